@@ -0,0 +1,235 @@
+# -*- encoding: utf-8 -*-
+
+'''
+Offline forced alignment
+离线字幕对齐：不依赖语音服务，直接分析 wav 音频的能量（NumPy 向量化计算，长音频使用内存映射分块读取），
+找出有声音的区间和停顿，把语音文本按句子分配到这些区间上，生成带时间轴的字幕
+
+适用于不是由本程序语音合成生成的音频（录制的配音、已有的 wav 文件等），没有合成时的词边界时间
+
+site: github.com/heiyeluren
+
+调用示例：
+align_segments_to_srt(["input/audio/01.wav", "input/audio/02.wav"], ["input/voice_text_01.txt", "input/voice_text_02.txt"], "input/srt/base.srt")
+
+命令行：
+python -m VideoMake.align --wav input/audio/01.wav --text input/voice_text_01.txt --output 01.srt
+
+'''
+
+import re
+import numpy as np
+
+from .media import probe_wav
+from .subtitle import estimate_sentence_timings, timings_to_cues, write_srt_file, SUBTITLE_MAX_CHARS
+
+
+# 能量分析的帧长（秒）
+ALIGN_FRAME_SECONDS = 0.02
+
+# 每次读取的最大采样数（限制内存占用，约16MB的float32）
+ALIGN_BLOCK_SAMPLES = 1 << 22
+
+# 停顿最短时长（秒），更短的静音不作为句子分界
+ALIGN_MIN_SILENCE = 0.25
+
+# 有声区间最短时长（秒），更短的视为噪声
+ALIGN_MIN_SPEECH = 0.08
+
+# wav 格式 -> NumPy 数据类型和归一化系数：(format_tag, 采样字节数) -> (dtype, 零点, 满幅)
+WAV_SAMPLE_TYPES = {
+    (1, 1): ('u1', 128.0, 128.0),
+    (1, 2): ('<i2', 0.0, 32768.0),
+    (1, 4): ('<i4', 0.0, 2147483648.0),
+    (3, 4): ('<f4', 0.0, 1.0),
+    (3, 8): ('<f8', 0.0, 1.0),
+}
+
+
+# 读取 wav 文件头，检查采样格式
+def get_wav_info(wav_file: str) -> dict:
+    info = probe_wav(wav_file)
+    key = (info["format_tag"], info["sample_width"])
+    if key not in WAV_SAMPLE_TYPES:
+        raise Exception("Unsupported wav sample format (format {}, {} bytes), please convert to 16bit pcm: {}".format(key[0], key[1], wav_file))
+    return info
+
+
+# 以内存映射方式读取一段采样（按声道交错排列），用完后映射随数组释放，不会把整个文件留在内存中
+def read_wav_samples(wav_file: str, info: dict, start: int, count: int) -> np.ndarray:
+    dtype = np.dtype(WAV_SAMPLE_TYPES[(info["format_tag"], info["sample_width"])][0])
+    if count <= 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(wav_file, dtype=dtype, mode='r', offset=info["data_offset"] + start * dtype.itemsize, shape=(count,))
+
+
+# 计算每一帧的能量（dB），按块处理，内存占用和音频长度无关
+def get_frame_energy(wav_file: str, info: dict, frame_seconds: float = ALIGN_FRAME_SECONDS) -> np.ndarray:
+    _, zero, full_scale = WAV_SAMPLE_TYPES[(info["format_tag"], info["sample_width"])]
+    frame_len = max(1, int(round(info["sample_rate"] * frame_seconds)))
+    frame_samples = frame_len * info["channels"]
+    frames = info["frames"] // frame_len
+    block_frames = max(1, ALIGN_BLOCK_SAMPLES // frame_samples)
+
+    energy = np.empty(frames, dtype=np.float32)
+    for start in range(0, frames, block_frames):
+        end = min(frames, start + block_frames)
+        samples = read_wav_samples(wav_file, info, start * frame_samples, (end - start) * frame_samples)
+        block = np.asarray(samples, dtype=np.float32).reshape(end - start, frame_samples)
+        del samples
+        if zero != 0:
+            block -= zero
+        energy[start:end] = np.sqrt(np.mean(np.square(block), axis=1)) / full_scale
+    return 20 * np.log10(np.maximum(energy, 1e-10))
+
+
+# 根据帧能量找出有声音的区间
+def detect_speech_regions(energy_db: np.ndarray, frame_seconds: float = ALIGN_FRAME_SECONDS, threshold_db: float = None,
+                          min_silence: float = ALIGN_MIN_SILENCE, min_speech: float = ALIGN_MIN_SPEECH) -> np.ndarray:
+    """
+    参数：
+    energy_db：np.ndarray，每一帧的能量（dB）
+    threshold_db：float，有声音的能量阈值，None表示按底噪和峰值自动计算
+
+    返回值：
+    np.ndarray，形状为 (区间数, 2)，每一行是一个有声区间的 [开始秒数, 结束秒数]
+    """
+    if len(energy_db) == 0:
+        return np.zeros((0, 2))
+    if threshold_db is None:
+        floor = np.percentile(energy_db, 10)
+        peak = np.percentile(energy_db, 95)
+        # 几乎没有起伏：整段是声音或者整段是静音
+        if peak - floor < 6:
+            if peak < -60:
+                return np.zeros((0, 2))
+            return np.array([[0.0, len(energy_db) * frame_seconds]])
+        threshold_db = floor + (peak - floor) * 0.3
+
+    mask = np.concatenate(([0], (energy_db > threshold_db).astype(np.int8), [0]))
+    edges = np.diff(mask)
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    if len(starts) == 0:
+        return np.zeros((0, 2))
+
+    # 合并间隔太短的区间（句内停顿）
+    keep = (starts[1:] - ends[:-1]) >= int(round(min_silence / frame_seconds))
+    starts = np.concatenate((starts[:1], starts[1:][keep]))
+    ends = np.concatenate((ends[:-1][keep], ends[-1:]))
+
+    # 去掉太短的区间（噪声）
+    keep = (ends - starts) >= int(round(min_speech / frame_seconds))
+    return np.stack((starts[keep], ends[keep]), axis=1) * frame_seconds
+
+
+# 句子中实际发音的字符数（不计标点和空白）
+def count_spoken_chars(sentence: str) -> int:
+    return len(re.sub(r'[\s\W_]+', '', sentence))
+
+
+# 把句子分配到有声区间上
+def align_sentences(sentences: list, regions: np.ndarray, duration: float, max_snap: float = None) -> list:
+    """
+    按每个句子的字数比例在有声区间的总时长上划分句子分界，再把每个分界移动到附近的停顿处
+
+    参数：
+    sentences：list，句子文本
+    regions：np.ndarray，detect_speech_regions 的结果
+    duration：float，音频总时长
+    max_snap：float，分界最多移动的秒数，None表示按平均句子时长自动计算
+
+    返回值：
+    list，句子时间列表（格式同 subtitle 时间文件中的 sentences）
+    """
+    if len(sentences) == 0:
+        return []
+    if len(regions) == 0:
+        return estimate_sentence_timings(sentences, duration)
+
+    weights = np.array([max(1, count_spoken_chars(s)) for s in sentences], dtype=np.float64)
+    region_lens = regions[:, 1] - regions[:, 0]
+    cum_speech = np.concatenate(([0.0], np.cumsum(region_lens)))
+    total_speech = cum_speech[-1]
+
+    # 句子分界在有声时间上的位置 -> 实际时间
+    targets = np.cumsum(weights)[:-1] / weights.sum() * total_speech
+    index = np.clip(np.searchsorted(cum_speech, targets, side='right') - 1, 0, len(regions) - 1)
+    walls = regions[index, 0] + (targets - cum_speech[index])
+
+    # 停顿（相邻有声区间之间）
+    gap_starts = regions[:-1, 1]
+    gap_ends = regions[1:, 0]
+    gap_mids = (gap_starts + gap_ends) / 2
+    if max_snap is None:
+        max_snap = max(1.0, total_speech / len(sentences) / 2)
+
+    # 每个分界移动到最近的、还没有被使用的停顿（分界顺序不变）
+    bounds = []
+    last_gap = -1
+    for wall in walls:
+        j = int(np.searchsorted(gap_mids, wall))
+        candidates = [g for g in (j - 1, j) if last_gap < g < len(gap_mids)]
+        best = min(candidates, key=lambda g: abs(gap_mids[g] - wall)) if candidates else None
+        if best is not None and abs(gap_mids[best] - wall) <= max_snap:
+            bounds.append((gap_starts[best], gap_ends[best]))
+            last_gap = best
+        else:
+            bounds.append((wall, wall))
+
+    result = []
+    start = regions[0, 0]
+    for i, sentence in enumerate(sentences):
+        end = bounds[i][0] if i < len(bounds) else regions[-1, 1]
+        result.append({"text": sentence, "start": round(float(start), 3), "end": round(float(max(end, start)), 3), "words": []})
+        if i < len(bounds):
+            start = bounds[i][1]
+    return result
+
+
+# 对齐一个音频文件和它的语音文本
+def align_text_to_audio(wav_file: str, text: str, threshold_db: float = None) -> tuple:
+    """
+    返回值：
+    tuple，(音频时长, 句子时间列表)
+    """
+    from .audio import split_sentences
+
+    info = get_wav_info(wav_file)
+    energy_db = get_frame_energy(wav_file, info)
+    regions = detect_speech_regions(energy_db, threshold_db=threshold_db)
+    return info["duration"], align_sentences(split_sentences(text), regions, info["duration"])
+
+
+# 多个分段音频和语音文本对齐，生成 srt 字幕
+def align_segments_to_srt(wav_files: list, text_files: list, srt_file_path: str, max_chars: int = SUBTITLE_MAX_CHARS) -> list:
+    """
+    参数：
+    wav_files：list，按播放顺序排列的分段 wav 文件
+    text_files：list，和 wav_files 对应的语音文本文件
+    srt_file_path：str，输出的 srt 文件
+
+    返回值：
+    list，字幕列表 [(开始秒数, 结束秒数, 文本), ...]
+    """
+    segments = []
+    for wav_file, text_file in zip(wav_files, text_files):
+        with open(text_file, 'r', encoding='utf-8', errors='ignore') as f:
+            text = f.read()
+        segments.append(align_text_to_audio(wav_file, text))
+    cues = timings_to_cues(segments, max_chars)
+    write_srt_file(cues, srt_file_path)
+    return cues
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Align voice text to a wav file and write srt subtitles")
+    parser.add_argument("--wav", required=True, nargs="+", help="wav files in playing order")
+    parser.add_argument("--text", required=True, nargs="+", help="voice text files, one for each wav file")
+    parser.add_argument("--output", required=True, help="output srt file")
+    args = parser.parse_args()
+    if len(args.wav) != len(args.text):
+        raise Exception("--wav and --text must have the same number of files")
+    cues = align_segments_to_srt(args.wav, args.text, args.output)
+    print("{} cues written to {}".format(len(cues), args.output))
@@ -11,18 +11,368 @@ site: github.com/heiyeluren
 '''
 
 import os
+import re
+import json
+import wave
+import bisect
+import struct
+import threading
 import subprocess
-import azure.cognitiveservices.speech as speechsdk
 
 from . import defined
 from .defined import *
 from . import util
 from .util import *
+from .cache import FileCache, hash_key
+from .media import get_media_duration, probe_wav
+from .ffmpeg import run_ffmpeg
+from .deps import lazy_import
+from .trace import span
 
+# Azure Speech SDK 第一次使用时才加载（只画图、编码的运行不需要加载原生库）
+speechsdk = lazy_import("azure.cognitiveservices.speech")
+from .subtitle import get_timing_file_path, save_timing_file, assign_words_to_sentences
+
+
+# 句子缓存使用的合成输出格式（原始PCM，便于逐句无缝拼接）
+TTS_CACHE_OUTPUT_FORMAT     = "Raw24Khz16BitMonoPcm"
+TTS_CACHE_SAMPLE_RATE       = 24000
+TTS_CACHE_SAMPLE_WIDTH      = 2
+TTS_CACHE_CHANNELS          = 1
+
+# 连续多个没有缓存的句子合并为一次请求合成（按词边界切回每个句子再分别缓存），一次请求的最大字数
+TTS_BATCH_MAX_CHARS         = 1000
+# 合并请求时句子之间的分隔符
+TTS_BATCH_SEPARATOR         = "\n"
+
+
+# 语音合成失败（服务返回 Canceled）
+class SpeechSynthesisError(Exception):
+    """
+    语音合成被取消或失败时抛出
+
+    属性：
+    reason：取消原因（speechsdk.CancellationReason）
+    error_code：错误码（speechsdk.CancellationErrorCode）
+    error_details：服务返回的错误详情
+    retryable：是否可以重试（限流、超时、连接失败等临时错误为True，鉴权失败、请求错误为False）
+    """
+    def __init__(self, message, reason=None, error_code=None, error_details='', retryable=True):
+        super().__init__(message)
+        self.reason = reason
+        self.error_code = error_code
+        self.error_details = error_details
+        self.retryable = retryable
+
+
+# 语音合成器池：合成器（和它的服务连接）在多次合成之间复用，不用每个文件重新创建
+class SynthesizerPool:
+    """
+    同一个 key（声音、语言）的合成器用完后放回池中，下次合成直接取出使用；合成失败的合成器不放回
+
+    调用示例：
+    pool = SynthesizerPool()
+    synthesize_text_to_voice("voice_text.txt", "output.wav", synthesizer_pool=pool)
+    """
+    def __init__(self):
+        self.idle = {}
+        self.lock = threading.Lock()
+
+    # 取一个合成器，返回 (合成器, 词边界列表)，池中没有时新建
+    def acquire(self, key, speech_config) -> tuple:
+        with self.lock:
+            items = self.idle.get(key)
+            if items:
+                return items.pop()
+        words = []
+        speech_synthesizer = speechsdk.SpeechSynthesizer(speech_config=speech_config, audio_config=None)
+        connect_word_boundary(speech_synthesizer, words)
+        return speech_synthesizer, words
+
+    # 放回合成器
+    def release(self, key, item: tuple):
+        with self.lock:
+            self.idle.setdefault(key, []).append(item)
+
+    # 释放所有空闲的合成器
+    def clear(self):
+        with self.lock:
+            self.idle = {}
+
+
+# 检查合成结果，被取消时抛出 SpeechSynthesisError
+def check_synthesis_result(speech_synthesis_result):
+    if speech_synthesis_result.reason != speechsdk.ResultReason.Canceled:
+        return
+    cancellation_details = speech_synthesis_result.cancellation_details
+    error_code = getattr(cancellation_details, 'error_code', None)
+    error_details = cancellation_details.error_details or ''
+    print("Speech synthesis canceled: {}".format(cancellation_details.reason))
+    if error_details:
+        print("Error details: {}".format(error_details))
+
+    # 鉴权失败和请求错误重试也没有用，其他（限流、超时、服务不可用等）都可以重试
+    retryable = error_code not in (speechsdk.CancellationErrorCode.AuthenticationFailure, speechsdk.CancellationErrorCode.Forbidden, speechsdk.CancellationErrorCode.BadRequest)
+    if not retryable:
+        print("Did you set the speech resource key and region values?")
+    raise SpeechSynthesisError("Speech synthesis canceled: {} {}".format(cancellation_details.reason, error_details),
+                               reason=cancellation_details.reason, error_code=error_code, error_details=error_details, retryable=retryable)
+
+
+# 文本按句子拆分（句末标点保留在句子中，换行也作为分隔）
+def split_sentences(text: str) -> list:
+    sentences = []
+    for line in text.splitlines():
+        for sentence in re.findall(r'[^。！？!?；;]+[。！？!?；;]*[”’"\'）)]*', line):
+            if sentence.strip() != '':
+                sentences.append(sentence.strip())
+    return sentences
+
+
+# 句子规范化（用于计算缓存key，空白差异不影响命中）
+def normalize_sentence(sentence: str) -> str:
+    return re.sub(r'\s+', ' ', sentence).strip()
+
+
+# 连接词边界事件，合成时把每个词的时间追加到 words 列表
+def connect_word_boundary(speech_synthesizer, words: list):
+    """
+    words 中每一项：{"text": 词, "start": 开始秒数, "end": 结束秒数, "text_offset": 词在合成文本中的字符位置}
+    """
+    punctuation_type = getattr(getattr(speechsdk, 'SpeechSynthesisBoundaryType', None), 'Punctuation', None)
+
+    def word_boundary_cb(evt):
+        if punctuation_type is not None and getattr(evt, 'boundary_type', None) == punctuation_type:
+            return
+        # audio_offset 的单位是 100 纳秒，duration 是 timedelta
+        start = evt.audio_offset / 10 ** 7
+        words.append({"text": evt.text, "start": round(start, 3), "end": round(start + evt.duration.total_seconds(), 3), "text_offset": evt.text_offset})
+
+    speech_synthesizer.synthesis_word_boundary.connect(word_boundary_cb)
+
+
+# 多段PCM数据按顺序写入wav文件（逐个采样拼接，不做任何重采样）
+def write_pcm_to_wav(pcm_list: list, output_wav_file: str, sample_rate: int = TTS_CACHE_SAMPLE_RATE, sample_width: int = TTS_CACHE_SAMPLE_WIDTH, channels: int = TTS_CACHE_CHANNELS):
+    with wave.open(output_wav_file, 'wb') as w:
+        w.setnchannels(channels)
+        w.setsampwidth(sample_width)
+        w.setframerate(sample_rate)
+        for pcm in pcm_list:
+            w.writeframes(pcm)
+
+
+# 从 src 文件的 offset 位置复制 count 字节追加到 dst 文件（支持时由内核直接复制，不经过用户空间）
+def copy_file_data(src, dst, offset: int, count: int, buffer_size: int = 1024 * 1024):
+    dst.flush()
+    if hasattr(os, 'sendfile'):
+        try:
+            while count > 0:
+                sent = os.sendfile(dst.fileno(), src.fileno(), offset, count)
+                if sent == 0:
+                    break
+                offset += sent
+                count -= sent
+            if count == 0:
+                return
+        except OSError:
+            # 文件系统不支持时改为普通读写（已经复制的部分不重复）
+            pass
+    src.seek(offset)
+    while count > 0:
+        data = src.read(min(buffer_size, count))
+        if not data:
+            break
+        dst.write(data)
+        count -= len(data)
+    if count > 0:
+        raise Exception("Unexpected end of file while copying audio data")
+
+
+# 多个wav文件直接拼接PCM数据为一个wav文件（不解码、不重新编码），返回每个文件在合并结果中的开始时间（秒）
+def concat_wav_files(wav_files: list, output_wav_file: str) -> list:
+    """
+    所有文件的采样率、声道数、采样位数必须一致（本程序合成的分段语音都是 24kHz 16bit 单声道）
+
+    调用示例：
+    offsets = concat_wav_files(["input/audio/01.wav", "input/audio/02.wav"], "input/audio/base.wav")
+    """
+    if len(wav_files) == 0:
+        raise Exception("wav_files is empty")
+    infos = [probe_wav(f) for f in wav_files]
+    first = infos[0]
+    for wav_file, info in zip(wav_files, infos):
+        for key in ("format_tag", "sample_rate", "channels", "sample_width"):
+            if info[key] != first[key]:
+                raise Exception("wav format mismatch ({}: {} != {}): {}".format(key, info[key], first[key], wav_file))
+    if first["format_tag"] not in (1, 3):
+        raise Exception("Only pcm wav files can be concatenated: {}".format(wav_files[0]))
+
+    block_align = first["channels"] * first["sample_width"]
+    data_size = sum([info["frames"] * block_align for info in infos])
+    if data_size + 36 > 0xFFFFFFFF:
+        raise Exception("Concatenated wav file is too large: {}".format(output_wav_file))
+
+    offsets = []
+    offset = 0.0
+    with open(output_wav_file, 'wb') as out:
+        out.write(b'RIFF' + struct.pack('<I', 36 + data_size) + b'WAVE')
+        out.write(b'fmt ' + struct.pack('<IHHIIHH', 16, first["format_tag"], first["channels"], first["sample_rate"],
+                                         first["sample_rate"] * block_align, block_align, first["sample_width"] * 8))
+        out.write(b'data' + struct.pack('<I', data_size))
+        for wav_file, info in zip(wav_files, infos):
+            offsets.append(offset)
+            with open(wav_file, 'rb') as src:
+                copy_file_data(src, out, info["data_offset"], info["frames"] * block_align)
+            offset += info["duration"]
+    return offsets
+
+
+# 一次请求合成连续的多个句子，按词边界把音频切回每个句子
+def synthesize_batch_pcm(speech_synthesizer, words: list, sentences: list, rate_limiter=None):
+    """
+    参数：
+    speech_synthesizer：合成器（输出格式为 TTS_CACHE_OUTPUT_FORMAT 原始PCM）
+    words：合成器连接的词边界列表（connect_word_boundary）
+    sentences：list，连续的句子
+
+    返回值：
+    list，[(句子PCM, 句子词边界), ...]，和 sentences 一一对应，词边界时间相对于句子开始；
+    有句子没有收到任何词边界（无法确定切分位置）时返回 None
+    """
+    text = TTS_BATCH_SEPARATOR.join(sentences)
+    starts = []
+    pos = 0
+    for sentence in sentences:
+        starts.append(pos)
+        pos += len(sentence) + len(TTS_BATCH_SEPARATOR)
+
+    if rate_limiter is not None:
+        with span("tts.rate_limit", "tts"):
+            rate_limiter.acquire(len(text))
+    del words[:]
+    with span("azure.speak_sentences", "tts", sentences=len(sentences), chars=len(text)):
+        speech_synthesis_result = speech_synthesizer.speak_text_async(text).get()
+    check_synthesis_result(speech_synthesis_result)
+    pcm = speech_synthesis_result.audio_data
+
+    # 词边界按字符位置分到各个句子
+    groups = [[] for _ in sentences]
+    for word in words:
+        index = max(0, bisect.bisect_right(starts, word.get("text_offset", 0)) - 1)
+        groups[index].append(word)
+    if len(sentences) > 1 and any(len(group) == 0 for group in groups):
+        return None
+
+    # 在相邻两句之间（前一句最后一个词结束和后一句第一个词开始）的中点切开，按采样对齐
+    frame_size = TTS_CACHE_SAMPLE_WIDTH * TTS_CACHE_CHANNELS
+    bytes_per_second = TTS_CACHE_SAMPLE_RATE * frame_size
+    cuts = [0]
+    for previous, following in zip(groups, groups[1:]):
+        seconds = (previous[-1]["end"] + following[0]["start"]) / 2
+        cuts.append(min(max(int(round(seconds * TTS_CACHE_SAMPLE_RATE)) * frame_size, cuts[-1]), len(pcm)))
+    cuts.append(len(pcm))
+
+    result = []
+    for i, group in enumerate(groups):
+        base = cuts[i] / bytes_per_second
+        sentence_words = [{"text": w["text"], "start": round(max(0.0, w["start"] - base), 3), "end": round(max(0.0, w["end"] - base), 3)} for w in group]
+        result.append((pcm[cuts[i]:cuts[i + 1]], sentence_words))
+    return result
+
+
+# 没有缓存的句子按连续段分组（每组字数不超过 TTS_BATCH_MAX_CHARS），返回 [[句子序号, ...], ...]
+def group_missing_sentences(sentences: list, missing: list) -> list:
+    groups = []
+    chars = 0
+    for index in missing:
+        length = len(sentences[index]) + len(TTS_BATCH_SEPARATOR)
+        if len(groups) > 0 and groups[-1][-1] == index - 1 and chars + length <= TTS_BATCH_MAX_CHARS:
+            groups[-1].append(index)
+            chars += length
+        else:
+            groups.append([index])
+            chars = length
+    return groups
+
+
+# 逐句合成（带句子缓存），返回每个句子的PCM数据和词边界
+def synthesize_sentences_pcm(sentences: list, speech_config, voice_name: str, voice_language: str, rate_limiter=None, cache: FileCache = None,
+                             synthesizer_pool: SynthesizerPool = None) -> tuple:
+    """
+    按句子合成语音，已经合成过的句子直接从缓存读取，只有新句子才会请求服务
+    连续的新句子合并为一次请求（请求数和限流等待按分段计算，而不是按句子），按词边界切回每个句子后分别缓存，
+    切分失败时这一组改为逐句请求
+    词边界（每个词在句子音频中的时间）和PCM一起缓存
+    synthesizer_pool 不为空时合成器从池中取出，合成成功后放回
+
+    缓存key：hash(规范化句子文本, 声音名称, 语言, 输出格式)
+
+    返回值：
+    tuple，(pcm_list, words_list)，都和 sentences 一一对应，words_list 中每一项是该句子的词边界列表
+    """
+    if cache is None:
+        cache = FileCache(get_tts_cache_dir_path(), TTS_CACHE_MAX_SIZE)
+
+    keys = [hash_key(normalize_sentence(sentence), voice_name, voice_language, TTS_CACHE_OUTPUT_FORMAT) for sentence in sentences]
+    pcm_list = [None] * len(sentences)
+    words_list = [[] for _ in sentences]
+    missing = []
+    for i, key in enumerate(keys):
+        pcm_list[i] = cache.get_bytes(key, ".pcm")
+        if pcm_list[i] is None:
+            missing.append(i)
+        else:
+            # 旧版本缓存没有词边界，只有句子时间
+            data = cache.get_bytes(key, ".json")
+            words_list[i] = json.loads(data.decode('utf-8')) if data is not None else []
+    if len(missing) == 0:
+        return pcm_list, words_list
+
+    # 只有缓存没有命中时才创建合成器、请求服务
+    if synthesizer_pool is not None:
+        speech_synthesizer, words = synthesizer_pool.acquire((voice_name, voice_language), speech_config)
+    else:
+        words = []
+        speech_synthesizer = speechsdk.SpeechSynthesizer(speech_config=speech_config, audio_config=None)
+        connect_word_boundary(speech_synthesizer, words)
+
+    for group in group_missing_sentences(sentences, missing):
+        results = synthesize_batch_pcm(speech_synthesizer, words, [sentences[i] for i in group], rate_limiter)
+        if results is None:
+            # 有句子没有词边界（无法确定切分位置），这一组逐句请求
+            results = [synthesize_batch_pcm(speech_synthesizer, words, [sentences[i]], rate_limiter)[0] for i in group]
+        for i, (pcm, sentence_words) in zip(group, results):
+            cache.put_bytes(keys[i], ".json", json.dumps(sentence_words, ensure_ascii=False).encode('utf-8'))
+            cache.put_bytes(keys[i], ".pcm", pcm)
+            pcm_list[i] = pcm
+            words_list[i] = sentence_words
+
+    if synthesizer_pool is not None:
+        synthesizer_pool.release((voice_name, voice_language), (speech_synthesizer, words))
+    # 有新写入的句子时检查缓存容量
+    cache.evict()
+    return pcm_list, words_list
+
+
+# 逐句合成结果的句子时间（每个句子的时间由前面句子PCM的长度累加得到）
+def get_sentence_timings(sentences: list, pcm_list: list, words_list: list) -> list:
+    bytes_per_second = TTS_CACHE_SAMPLE_RATE * TTS_CACHE_SAMPLE_WIDTH * TTS_CACHE_CHANNELS
+    result = []
+    offset = 0.0
+    for sentence, pcm, words in zip(sentences, pcm_list, words_list):
+        duration = len(pcm) / bytes_per_second
+        result.append({
+            "text": sentence,
+            "start": round(offset, 3),
+            "end": round(offset + duration, 3),
+            "words": [{"text": w["text"], "start": round(offset + w["start"], 3), "end": round(offset + w["end"], 3)} for w in words],
+        })
+        offset += duration
+    return result
 
 
 # 文本转语音
-def synthesize_text_to_voice(input_text_file: str, output_wav_file: str, is_output_mp3: bool = False, output_mp3_file: str = "", is_play: bool = False, voice_name: str='zh-CN-YunzeNeural', subscription: str='', region: str='', ) -> None:
+def synthesize_text_to_voice(input_text_file: str, output_wav_file: str, is_output_mp3: bool = False, output_mp3_file: str = "", is_play: bool = False, voice_name: str='zh-CN-YunzeNeural', subscription: str='', region: str='', use_cache: bool = True, rate_limiter=None, timing_file: str = '', synthesizer_pool: SynthesizerPool = None) -> None:
     """
     将文本合成为语音，并保存为.wav文件，可选择转换为.mp3文件，并可选择是否播放
 
@@ -35,6 +385,10 @@ def synthesize_text_to_voice(input_text_file: str, output_wav_file: str, is_outp
     is_output_mp3：是否同时输出为.mp3文件，默认为False
     output_mp3_file：输出.mp3文件的路径（仅当is_output_mp3为True时有用）
     is_play_mp3：是否播放生成的.mp3文件，默认为False
+    use_cache：是否使用句子缓存（按句子合成，没有变化的句子不会重新请求服务），默认为True
+    rate_limiter：限流器（scheduler.RateLimiter），每次请求服务前调用 acquire
+    timing_file：句子和词的时间文件（用于生成字幕），默认和 output_wav_file 同名的 .timing.json，None 表示不保存
+    synthesizer_pool：合成器池（SynthesizerPool），逐句合成时复用合成器
 
     返回值：
     无返回值
@@ -63,33 +417,49 @@ def synthesize_text_to_voice(input_text_file: str, output_wav_file: str, is_outp
     speech_config = speechsdk.SpeechConfig(subscription=subscription, region=region)
     speech_config.speech_synthesis_language = voice_language
     speech_config.speech_synthesis_voice_name = voice_name
-    audio_config = speechsdk.audio.AudioOutputConfig(use_default_speaker=True, filename=output_wav_file)
-    speech_synthesizer = speechsdk.SpeechSynthesizer(speech_config=speech_config, audio_config=audio_config)
 
     with open(input_text_file, 'r', encoding='utf-8', errors='ignore') as f:
         text = f.read()
     if text == '':
         raise Exception("input_text_file is empty")
 
-    # 进行tts流读取
-    speech_synthesis_result = speech_synthesizer.speak_text_async(text).get()
-    stream = speechsdk.AudioDataStream(speech_synthesis_result)
-
-    # 保存tts返回内容为wav文件
-    ret = stream.save_to_wav_file(output_wav_file)
-    if ret is False:
-        print("Error: Text to speech is fail, wav file:", output_wav_file)
-        raise Exception("Text to speech is fail.")
-
-    if speech_synthesis_result.reason == speechsdk.ResultReason.SynthesizingAudioCompleted:
-        print("Speech synthesized for text [{}]\n".format(text))
-    elif speech_synthesis_result.reason == speechsdk.ResultReason.Canceled:
-        cancellation_details = speech_synthesis_result.cancellation_details
-        print("Speech synthesis canceled: {}".format(cancellation_details.reason))
-        if cancellation_details.reason == speechsdk.CancellationReason.Error:
-            if cancellation_details.error_details:
-                print("Error details: {}".format(cancellation_details.error_details))
-                print("Did you set the speech resource key and region values?")
+    if use_cache:
+        # 逐句合成（命中缓存的句子不请求服务），PCM按顺序拼接写入wav
+        speech_config.set_speech_synthesis_output_format(getattr(speechsdk.SpeechSynthesisOutputFormat, TTS_CACHE_OUTPUT_FORMAT))
+        sentences = split_sentences(text)
+        pcm_list, words_list = synthesize_sentences_pcm(sentences, speech_config, voice_name, voice_language, rate_limiter, synthesizer_pool=synthesizer_pool)
+        write_pcm_to_wav(pcm_list, output_wav_file)
+        sentence_timings = get_sentence_timings(sentences, pcm_list, words_list)
+    else:
+        audio_config = speechsdk.audio.AudioOutputConfig(use_default_speaker=True, filename=output_wav_file)
+        speech_synthesizer = speechsdk.SpeechSynthesizer(speech_config=speech_config, audio_config=audio_config)
+        words = []
+        connect_word_boundary(speech_synthesizer, words)
+
+        # 进行tts流读取（被取消时抛出 SpeechSynthesisError，由调用方决定是否重试）
+        if rate_limiter is not None:
+            with span("tts.rate_limit", "tts"):
+                rate_limiter.acquire(len(text))
+        with span("azure.speak_text", "tts", chars=len(text)):
+            speech_synthesis_result = speech_synthesizer.speak_text_async(text).get()
+        check_synthesis_result(speech_synthesis_result)
+        stream = speechsdk.AudioDataStream(speech_synthesis_result)
+
+        # 保存tts返回内容为wav文件
+        ret = stream.save_to_wav_file(output_wav_file)
+        if ret is False:
+            print("Error: Text to speech is fail, wav file:", output_wav_file)
+            raise Exception("Text to speech is fail.")
+        sentence_timings = assign_words_to_sentences(text, split_sentences(text), words, get_media_duration(output_wav_file))
+
+    # 保存句子和词的时间（生成字幕使用）
+    if timing_file is not None:
+        if timing_file == '':
+            timing_file = get_timing_file_path(output_wav_file)
+        duration = sentence_timings[-1]["end"] if len(sentence_timings) > 0 else 0
+        save_timing_file(timing_file, sentence_timings, duration)
+
+    print("Speech synthesized for text [{}]\n".format(text))
 
     # 转换音频文件格式为mp3
     if is_output_mp3 and output_mp3_file=="":
@@ -99,7 +469,7 @@ def synthesize_text_to_voice(input_text_file: str, output_wav_file: str, is_outp
             output_mp3_file = os.path.splitext(output_wav_file)[0] + ".mp3"
         if ffmpeg_is_installed() == False:
             raise Exception("ffmpeg is not installed, please from https://github.com/BtbN/FFmpeg-Builds/releases download ffmpeg and install it")
-        subprocess.call(['ffmpeg', '-y', '-i', output_wav_file, '-b:a', '192k', output_mp3_file])
+        run_ffmpeg(['-y', '-i', output_wav_file, '-b:a', '192k', output_mp3_file])
 
     # 播放返回的音频内容
     if is_play:
@@ -128,6 +498,6 @@ def merge_audio_files(audio_list, output_path: str, output_file_name = 'final.wa
     # 使用ffmpeg把多个音频文件进行合并
     output_file = output_path + "/" + output_file_name
     output_file = output_file.replace("\\", "/")
-    subprocess.call(f'ffmpeg -f concat -safe 0 -i {list_file} -c copy {output_file}', shell=True)
+    run_ffmpeg(['-y', '-f', 'concat', '-safe', '0', '-i', list_file, '-c', 'copy', output_file])
     # ffmpeg -f concat -safe 0 -i filelist.txt -c copy output.wav
 
@@ -0,0 +1,370 @@
+# -*- encoding: utf-8 -*-
+
+'''
+Offline benchmark
+离线性能测试：生成指定规模的模拟项目（背景图、文本、正弦波/噪声音频），逐个步骤运行并记录
+耗时、CPU时间、峰值内存、写入字节数，结果输出为 JSON，可以在不同提交之间对比
+
+语音合成、语音识别使用本地模拟的 Speech SDK（fakesdk），不需要网络
+
+site: github.com/heiyeluren
+
+命令行：
+python -m VideoMake.bench --segments 20 --duration 30 --output bench.json
+
+冒烟测试（小项目跑一遍语音合成、语音识别等步骤，任意步骤失败时退出码为1）：
+python -m VideoMake.bench --segments 2 --duration 2 --stages tts,merge_videos,stt,stt_parallel,stt_stream --check
+
+'''
+
+import os
+import sys
+import json
+import time
+import queue
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+import multiprocessing
+
+try:
+    import resource  # 只有 Linux / macOS 有
+except ImportError:
+    resource = None
+
+from PIL import Image, ImageDraw
+
+from . import defined
+from .defined import *
+
+
+# 所有测试步骤（按顺序执行）
+BENCH_STAGES = ["check_input_files", "tts", "slides", "segments", "merge_videos", "subtitle", "align", "stt", "stt_parallel", "stt_stream", "merge_video_srt", "final_single"]
+
+# 旧的逐帧图片方式（make_img_from_audio + images_to_video），--legacy 时加入测试
+BENCH_LEGACY_STAGES = ["legacy_segments"]
+
+# 模拟文本使用的字符
+SAMPLE_TEXT = "黑夜路人视频制作工具可以根据输入的文本内容自动生成语音图片和视频"
+
+# 常见字体目录（非 Windows 系统默认字体文件不存在时查找替代字体）
+FONT_DIRS = ["/usr/share/fonts", "/usr/local/share/fonts", "/System/Library/Fonts", "/Library/Fonts", "C:/Windows/Fonts"]
+
+
+# 查找可用字体
+def find_font_file(font_file: str = '') -> str:
+    if font_file and os.path.exists(font_file):
+        return font_file
+    if os.path.exists(BOLD_FONT_FILE):
+        return BOLD_FONT_FILE
+    for font_dir in FONT_DIRS:
+        for root, _, files in os.walk(font_dir):
+            for name in sorted(files):
+                if name.lower().endswith((".ttf", ".ttc", ".otf")):
+                    return os.path.join(root, name).replace("\\", "/")
+    raise Exception("No font file found, please set --font")
+
+
+# 生成模拟项目
+def make_project(root_path: str, segments: int, duration: float, size=(1920, 1080)):
+    """
+    在 root_path 下生成模拟项目：
+    input/video_bg_XX.png、input/video_text_XX.txt、input/voice_text_XX.txt、
+    input/audio/XX.wav（正弦波+噪声，代替语音合成结果）、input/srt/final.srt（每个分段一条字幕）
+    """
+    from .fakesdk import make_pcm, SECONDS_PER_CHAR
+    from .audio import write_pcm_to_wav
+    from .subtitle import write_srt_file
+
+    defined.set_root_path(root_path, os.path.join(root_path, "cache"))
+    os.makedirs(defined.INPUT_AUDIO_ROOT_PATH, exist_ok=True)
+    os.makedirs(defined.INPUT_SRT_ROOT_PATH, exist_ok=True)
+    os.makedirs(defined.OUTPUT_ROOT_PATH, exist_ok=True)
+
+    digits = max(2, len(str(segments)))
+    cues = []
+    for i in range(1, segments + 1):
+        num = str(i).zfill(digits)
+
+        # 背景图：纯色 + 几个色块
+        im = Image.new("RGB", size, (230, 230 - i % 50, 220))
+        draw = ImageDraw.Draw(im)
+        for k in range(4):
+            draw.rectangle([k * size[0] // 4, size[1] - 80, (k + 1) * size[0] // 4 - 10, size[1] - 20], fill=(40 * k, 120, 200 - 30 * k))
+        im.save(defined.INPUT_ROOT_PATH + VIDEO_BG_PREFIX + num + PNG_SUFFIX)
+
+        # 显示文本：标题 + 几行内容
+        lines = ["第{}部分".format(i)] + [SAMPLE_TEXT[k:] + SAMPLE_TEXT[:k] for k in range(0, 20, 5)]
+        with open(defined.INPUT_ROOT_PATH + VIDEO_TEXT_PREFIX + num + TEXT_SUFFIX, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines))
+
+        # 语音文本：按语速估算，文本长度对应 duration 秒
+        chars = max(1, int(duration / SECONDS_PER_CHAR))
+        sentence = SAMPLE_TEXT + "。"
+        text = (sentence * (chars // len(sentence) + 1))[:chars]
+        with open(defined.INPUT_ROOT_PATH + VOICE_TEXT_PREFIX + num + TEXT_SUFFIX, "w", encoding="utf-8") as f:
+            f.write(text)
+
+        # 音频
+        write_pcm_to_wav([make_pcm(duration, seed=i)], defined.INPUT_AUDIO_ROOT_PATH + num + WAV_SUFFIX)
+
+        cues.append(((i - 1) * duration, i * duration, lines[0]))
+
+    write_srt_file(cues, defined.INPUT_SRT_ROOT_PATH + FINAL_VIDEO_NAME + SRT_SUFFIX)
+
+
+# 目录中所有文件的 大小/修改时间 快照
+def snapshot_files(root_path: str) -> dict:
+    result = {}
+    for root, _, files in os.walk(root_path):
+        for name in files:
+            path = os.path.join(root, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            result[path] = (st.st_size, st.st_mtime_ns)
+    return result
+
+
+# 两次快照之间新增或修改的文件大小总和
+def get_bytes_written(before: dict, after: dict) -> int:
+    return sum(size for path, (size, mtime) in after.items() if before.get(path) != (size, mtime))
+
+
+# 运行一个测试步骤
+def run_stage(stage: str, root_path: str, options: dict):
+    from . import util
+    from . import fakesdk
+    from .img import draw_first_page, draw_contents_page, draw_end_page
+    from .video import images_to_video, make_img_from_audio, merge_videos, merge_video_srt, make_final_video, get_segment_threads
+    from .scheduler import synthesize_batch
+    from .voice import SpeechToText
+    from .subtitle import build_srt_from_timings
+    from .align import align_segments_to_srt
+    from concurrent.futures import ThreadPoolExecutor
+
+    defined.set_root_path(root_path, os.path.join(root_path, "cache"))
+    fakesdk.install()
+    fakesdk.REQUEST_LATENCY = options["latency"]
+
+    dnames = util.check_input_files()
+    nums = sorted(dnames, key=int)
+    jobs = options["jobs"]
+    font_file = options["font"]
+    base_video_file = util.get_output_video_file_path("base")
+
+    if stage == "check_input_files":
+        # 一次完整扫描（校验、计算哈希），之后读取项目清单
+        util.check_input_files(rescan=True)
+        for _ in range(10):
+            util.check_input_files()
+
+    elif stage == "tts":
+        tts_dir = os.path.join(root_path, "bench_tts")
+        os.makedirs(tts_dir, exist_ok=True)
+        tasks = [dict(input_text_file=util.get_input_text_file_path(dnames[num][VOICE_TEXT_FILE]),
+                      output_wav_file=os.path.join(tts_dir, num + WAV_SUFFIX)) for num in nums]
+        synthesize_batch(tasks, workers=options["tts_workers"], requests_per_second=0)
+
+    elif stage == "slides":
+        for num in nums:
+            bg_img_file = util.get_input_text_file_path(dnames[num][VIDEO_BG_FILE])
+            text_file = util.get_input_text_file_path(dnames[num][VIDEO_TEXT_FILE])
+            output_img_file = util.get_output_img_file_path(num)
+            if int(num) == 1:
+                draw_first_page(text_file, output_img_file, bg_img_file, normal_font_file=font_file, bold_font_file=font_file)
+            elif int(num) == len(nums):
+                draw_end_page(text_file, output_img_file, bg_img_file, normal_font_file=font_file, bold_font_file=font_file)
+            else:
+                draw_contents_page(text_file, output_img_file, bg_img_file, normal_font_file=font_file, bold_font_file=font_file)
+
+    elif stage == "segments":
+        threads = get_segment_threads(jobs)
+        def render(num):
+            images_to_video(util.get_output_img_file_path(num), util.get_input_video_file_path(num), util.get_output_wav_file_path(num),
+                            1, is_still_image=True, threads=threads, profile=options["profile"])
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            list(executor.map(render, nums))
+
+    elif stage == "legacy_segments":
+        for num in nums:
+            img_dir = util.get_batch_img_dir_path(num)
+            make_img_from_audio(util.get_output_wav_file_path(num), util.get_output_img_file_path(num), img_dir, 1)
+            images_to_video(img_dir, util.get_input_video_file_path(num), util.get_output_wav_file_path(num), 1, profile=options["profile"])
+
+    elif stage == "merge_videos":
+        merge_videos([util.get_input_video_file_path(num) for num in nums], base_video_file, util.get_input_video_list_file_path())
+
+    elif stage == "stt":
+        # 分段音频的PCM数据直接拼接为识别输入（不解码视频）
+        stt = SpeechToText("", "", "", util.get_input_srt_audio_file_path("base"), util.get_input_srt_file_path("base"),
+                           segment_audio_files=[util.get_output_wav_file_path(num) for num in nums])
+        stt.recognize_and_save_as_srt()
+
+    elif stage == "subtitle":
+        # 使用 tts 步骤合成的语音和时间文件
+        tts_dir = os.path.join(root_path, "bench_tts")
+        build_srt_from_timings([os.path.join(tts_dir, num + WAV_SUFFIX) for num in nums], util.get_input_srt_file_path("tts"),
+                               [util.get_input_text_file_path(dnames[num][VOICE_TEXT_FILE]) for num in nums])
+
+    elif stage == "align":
+        align_segments_to_srt([util.get_output_wav_file_path(num) for num in nums],
+                              [util.get_input_text_file_path(dnames[num][VOICE_TEXT_FILE]) for num in nums], util.get_input_srt_file_path("align"))
+
+    elif stage == "stt_parallel":
+        stt = SpeechToText("", "", "", srt_file_path=util.get_input_srt_file_path("base_parallel"))
+        stt.recognize_files_and_save_as_srt([util.get_output_wav_file_path(num) for num in nums], options["tts_workers"])
+
+    elif stage == "stt_stream":
+        stt = SpeechToText("", "", base_video_file, audio_file_path=util.get_input_srt_audio_file_path("base_stream"),
+                           srt_file_path=util.get_input_srt_file_path("base_stream"))
+        stt.recognize_stream_and_save_as_srt()
+
+    elif stage == "merge_video_srt":
+        merge_video_srt(base_video_file, util.get_input_srt_file_path(FINAL_VIDEO_NAME), util.get_output_video_file_path(FINAL_VIDEO_NAME))
+
+    elif stage == "final_single":
+        make_final_video([util.get_input_video_file_path(num) for num in nums], util.get_input_srt_file_path(FINAL_VIDEO_NAME),
+                         util.get_output_video_file_path("final_single"), util.get_input_video_list_file_path(), profile=options["profile"])
+
+    else:
+        raise Exception("Unknown bench stage: {}".format(stage))
+
+
+# 子进程中运行一个步骤并统计资源占用
+def _stage_worker(stage: str, root_path: str, options: dict, result_queue):
+    result = {"name": stage, "ok": True, "error": ""}
+    before = snapshot_files(root_path)
+    children_start = resource.getrusage(resource.RUSAGE_CHILDREN) if resource else None
+    cpu_start = time.process_time()
+    start = time.perf_counter()
+    try:
+        run_stage(stage, root_path, options)
+    except Exception as e:
+        result["ok"] = False
+        result["error"] = "{}: {}".format(type(e).__name__, e)
+    result["wall_seconds"] = round(time.perf_counter() - start, 4)
+    result["cpu_seconds"] = round(time.process_time() - cpu_start, 4)
+    if resource is not None:
+        children_end = resource.getrusage(resource.RUSAGE_CHILDREN)
+        result["children_cpu_seconds"] = round((children_end.ru_utime + children_end.ru_stime) - (children_start.ru_utime + children_start.ru_stime), 4)
+        # ru_maxrss：Linux 单位为KB，macOS 单位为字节
+        scale = 1024 if sys.platform == "darwin" else 1
+        result["peak_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // scale
+        result["children_peak_rss_kb"] = children_end.ru_maxrss // scale
+    else:
+        result["children_cpu_seconds"] = None
+        result["peak_rss_kb"] = None
+        result["children_peak_rss_kb"] = None
+    result["bytes_written"] = get_bytes_written(before, snapshot_files(root_path))
+    result_queue.put(result)
+
+
+# 运行全部测试
+def run_bench(segments: int = 10, duration: float = 20, stages: list = None, jobs: int = 0, tts_workers: int = 4, latency: float = 0.0,
+              profile: str = None, font_file: str = '', work_dir: str = None, keep: bool = False) -> dict:
+    """
+    生成模拟项目并逐个步骤运行，每个步骤在独立子进程中执行，峰值内存互不影响
+
+    返回值：
+    dict，{"meta": 测试环境和参数, "stages": 每个步骤的统计结果}
+    """
+    if stages is None:
+        stages = BENCH_STAGES
+    if jobs <= 0:
+        jobs = os.cpu_count() or 1
+    root_path = tempfile.mkdtemp(prefix="bvm-bench-", dir=work_dir)
+    options = {"jobs": jobs, "tts_workers": tts_workers, "latency": latency, "profile": profile, "font": find_font_file(font_file)}
+
+    start = time.perf_counter()
+    make_project(root_path, segments, duration)
+    setup_seconds = time.perf_counter() - start
+
+    ctx = multiprocessing.get_context("spawn")
+    results = []
+    try:
+        for stage in stages:
+            result_queue = ctx.Queue()
+            proc = ctx.Process(target=_stage_worker, args=(stage, root_path, options, result_queue))
+            proc.start()
+            while True:
+                try:
+                    result = result_queue.get(timeout=1)
+                    break
+                except queue.Empty:
+                    # 子进程异常退出（没有返回结果）时不再等待
+                    if not proc.is_alive() and result_queue.empty():
+                        result = {"name": stage, "ok": False, "error": "stage process exited with code {}".format(proc.exitcode)}
+                        break
+            proc.join()
+            print("{name}: {wall_seconds}s ok={ok} {error}".format(**result))
+            results.append(result)
+    finally:
+        if not keep:
+            shutil.rmtree(root_path, ignore_errors=True)
+
+    return {
+        "meta": {
+            "commit": get_git_commit(),
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "segments": segments,
+            "duration": duration,
+            "jobs": jobs,
+            "tts_workers": tts_workers,
+            "latency": latency,
+            "profile": profile,
+            "setup_seconds": round(setup_seconds, 4),
+            "work_dir": root_path if keep else '',
+        },
+        "stages": results,
+    }
+
+
+# 当前代码的 git 提交号（用于对比不同提交的测试结果）
+def get_git_commit() -> str:
+    try:
+        output = subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.DEVNULL)
+        return output.decode("utf-8").strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline benchmark with synthetic projects")
+    parser.add_argument("--segments", type=int, default=10, help="number of segments")
+    parser.add_argument("--duration", type=float, default=20, help="audio duration of each segment in seconds")
+    parser.add_argument("--stages", default=",".join(BENCH_STAGES), help="comma separated stages, available: " + ",".join(BENCH_STAGES + BENCH_LEGACY_STAGES))
+    parser.add_argument("--legacy", action="store_true", help="also run the legacy png-per-frame segment stage")
+    parser.add_argument("--jobs", type=int, default=0, help="segments rendered in parallel (0 = cpu count)")
+    parser.add_argument("--tts-workers", type=int, default=4, help="concurrent speech syntheses")
+    parser.add_argument("--latency", type=float, default=0.0, help="simulated speech service latency per request in seconds")
+    parser.add_argument("--profile", default=None, help="video encoding profile")
+    parser.add_argument("--font", default='', help="font file used to draw slides")
+    parser.add_argument("--work-dir", default=None, help="directory for the synthetic project (default: system temp)")
+    parser.add_argument("--keep", action="store_true", help="keep the synthetic project after running")
+    parser.add_argument("--output", default='', help="write JSON result to this file (default: stdout)")
+    parser.add_argument("--check", action="store_true", help="exit with code 1 when any stage fails (smoke test)")
+    args = parser.parse_args()
+
+    stages = [s for s in args.stages.split(",") if s]
+    if args.legacy:
+        stages += [s for s in BENCH_LEGACY_STAGES if s not in stages]
+    report = run_bench(args.segments, args.duration, stages, args.jobs, args.tts_workers, args.latency, args.profile, args.font, args.work_dir, args.keep)
+
+    data = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(data)
+    else:
+        print(data)
+
+    failed = [stage["name"] for stage in report["stages"] if not stage["ok"]]
+    if args.check and len(failed) > 0:
+        print("Failed stages: {}".format(", ".join(failed)), file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,211 @@
+# -*- encoding: utf-8 -*-
+
+'''
+Incremental build graph
+增量构建：记录每个产物（wav、图片、分段视频、基本视频、字幕、最终视频）输入文件的内容哈希，
+只重新生成输入发生变化的产物，全部没有变化的步骤直接跳过
+
+site: github.com/heiyeluren
+
+'''
+
+import os
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .cache import file_hash, hash_key, atomic_write_bytes
+from .trace import span
+
+
+# 获取产物的临时输出路径（保留扩展名，ffmpeg/Pillow 根据扩展名判断格式）
+def get_tmp_output_path(output: str) -> str:
+    base, ext = os.path.splitext(output)
+    return base + ".part" + ext
+
+
+# 构建产物
+class Artifact:
+    """
+    一个构建产物
+
+    属性：
+    stage：所属步骤名称
+    output：产物文件路径
+    inputs：输入文件路径列表（源文件或者其他产物）
+    params：影响产物内容的参数（字体、字号、声音等），参与签名计算
+    optional_inputs：可选输入文件路径列表（构建时读取，但是可以不存在，比如语音的时间文件），存在与否和内容都参与签名计算
+    tmp_output：临时输出路径，构建函数必须写入这个路径，成功后再原子替换为 output
+    """
+    def __init__(self, stage: str, output: str, inputs: list, params=None, optional_inputs=None):
+        self.stage = stage
+        self.output = output
+        self.inputs = list(inputs)
+        self.params = params
+        self.optional_inputs = list(optional_inputs or [])
+        self.tmp_output = get_tmp_output_path(output)
+
+
+# 构建图
+class BuildGraph:
+    """
+    按步骤登记产物，每个步骤运行时计算产物输入的内容哈希，和上次成功构建时记录的签名比较，只构建有变化的产物。
+    产物先写入临时文件，成功后原子替换并立即保存状态，中途崩溃后再次运行会从中断的位置继续。
+
+    调用示例：
+    graph = BuildGraph("input/.build_state.json")
+    graph.add("voice", "input/audio/01.wav", ["input/voice_text_01.txt"], {"voice": "zh-CN-YunzeNeural"})
+    graph.run_stage("voice", lambda a: synthesize_text_to_voice(a.inputs[0], a.tmp_output), jobs=4)
+
+    progress 不为空时，每个步骤开始和每个产物构建完成时调用 progress(步骤名称, 已完成数, 需要构建数)
+    cancel_event 不为空时使用调用方的事件（比如渲染服务取消任务时从其他进程设置）
+    """
+    def __init__(self, state_file: str, force: bool = False, progress=None, cancel_event=None):
+        self.state_file = state_file
+        self.force = force
+        self.progress = progress
+        self.artifacts = []
+        self.lock = threading.Lock()
+        # 任意产物构建失败后设置，正在运行的 ffmpeg 随之结束，还没开始的产物不再构建
+        self.cancel_event = cancel_event if cancel_event is not None else threading.Event()
+        self.error = None
+        self.state = {"files": {}, "artifacts": {}}
+        if os.path.exists(state_file):
+            try:
+                with open(state_file, 'r', encoding='utf-8') as f:
+                    self.state = json.load(f)
+            except ValueError:
+                print("Warning: build state file is broken, rebuild all:", state_file)
+        self.state.setdefault("files", {})
+        self.state.setdefault("artifacts", {})
+
+    # 登记产物
+    def add(self, stage: str, output: str, inputs: list, params=None, optional_inputs=None) -> Artifact:
+        artifact = Artifact(stage, output, inputs, params, optional_inputs)
+        self.artifacts.append(artifact)
+        return artifact
+
+    # 获取某个步骤的所有产物
+    def get_stage(self, stage: str) -> list:
+        return [a for a in self.artifacts if a.stage == stage]
+
+    # 文件内容哈希（按 大小+修改时间 缓存，文件没有变化时不重新读取）
+    def get_file_hash(self, path: str) -> str:
+        st = os.stat(path)
+        with self.lock:
+            cached = self.state["files"].get(path)
+        if cached is not None and cached[0] == st.st_size and cached[1] == st.st_mtime_ns:
+            return cached[2]
+        digest = file_hash(path)
+        with self.lock:
+            self.state["files"][path] = [st.st_size, st.st_mtime_ns, digest]
+        return digest
+
+    # 预填文件哈希缓存（例如项目清单中已经计算过的输入文件哈希），已有记录的文件不覆盖
+    def add_file_hashes(self, files: dict):
+        """
+        参数：
+        files：dict，{文件路径: [大小, 修改时间(纳秒), 哈希], ...}
+        """
+        with self.lock:
+            for path, info in files.items():
+                self.state["files"].setdefault(path, list(info))
+
+    # 计算产物签名：参数 + 所有输入文件的内容哈希
+    def signature(self, artifact: Artifact) -> str:
+        inputs = []
+        for path in artifact.inputs:
+            if not os.path.exists(path):
+                raise Exception("Build input file not found: {} (for {})".format(path, artifact.output))
+            inputs.append([path, self.get_file_hash(path)])
+        # 可选输入不存在时记为 None（之后生成、删除都会让产物重新构建）
+        for path in artifact.optional_inputs:
+            inputs.append([path, self.get_file_hash(path) if os.path.exists(path) else None])
+        return hash_key(artifact.params, inputs)
+
+    # 判断产物是否需要重新构建
+    def is_outdated(self, artifact: Artifact) -> bool:
+        if self.force or not os.path.exists(artifact.output):
+            return True
+        return self.state["artifacts"].get(artifact.output) != self.signature(artifact)
+
+    # 获取某个步骤中需要重新构建的产物
+    def outdated(self, stage: str) -> list:
+        return [a for a in self.get_stage(stage) if self.is_outdated(a)]
+
+    # 构建成功：临时文件原子替换为正式文件，记录签名并保存状态
+    def commit(self, artifact: Artifact):
+        if not os.path.exists(artifact.tmp_output):
+            raise Exception("Build output file not generated: {}".format(artifact.tmp_output))
+        os.replace(artifact.tmp_output, artifact.output)
+        signature = self.signature(artifact)
+        with self.lock:
+            self.state["artifacts"][artifact.output] = signature
+            self.save()
+
+    # 保存构建状态（原子写入）
+    def save(self):
+        data = json.dumps(self.state, ensure_ascii=False, indent=1).encode('utf-8')
+        atomic_write_bytes(self.state_file, data)
+
+    # 构建一个产物：清理临时文件、创建输出目录，构建成功后提交
+    def build(self, artifact: Artifact, build_func):
+        if self.cancel_event.is_set():
+            raise Exception("Build canceled after an earlier failure: {}".format(artifact.output))
+        # 清理上次中断留下的临时文件
+        if os.path.exists(artifact.tmp_output):
+            os.remove(artifact.tmp_output)
+        output_dir = os.path.dirname(artifact.output)
+        if output_dir != '' and not os.path.exists(output_dir):
+            os.makedirs(output_dir, exist_ok=True)
+        try:
+            with span(artifact.stage, "build", output=artifact.output):
+                build_func(artifact)
+        except Exception as e:
+            with self.lock:
+                if self.error is None:
+                    self.error = e
+            self.cancel_event.set()
+            raise
+        self.commit(artifact)
+
+    # 运行一个步骤
+    def run_stage(self, stage: str, build_func, jobs: int = 1) -> list:
+        """
+        构建步骤中所有有变化的产物，没有需要构建的产物时直接跳过
+
+        参数：
+        stage：str，步骤名称
+        build_func：构建函数，参数为 Artifact，必须把结果写入 artifact.tmp_output
+        jobs：int，同时构建的产物数量
+
+        返回值：
+        list，本次重新构建的产物
+        """
+        artifacts = self.outdated(stage)
+        if self.progress is not None:
+            self.progress(stage, 0, len(artifacts))
+        if len(artifacts) == 0:
+            print("Stage [{}] is up to date, skipped".format(stage))
+            return []
+        print("Stage [{}]: {} of {} to build".format(stage, len(artifacts), len(self.get_stage(stage))))
+        done = [0]
+
+        def build_one(artifact):
+            self.build(artifact, build_func)
+            if self.progress is not None:
+                with self.lock:
+                    done[0] += 1
+                    count = done[0]
+                self.progress(stage, count, len(artifacts))
+            return artifact
+
+        with ThreadPoolExecutor(max_workers=max(1, min(jobs, len(artifacts)))) as executor, \
+                span("stage:" + stage, "stage", count=len(artifacts), jobs=jobs):
+            try:
+                return list(executor.map(build_one, artifacts))
+            except Exception:
+                # 抛出最先失败的错误，而不是因为它被取消的其他产物的错误
+                if self.error is not None:
+                    raise self.error
+                raise
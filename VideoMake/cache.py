@@ -0,0 +1,166 @@
+# -*- encoding: utf-8 -*-
+
+'''
+Content-addressed file cache
+按内容哈希寻址的磁盘缓存（带容量上限，按最近使用时间LRU淘汰）
+
+site: github.com/heiyeluren
+
+'''
+
+import os
+import json
+import shutil
+import hashlib
+import threading
+
+
+# 计算文件内容哈希
+def file_hash(file_path: str, block_size: int = 1024 * 1024) -> str:
+    h = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            h.update(block)
+    return h.hexdigest()
+
+
+# 多个参数组合计算缓存key
+def hash_key(*parts) -> str:
+    """
+    把多个参数（字符串、数字、列表、元组、字典）组合成一个稳定的哈希key
+
+    调用示例：
+    key = hash_key("你好。", "zh-CN-YunzeNeural", "zh-CN", "Raw24Khz16BitMonoPcm")
+    """
+    data = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+
+# 先写临时文件再改名，保证其他进程/线程不会读到写了一半的文件
+def atomic_write_bytes(file_path: str, data: bytes):
+    tmp_file = "{}.{}.{}.tmp".format(file_path, os.getpid(), threading.get_ident())
+    with open(tmp_file, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_file, file_path)
+
+
+# 硬链接文件，不支持硬链接（跨磁盘、文件系统不支持）时复制文件
+def link_or_copy(src_file: str, dst_file: str):
+    tmp_file = "{}.{}.{}.tmp".format(dst_file, os.getpid(), threading.get_ident())
+    try:
+        os.link(src_file, tmp_file)
+    except OSError:
+        shutil.copyfile(src_file, tmp_file)
+    os.replace(tmp_file, dst_file)
+
+
+# 各缓存目录占用的空间（进程内统计：第一次检查容量时扫描一次目录，之后写入时累加，超过上限时才重新扫描并淘汰）
+_cache_sizes = {}
+_cache_sizes_lock = threading.Lock()
+
+
+# 磁盘缓存
+class FileCache:
+    """
+    按key保存文件的磁盘缓存，文件名为 <key><suffix>，按前两位分子目录
+    读取命中时更新文件修改时间，超过容量上限时删除最久没有使用的文件（LRU）
+    占用空间在进程内累加统计，evict 没有超过上限时不扫描目录，每次写入后都可以调用
+
+    调用示例：
+    cache = FileCache("cache/tts", max_size=512 * 1024 * 1024)
+    data = cache.get_bytes(key, ".pcm")
+    if data is None:
+        cache.put_bytes(key, ".pcm", pcm)
+    cache.evict()
+    """
+    def __init__(self, cache_dir: str, max_size: int = 0):
+        self.cache_dir = cache_dir.replace("\\", "/")
+        self.max_size = max_size
+        if os.path.exists(self.cache_dir) is False:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    # 获取key对应的文件路径（不判断是否存在）
+    def get_path(self, key: str, suffix: str = '') -> str:
+        return os.path.join(self.cache_dir, key[:2], key + suffix).replace("\\", "/")
+
+    # 获取缓存文件路径，不存在返回None
+    def get(self, key: str, suffix: str = ''):
+        path = self.get_path(key, suffix)
+        if not os.path.exists(path):
+            return None
+        # 更新修改时间，作为LRU的最近使用时间
+        try:
+            os.utime(path, None)
+        except OSError:
+            return None
+        return path
+
+    # 读取缓存内容，不存在返回None
+    def get_bytes(self, key: str, suffix: str = ''):
+        path = self.get(key, suffix)
+        if path is None:
+            return None
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    # 写入缓存内容
+    def put_bytes(self, key: str, suffix: str, data: bytes) -> str:
+        path = self.get_path(key, suffix)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        atomic_write_bytes(path, data)
+        self.add_size(len(data))
+        return path
+
+    # 把已有文件放进缓存（优先使用硬链接，不占用额外空间）
+    def put_file(self, key: str, suffix: str, src_file: str) -> str:
+        path = self.get_path(key, suffix)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        link_or_copy(src_file, path)
+        self.add_size(os.path.getsize(path))
+        return path
+
+    # 累加写入的空间（目录还没有扫描过时不统计，扫描时会计入）
+    def add_size(self, size: int):
+        with _cache_sizes_lock:
+            if self.cache_dir in _cache_sizes:
+                _cache_sizes[self.cache_dir] += size
+
+    # 缓存占用空间超过上限时，按最近使用时间淘汰
+    def evict(self):
+        if self.max_size <= 0:
+            return
+        with _cache_sizes_lock:
+            total = _cache_sizes.get(self.cache_dir)
+            if total is not None and total <= self.max_size:
+                return
+            # 第一次检查或者超过上限：扫描目录得到实际占用空间（其他进程写入、删除的文件也会统计进来）
+            entries = []
+            total = 0
+            for root, _, files in os.walk(self.cache_dir):
+                for name in files:
+                    if name.endswith(".tmp"):
+                        continue
+                    path = os.path.join(root, name)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    entries.append((st.st_mtime, st.st_size, path))
+                    total += st.st_size
+            if total > self.max_size:
+                entries.sort()
+                for _, size, path in entries:
+                    if total <= self.max_size:
+                        break
+                    try:
+                        os.remove(path)
+                        total -= size
+                    except OSError:
+                        pass
+            _cache_sizes[self.cache_dir] = total
@@ -0,0 +1,529 @@
+# -*- encoding: utf-8 -*-
+
+'''
+Render daemon
+渲染服务：常驻后台的本地任务队列，通过 localhost HTTP 接口提交多个项目目录的生成任务
+
+每个工作进程启动后一直运行，在任务之间保持已经加载的模块（azure、Pillow 等）、字体和文字测量缓存、
+媒体信息缓存、语音合成后端（pyttsx3 引擎进程、Azure 合成器连接），连续的小任务不用每次重新启动程序
+任务按优先级（数字越大越优先）、提交顺序分配给空闲的工作进程，同一个项目目录同时只运行一个任务
+
+site: github.com/heiyeluren
+
+HTTP 接口（JSON）：
+POST /jobs                  提交任务 {"root": "/data/projects/demo", "priority": 0, "config": {"tts_backend": "pyttsx3"}}
+GET  /jobs                  所有任务
+GET  /jobs/<id>             任务状态和进度
+POST /jobs/<id>/cancel      取消任务（运行中的任务通知工作进程停止，正在运行的 ffmpeg 随之结束；超时没有停止时才结束工作进程并重新启动）
+GET  /status                工作进程状态
+
+命令行：
+python -m VideoMake.daemon serve --workers 2
+python -m VideoMake.daemon submit /data/projects/demo --priority 5 --config '{"tts_backend": "pyttsx3"}' --wait
+python -m VideoMake.daemon status
+python -m VideoMake.daemon cancel 3
+
+'''
+
+import os
+import sys
+import json
+import time
+import heapq
+import signal
+import threading
+import traceback
+import multiprocessing
+import multiprocessing.connection
+import urllib.request
+import urllib.error
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from .trace import add_trace_events
+
+
+# 服务默认监听地址（只监听本机）
+DAEMON_HOST = "127.0.0.1"
+DAEMON_PORT = 8765
+
+# 默认工作进程数
+DAEMON_WORKERS = 2
+
+# 取消运行中的任务后等待工作进程停止的时间（秒），超时后结束工作进程
+DAEMON_CANCEL_GRACE = 30
+
+# 保留的已结束任务数（超过后删除最早结束的任务记录）
+DAEMON_MAX_FINISHED_JOBS = 1000
+
+# 任务状态
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+JOB_CANCELED = "canceled"
+
+
+# 生成任务
+class RenderJob:
+    def __init__(self, job_id: int, root: str, priority: int = 0, config: dict = None):
+        self.id = job_id
+        self.root = root
+        self.priority = priority
+        self.config = config or {}
+        self.status = JOB_QUEUED
+        self.worker = None
+        # 当前步骤和进度，stages 记录每个步骤的 [已完成数, 需要构建数]
+        self.stage = ''
+        self.stages = {}
+        self.built = {}
+        self.error = ''
+        self.created = time.time()
+        self.started = 0.0
+        self.finished = 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "root": self.root,
+            "priority": self.priority,
+            "config": self.config,
+            "status": self.status,
+            "worker": self.worker,
+            "stage": self.stage,
+            "stages": self.stages,
+            "built": self.built,
+            "error": self.error,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+        }
+
+
+# 工作进程：常驻运行，逐个执行分配的任务
+def run_render_worker(worker_id: int, task_queue, event_conn, cancel_event, cache_root: str, workers: int):
+    """
+    参数：
+    task_queue：任务队列，None 表示退出
+    event_conn：结果管道（每个工作进程一个，结束一个工作进程不影响其他工作进程）
+    cancel_event：取消事件，服务进程设置后当前任务停止（映射到构建图的 cancel_event）
+    """
+    # 工作进程单独一个进程组，取消超时结束工作进程时连同 ffmpeg、pyttsx3 等子进程一起结束
+    if hasattr(os, "setpgrp"):
+        os.setpgrp()
+
+    # 只在工作进程中加载生成流程（以及它依赖的 azure、Pillow、pydub 等），加载一次后所有任务共用
+    from . import defined
+    from .render import render_project, create_tts_backend, RENDER_DEFAULT_CONFIG
+    from .scheduler import RateLimiter
+    from .trace import span, take_trace_events, trace_is_enabled
+
+    # 进度回调可能来自多个构建线程，发送时加锁
+    send_lock = threading.Lock()
+
+    def send_event(*event):
+        with send_lock:
+            event_conn.send(event)
+
+    backends = {}
+    limiters = {}
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+        job_id, root, config = task
+        config = dict(RENDER_DEFAULT_CONFIG, **config)
+        try:
+            defined.set_root_path(root, cache_root or None)
+
+            # 语音合成后端按 (后端, 声音, 并发数) 复用
+            backend_key = (config["tts_backend"], config["voice_name"], config["tts_workers"])
+            if backend_key not in backends:
+                backends[backend_key] = create_tts_backend(config)
+            # 限流按工作进程数平分，所有工作进程合起来不超过配置的速率
+            limiter_key = (config["tts_rps"], config["tts_cpm"])
+            if limiter_key not in limiters:
+                limiters[limiter_key] = RateLimiter(config["tts_rps"] / workers, config["tts_cpm"] / workers)
+
+            def progress(stage, done, total):
+                send_event("progress", worker_id, job_id, stage, done, total)
+
+            with span("job", "daemon", job_id=job_id, root=root):
+                built = render_project(config, tts_backend=backends[backend_key], tts_limiter=limiters[limiter_key], progress=progress,
+                                       cancel_event=cancel_event)
+            send_event("done", worker_id, job_id, built)
+        except Exception as e:
+            traceback.print_exc()
+            send_event("failed", worker_id, job_id, "{}: {}".format(type(e).__name__, e))
+        # 开启追踪时，任务的区间交给服务进程合并保存
+        if trace_is_enabled():
+            send_event("trace", worker_id, job_id, take_trace_events())
+
+    for backend in backends.values():
+        backend.close()
+
+
+# 工作进程信息
+class RenderWorker:
+    def __init__(self, worker_id: int):
+        self.id = worker_id
+        self.process = None
+        self.task_queue = None
+        self.events = None
+        self.cancel_event = None
+        # 取消当前任务后的截止时间，0 表示没有取消
+        self.cancel_deadline = 0.0
+        self.job = None
+
+
+# 渲染服务：任务队列 + 工作进程池
+class RenderService:
+    """
+    调用示例：
+    service = RenderService(workers=2)
+    service.start()
+    job = service.submit("/data/projects/demo", priority=5, config={"tts_backend": "pyttsx3"})
+    print(service.get_job(job.id).to_dict())
+    service.stop()
+    """
+    def __init__(self, workers: int = DAEMON_WORKERS, cache_root: str = ''):
+        self.context = multiprocessing.get_context("spawn")
+        self.workers = [RenderWorker(i) for i in range(max(1, workers))]
+        self.cache_root = cache_root
+        self.jobs = {}
+        # 等待中的任务：(-优先级, 任务ID)，优先级相同时先提交的先运行
+        self.pending = []
+        self.next_id = 1
+        self.lock = threading.Lock()
+        self.running = False
+        self.thread = None
+
+    # 启动工作进程（调用方持有 self.lock 或者服务还没有启动）
+    def start_worker(self, worker: RenderWorker):
+        if worker.events is not None:
+            worker.events.close()
+        worker.task_queue = self.context.Queue()
+        worker.cancel_event = self.context.Event()
+        receiver, sender = self.context.Pipe(duplex=False)
+        worker.process = self.context.Process(target=run_render_worker, daemon=True,
+                                              args=(worker.id, worker.task_queue, sender, worker.cancel_event, self.cache_root, len(self.workers)))
+        worker.process.start()
+        # 关闭本进程的发送端，工作进程退出后接收端能读到 EOF
+        sender.close()
+        worker.events = receiver
+        worker.cancel_deadline = 0.0
+        worker.job = None
+
+    # 结束工作进程和它的子进程（调用方不持有 self.lock，等待进程退出可能需要一段时间）
+    def terminate_worker(self, worker: RenderWorker):
+        try:
+            os.killpg(worker.process.pid, signal.SIGTERM)
+        except (AttributeError, OSError):
+            # Windows 没有进程组，或者工作进程还没有建立进程组
+            worker.process.terminate()
+        worker.process.join(timeout=10)
+
+    def start(self):
+        for worker in self.workers:
+            self.start_worker(worker)
+        self.running = True
+        self.thread = threading.Thread(target=self.run_events, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        for worker in self.workers:
+            worker.task_queue.put(None)
+        for worker in self.workers:
+            worker.process.join(timeout=10)
+            if worker.process.is_alive():
+                self.terminate_worker(worker)
+        if self.thread is not None:
+            self.thread.join()
+
+    # 提交任务
+    def submit(self, root: str, priority: int = 0, config: dict = None) -> RenderJob:
+        from .render import RENDER_DEFAULT_CONFIG
+        root = os.path.abspath(root).replace("\\", "/")
+        if not os.path.isdir(os.path.join(root, "input")):
+            raise Exception("Project input path is not exists: {}".format(os.path.join(root, "input")))
+        unknown = [key for key in (config or {}) if key not in RENDER_DEFAULT_CONFIG]
+        if len(unknown) > 0:
+            raise Exception("Unknown render config: {}".format(", ".join(unknown)))
+        with self.lock:
+            job = RenderJob(self.next_id, root, int(priority), config)
+            self.next_id += 1
+            self.jobs[job.id] = job
+            heapq.heappush(self.pending, (-job.priority, job.id))
+            self.dispatch()
+        return job
+
+    # 取消任务
+    def cancel(self, job_id: int) -> RenderJob:
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            if job.status == JOB_RUNNING:
+                # 正在运行的任务：通知工作进程停止（正在运行的 ffmpeg 随之结束，产物都是先写临时文件，下次运行会从中断的位置继续），
+                # 工作进程报告任务结束后才分配新任务，超过 DAEMON_CANCEL_GRACE 秒没有结束时 run_events 结束工作进程
+                worker = self.workers[job.worker]
+                if worker.job == job.id:
+                    worker.cancel_event.set()
+                    worker.cancel_deadline = time.time() + DAEMON_CANCEL_GRACE
+            if job.status in (JOB_QUEUED, JOB_RUNNING):
+                job.status = JOB_CANCELED
+                job.finished = time.time()
+            self.dispatch()
+            return job
+
+    def get_job(self, job_id: int) -> RenderJob:
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def list_jobs(self) -> list:
+        with self.lock:
+            return [job.to_dict() for job in self.jobs.values()]
+
+    def get_status(self) -> dict:
+        with self.lock:
+            return {
+                "workers": [{"id": w.id, "pid": w.process.pid, "alive": w.process.is_alive(), "job": w.job} for w in self.workers],
+                "queued": len([j for j in self.jobs.values() if j.status == JOB_QUEUED]),
+            }
+
+    # 把等待中的任务分配给空闲的工作进程（调用方持有 self.lock）
+    def dispatch(self):
+        idle = [w for w in self.workers if w.job is None]
+        busy_roots = set([self.jobs[w.job].root for w in self.workers if w.job is not None])
+        skipped = []
+        while len(idle) > 0 and len(self.pending) > 0:
+            item = heapq.heappop(self.pending)
+            job = self.jobs.get(item[1])
+            if job is None or job.status != JOB_QUEUED:
+                continue
+            # 同一个项目目录正在生成，等它结束后再运行
+            if job.root in busy_roots:
+                skipped.append(item)
+                continue
+            worker = idle.pop(0)
+            # 上一个任务取消或失败时设置过取消事件
+            worker.cancel_event.clear()
+            worker.job = job.id
+            job.worker = worker.id
+            job.status = JOB_RUNNING
+            job.started = time.time()
+            busy_roots.add(job.root)
+            worker.task_queue.put((job.id, job.root, job.config))
+        for item in skipped:
+            heapq.heappush(self.pending, item)
+
+    # 任务结束（调用方持有 self.lock）
+    def finish_job(self, worker_id: int, job_id: int, status: str, error: str = '', built: dict = None):
+        worker = self.workers[worker_id]
+        if worker.job == job_id:
+            worker.job = None
+            worker.cancel_deadline = 0.0
+        job = self.jobs.get(job_id)
+        if job is not None and job.status == JOB_RUNNING:
+            job.status = status
+            job.error = error
+            job.built = built or {}
+            job.finished = time.time()
+        self.prune_jobs()
+        self.dispatch()
+
+    # 删除最早结束的任务记录（调用方持有 self.lock）
+    def prune_jobs(self):
+        finished = [j for j in self.jobs.values() if j.status in (JOB_DONE, JOB_FAILED, JOB_CANCELED)]
+        if len(finished) > DAEMON_MAX_FINISHED_JOBS:
+            finished.sort(key=lambda j: j.finished)
+            for job in finished[:len(finished) - DAEMON_MAX_FINISHED_JOBS]:
+                del self.jobs[job.id]
+
+    # 处理工作进程发来的进度和结果，检查异常退出的工作进程
+    def run_events(self):
+        while self.running:
+            connections = dict([(w.events, w) for w in self.workers if w.events is not None])
+            events = []
+            for conn in multiprocessing.connection.wait(list(connections), timeout=0.5):
+                try:
+                    events.append(conn.recv())
+                except (EOFError, OSError):
+                    # 工作进程已经退出，下面检查进程状态后重新启动
+                    connections[conn].events = None
+                    conn.close()
+
+            with self.lock:
+                for event in events:
+                    kind, worker_id, job_id = event[:3]
+                    if kind == "progress":
+                        job = self.jobs.get(job_id)
+                        if job is not None and job.status == JOB_RUNNING:
+                            job.stage = event[3]
+                            job.stages[event[3]] = [event[4], event[5]]
+                    elif kind == "done":
+                        self.finish_job(worker_id, job_id, JOB_DONE, built=event[3])
+                    elif kind == "failed":
+                        self.finish_job(worker_id, job_id, JOB_FAILED, error=event[3])
+                    elif kind == "trace":
+                        add_trace_events(event[3])
+                now = time.time()
+                expired = [w for w in self.workers if w.job is not None and 0 < w.cancel_deadline < now]
+
+            # 取消后超时没有停止的工作进程：在锁外结束（只影响它自己的结果管道），下面按异常退出重新启动
+            for worker in expired:
+                print("Warning: render worker {} did not stop within {}s after cancel, terminate".format(worker.id, DAEMON_CANCEL_GRACE), file=sys.stderr)
+                self.terminate_worker(worker)
+
+            with self.lock:
+                for worker in self.workers:
+                    if self.running and not worker.process.is_alive():
+                        job_id = worker.job
+                        print("Warning: render worker {} exited with code {}, restart".format(worker.id, worker.process.exitcode), file=sys.stderr)
+                        self.start_worker(worker)
+                        if job_id is not None:
+                            self.finish_job(worker.id, job_id, JOB_FAILED, error="render worker exited unexpectedly")
+
+
+# HTTP 接口
+class RenderRequestHandler(BaseHTTPRequestHandler):
+    def send_json(self, code: int, data):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_json(self) -> dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        data = self.rfile.read(length) if length > 0 else b'{}'
+        return json.loads(data.decode('utf-8'))
+
+    # 路径中的任务ID，不是数字时返回 None
+    def get_job_id(self, parts: list):
+        return int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else None
+
+    def do_GET(self):
+        service = self.server.service
+        parts = self.path.strip("/").split("/")
+        if parts == ["jobs"]:
+            return self.send_json(200, service.list_jobs())
+        if parts[0] == "jobs" and len(parts) == 2:
+            job = service.get_job(self.get_job_id(parts))
+            if job is None:
+                return self.send_json(404, {"error": "job not found"})
+            return self.send_json(200, job.to_dict())
+        if parts == ["status"]:
+            return self.send_json(200, service.get_status())
+        self.send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        service = self.server.service
+        parts = self.path.strip("/").split("/")
+        try:
+            if parts == ["jobs"]:
+                data = self.read_json()
+                job = service.submit(data.get("root", ''), data.get("priority", 0), data.get("config"))
+                return self.send_json(200, job.to_dict())
+            if parts[0] == "jobs" and len(parts) == 3 and parts[2] == "cancel":
+                job = service.cancel(self.get_job_id(parts))
+                if job is None:
+                    return self.send_json(404, {"error": "job not found"})
+                return self.send_json(200, job.to_dict())
+        except Exception as e:
+            return self.send_json(400, {"error": str(e)})
+        self.send_json(404, {"error": "not found"})
+
+    def log_message(self, format, *args):
+        pass
+
+
+# 启动渲染服务（一直运行到 Ctrl+C）
+def serve(host: str = DAEMON_HOST, port: int = DAEMON_PORT, workers: int = DAEMON_WORKERS, cache_root: str = ''):
+    service = RenderService(workers, cache_root)
+    service.start()
+    server = ThreadingHTTPServer((host, port), RenderRequestHandler)
+    server.service = service
+    print("Render daemon listening on http://{}:{} with {} workers".format(host, server.server_address[1], len(service.workers)))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.stop()
+
+
+# 调用渲染服务的 HTTP 接口
+def request_daemon(path: str, data: dict = None, url: str = '') -> dict:
+    url = (url or "http://{}:{}".format(DAEMON_HOST, DAEMON_PORT)).rstrip("/") + path
+    body = json.dumps(data).encode('utf-8') if data is not None else None
+    request = urllib.request.Request(url, data=body, method="POST" if data is not None else "GET",
+                                     headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(request) as response:
+            return json.loads(response.read().decode('utf-8'))
+    except urllib.error.HTTPError as e:
+        raise Exception("Render daemon error: {}".format(json.loads(e.read().decode('utf-8')).get("error")))
+
+
+# 提交任务
+def submit_job(root: str, priority: int = 0, config: dict = None, url: str = '') -> dict:
+    return request_daemon("/jobs", {"root": os.path.abspath(root), "priority": priority, "config": config or {}}, url)
+
+
+# 等待任务结束，返回最终状态
+def wait_job(job_id: int, url: str = '', interval: float = 1.0, on_progress=None) -> dict:
+    while True:
+        job = request_daemon("/jobs/{}".format(job_id), url=url)
+        if on_progress is not None:
+            on_progress(job)
+        if job["status"] not in (JOB_QUEUED, JOB_RUNNING):
+            return job
+        time.sleep(interval)
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Render daemon with a local job queue")
+    parser.add_argument("--url", default='', help="daemon url for client commands (default: http://127.0.0.1:8765)")
+    commands = parser.add_subparsers(dest="command")
+    serve_parser = commands.add_parser("serve", help="run the render daemon")
+    serve_parser.add_argument("--host", default=DAEMON_HOST, help="listen address")
+    serve_parser.add_argument("--port", type=int, default=DAEMON_PORT, help="listen port")
+    serve_parser.add_argument("--workers", type=int, default=DAEMON_WORKERS, help="number of render worker processes")
+    serve_parser.add_argument("--cache-dir", default='', help="cache directory shared by all projects (default: the package cache/)")
+    submit_parser = commands.add_parser("submit", help="submit a project directory")
+    submit_parser.add_argument("root", help="project root path containing input/")
+    submit_parser.add_argument("--priority", type=int, default=0, help="higher runs first")
+    submit_parser.add_argument("--config", default='{}', help="render config as json, see render.RENDER_DEFAULT_CONFIG")
+    submit_parser.add_argument("--wait", action="store_true", help="wait until the job finishes")
+    status_parser = commands.add_parser("status", help="show jobs")
+    status_parser.add_argument("job_id", nargs="?", type=int, help="job id (default: all jobs)")
+    cancel_parser = commands.add_parser("cancel", help="cancel a job")
+    cancel_parser.add_argument("job_id", type=int, help="job id")
+    args = parser.parse_args()
+
+    def print_job(job):
+        stage = "{} {}/{}".format(job["stage"], *job["stages"].get(job["stage"], [0, 0])) if job["stage"] else ''
+        print("#{} [{}] priority={} {} {} {}".format(job["id"], job["status"], job["priority"], job["root"], stage, job["error"]))
+
+    if args.command == "serve":
+        serve(args.host, args.port, args.workers, args.cache_dir)
+    elif args.command == "submit":
+        job = submit_job(args.root, args.priority, json.loads(args.config), args.url)
+        print_job(job)
+        if args.wait:
+            job = wait_job(job["id"], args.url, on_progress=print_job)
+            sys.exit(0 if job["status"] == JOB_DONE else 1)
+    elif args.command == "status":
+        if args.job_id is not None:
+            print_job(request_daemon("/jobs/{}".format(args.job_id), url=args.url))
+        else:
+            for job in request_daemon("/jobs", url=args.url):
+                print_job(job)
+    elif args.command == "cancel":
+        print_job(request_daemon("/jobs/{}/cancel".format(args.job_id), {}, args.url))
+    else:
+        parser.print_help()
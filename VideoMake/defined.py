@@ -23,6 +23,37 @@ INPUT_AUDIO_ROOT_PATH   = os.path.abspath(os.path.join(os.path.dirname(__file__)
 INPUT_VIDEO_ROOT_PATH   = os.path.abspath(os.path.join(os.path.dirname(__file__), "../input/video/")).replace("\\", "/") + "/"
 INPUT_SRT_ROOT_PATH     = os.path.abspath(os.path.join(os.path.dirname(__file__), "../input/srt/")).replace("\\", "/") + "/"
 OUTPUT_ROOT_PATH        = os.path.abspath(os.path.join(os.path.dirname(__file__), "../output/")).replace("\\", "/") + "/"
+CACHE_ROOT_PATH         = os.path.abspath(os.path.join(os.path.dirname(__file__), "../cache/")).replace("\\", "/") + "/"
+TTS_CACHE_ROOT_PATH     = os.path.abspath(os.path.join(os.path.dirname(__file__), "../cache/tts/")).replace("\\", "/") + "/"
+SLIDE_CACHE_ROOT_PATH   = os.path.abspath(os.path.join(os.path.dirname(__file__), "../cache/slide/")).replace("\\", "/") + "/"
+
+
+# 切换项目根目录（input / output / cache 目录随之变化，用于同时处理多个项目目录或者测试）
+def set_root_path(root_path: str, cache_root_path: str = None):
+    """
+    参数：
+    root_path：str，项目根目录，其中包含 input/ 和 output/ 目录
+    cache_root_path：str，缓存目录，不传则不修改（多个项目共享缓存）
+
+    调用示例：
+    defined.set_root_path("/data/projects/demo")
+    """
+    global ROOT_PATH, INPUT_ROOT_PATH, INPUT_IMGS_ROOT_PATH, INPUT_AUDIO_ROOT_PATH, INPUT_VIDEO_ROOT_PATH, INPUT_SRT_ROOT_PATH, OUTPUT_ROOT_PATH
+    global CACHE_ROOT_PATH, TTS_CACHE_ROOT_PATH, SLIDE_CACHE_ROOT_PATH
+
+    ROOT_PATH               = os.path.abspath(root_path).replace("\\", "/") + "/"
+    INPUT_ROOT_PATH         = ROOT_PATH + "input/"
+    INPUT_IMGS_ROOT_PATH    = ROOT_PATH + "input/img/"
+    INPUT_AUDIO_ROOT_PATH   = ROOT_PATH + "input/audio/"
+    INPUT_VIDEO_ROOT_PATH   = ROOT_PATH + "input/video/"
+    INPUT_SRT_ROOT_PATH     = ROOT_PATH + "input/srt/"
+    OUTPUT_ROOT_PATH        = ROOT_PATH + "output/"
+
+    if cache_root_path is not None:
+        CACHE_ROOT_PATH         = os.path.abspath(cache_root_path).replace("\\", "/") + "/"
+        TTS_CACHE_ROOT_PATH     = CACHE_ROOT_PATH + "tts/"
+        SLIDE_CACHE_ROOT_PATH   = CACHE_ROOT_PATH + "slide/"
+
 
 # 文件前缀设定
 VIDEO_BG_PREFIX         = "video_bg_"
@@ -43,6 +74,13 @@ VIDEO_TEXT_FILE         = "video_text_file"
 VOICE_TEXT_FILE         = "voice_text_file"
 
 FINAL_VIDEO_NAME        = "final"
+BUILD_STATE_FILE        = ".build_state.json"
+PROJECT_MANIFEST_FILE   = ".project_manifest.json"
+
+
+# 缓存设定
+TTS_CACHE_MAX_SIZE      = 1024 * 1024 * 1024   # 语音句子缓存容量上限（字节），超过后按最近使用时间淘汰
+SLIDE_CACHE_MAX_SIZE    = 512 * 1024 * 1024    # 显示图片缓存容量上限（字节），超过后按最近使用时间淘汰
 
 
 # 操作系统
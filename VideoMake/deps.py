@@ -0,0 +1,156 @@
+# -*- encoding: utf-8 -*-
+
+'''
+Dependencies
+可选依赖延迟导入 + 外部工具（ffmpeg、ffprobe、vlc 等）查找缓存
+
+Azure Speech SDK 加载原生库比较慢，pyttsx3 / pydub / win32 只在部分步骤或者部分平台上使用，
+模块中用 lazy_import 代替 import，第一次访问属性时才真正导入，只画图、只编码的运行不需要加载它们，
+没有安装时也只有用到的步骤才报错
+
+外部工具每个进程只查找一次（shutil.which，不再启动 which / where 子进程），
+可以用环境变量 VIDEOMAKE_<工具名大写> 指定路径，比如 VIDEOMAKE_FFMPEG=/opt/ffmpeg/bin/ffmpeg
+
+site: github.com/heiyeluren
+
+调用示例：
+speechsdk = lazy_import("azure.cognitiveservices.speech", "pip install azure-cognitiveservices-speech")
+speechsdk.SpeechConfig(subscription=key, region=region)   # 这时才导入
+
+ffmpeg_path = require_tool("ffmpeg")
+
+命令行（查看依赖和工具是否可用）：
+python -m VideoMake.deps
+
+'''
+
+import os
+import sys
+import types
+import shutil
+import threading
+import importlib
+import importlib.util
+
+
+# 可选依赖的安装说明
+MODULE_INSTALL_HINTS = {
+    "azure.cognitiveservices.speech": "pip install azure-cognitiveservices-speech",
+    "pyttsx3": "pip install pyttsx3",
+    "pydub": "pip install pydub",
+    "numpy": "pip install numpy",
+    "win32gui": "pip install pywin32 (Windows only)",
+}
+
+# 外部工具的安装说明
+FFMPEG_INSTALL_HINT = "please from https://github.com/BtbN/FFmpeg-Builds/releases download ffmpeg and install it"
+TOOL_INSTALL_HINTS = {
+    "ffmpeg": FFMPEG_INSTALL_HINT,
+    "ffprobe": FFMPEG_INSTALL_HINT,
+    "ffplay": FFMPEG_INSTALL_HINT,
+    "vlc": "please from https://www.videolan.org/ download vlc and install it",
+}
+
+_lazy_modules = {}
+_tool_paths = {}
+_deps_lock = threading.Lock()
+
+
+# 延迟导入的模块：第一次访问属性时导入
+class LazyModule(types.ModuleType):
+    def __init__(self, name: str, hint: str = ''):
+        super().__init__(name)
+        self.__dict__["_lazy_hint"] = hint
+        self.__dict__["_lazy_module"] = None
+
+    def _load(self):
+        module = self.__dict__["_lazy_module"]
+        if module is None:
+            try:
+                module = importlib.import_module(self.__name__)
+            except ImportError as e:
+                hint = self.__dict__["_lazy_hint"]
+                raise ImportError("{} is not installed{}: {}".format(self.__name__, ", " + hint if hint else "", e)) from e
+            self.__dict__["_lazy_module"] = module
+        return module
+
+    def __getattr__(self, name):
+        return getattr(self._load(), name)
+
+    def __dir__(self):
+        return dir(self._load())
+
+
+# 获取延迟导入的模块（同一个模块名返回同一个对象）
+def lazy_import(name: str, hint: str = '') -> LazyModule:
+    """
+    参数：
+    name：str，模块名
+    hint：str，没有安装时错误信息中的安装说明，默认使用 MODULE_INSTALL_HINTS
+
+    返回值：
+    LazyModule，用法和导入的模块一样
+    """
+    with _deps_lock:
+        module = _lazy_modules.get(name)
+        if module is None:
+            module = _lazy_modules[name] = LazyModule(name, hint or MODULE_INSTALL_HINTS.get(name, ''))
+        return module
+
+
+# 判断模块是否已安装（不导入模块）
+def module_is_available(name: str) -> bool:
+    if name in sys.modules:
+        return True
+    try:
+        return importlib.util.find_spec(name) is not None
+    except (ImportError, ValueError):
+        return False
+
+
+# 查找外部工具路径（每个进程只查找一次），没有找到返回 None
+def find_tool(name: str):
+    with _deps_lock:
+        if name in _tool_paths:
+            return _tool_paths[name]
+    path = os.environ.get("VIDEOMAKE_" + name.upper()) or shutil.which(name)
+    with _deps_lock:
+        _tool_paths[name] = path
+    return path
+
+
+# 判断外部工具是否已安装
+def tool_is_installed(name: str) -> bool:
+    return find_tool(name) is not None
+
+
+# 获取外部工具路径，没有安装时抛出异常
+def require_tool(name: str) -> str:
+    path = find_tool(name)
+    if path is None:
+        raise Exception("{} is not installed, {}".format(name, TOOL_INSTALL_HINTS.get(name, "please install it")))
+    return path
+
+
+# 获取运行外部工具使用的命令（找到时使用完整路径，没有找到时使用工具名，由启动子进程时报错）
+def get_tool_command(name: str) -> str:
+    return find_tool(name) or name
+
+
+# 指定外部工具路径（比如配置文件中设置），None 表示没有安装
+def register_tool(name: str, path):
+    with _deps_lock:
+        _tool_paths[name] = path
+
+
+# 清空工具查找缓存（安装工具或者修改 PATH 后重新查找）
+def clear_tool_cache():
+    with _deps_lock:
+        _tool_paths.clear()
+
+
+if __name__ == "__main__":
+    for module_name in MODULE_INSTALL_HINTS:
+        print("{:32} {}".format(module_name, "ok" if module_is_available(module_name) else "missing (" + MODULE_INSTALL_HINTS[module_name] + ")"))
+    for tool_name in TOOL_INSTALL_HINTS:
+        print("{:32} {}".format(tool_name, find_tool(tool_name) or "missing"))
@@ -0,0 +1,264 @@
+# -*- encoding: utf-8 -*-
+
+'''
+Encoding profiles
+视频编码参数配置（针对静态幻灯片内容），以及编码参数自动测试（速度、文件大小、画质）
+
+site: github.com/heiyeluren
+
+命令行自动测试：
+python -m VideoMake.encode --image input/img/01.png --audio input/audio/01.wav --budget 500
+
+'''
+
+import os
+import re
+import sys
+import json
+import argparse
+
+from .ffmpeg import run_ffmpeg, FFmpegError
+from .media import get_media_info
+
+
+'''
+编码参数说明：
+video_codec：视频编码器
+pix_fmt：像素格式
+video_size：输出视频尺寸
+preset：x264 编码速度预设，越快文件越大
+crf：画质（0-51，越小画质越好、文件越大）
+tune：针对内容类型优化，静态画面使用 stillimage
+gop_seconds：关键帧间隔（秒），静态画面可以设置得比较大
+audio_bitrate：音频码率
+'''
+ENCODE_PROFILES = {
+    # 草稿：速度优先，用于预览
+    "draft": {
+        "video_codec": "libx264",
+        "pix_fmt": "yuv420p",
+        "video_size": "1280x720",
+        "preset": "ultrafast",
+        "crf": 30,
+        "tune": "stillimage",
+        "gop_seconds": 20,
+        "audio_bitrate": "96k",
+    },
+    # 标准：发布使用
+    "standard": {
+        "video_codec": "libx264",
+        "pix_fmt": "yuv420p",
+        "video_size": "1920x1080",
+        "preset": "veryfast",
+        "crf": 23,
+        "tune": "stillimage",
+        "gop_seconds": 10,
+        "audio_bitrate": "128k",
+    },
+    # 存档：画质优先
+    "archive": {
+        "video_codec": "libx264",
+        "pix_fmt": "yuv420p",
+        "video_size": "1920x1080",
+        "preset": "slow",
+        "crf": 18,
+        "tune": "stillimage",
+        "gop_seconds": 5,
+        "audio_bitrate": "192k",
+    },
+}
+
+DEFAULT_ENCODE_PROFILE = "standard"
+
+
+# 获取编码参数配置
+def get_encode_profile(profile=None, **overrides) -> dict:
+    """
+    参数：
+    profile：str 或 dict，配置名称（draft / standard / archive）或者完整的配置字典，None 表示默认配置
+    overrides：覆盖配置中的某些参数，值为 None 的参数不覆盖
+
+    调用示例：
+    p = get_encode_profile("draft", video_size="1920x1080")
+    """
+    if profile is None or profile == '':
+        profile = DEFAULT_ENCODE_PROFILE
+    if isinstance(profile, dict):
+        result = dict(ENCODE_PROFILES[DEFAULT_ENCODE_PROFILE], **profile)
+    elif profile in ENCODE_PROFILES:
+        result = dict(ENCODE_PROFILES[profile])
+    else:
+        raise Exception("Unknown encode profile: {}, support: {}".format(profile, ", ".join(ENCODE_PROFILES)))
+    for key, value in overrides.items():
+        if value is not None:
+            result[key] = value
+    return result
+
+
+# 生成视频编码的 ffmpeg 参数
+def get_video_encode_args(profile, frame_rate=1, threads=0, is_still=True, with_size=True) -> list:
+    """
+    参数：
+    profile：get_encode_profile 返回的配置
+    frame_rate：视频帧率（用于计算关键帧间隔）
+    threads：编码线程数，0表示自动
+    is_still：是否静态画面（只有静态画面才使用 tune 参数）
+    with_size：是否输出 -s 参数（已经是目标尺寸的视频重新编码时不需要）
+
+    返回值：
+    list，ffmpeg 参数列表
+    """
+    args = []
+    if with_size and profile.get("video_size"):
+        args += ['-s', profile["video_size"]]
+    args += ['-pix_fmt', profile["pix_fmt"], '-c:v', profile["video_codec"]]
+    if profile["video_codec"] in ('libx264', 'libx265'):
+        if profile.get("preset"):
+            args += ['-preset', profile["preset"]]
+        if profile.get("crf") is not None:
+            args += ['-crf', str(profile["crf"])]
+    if profile["video_codec"] == 'libx264' and is_still and profile.get("tune"):
+        args += ['-tune', profile["tune"]]
+    if profile.get("gop_seconds"):
+        args += ['-g', str(max(1, int(profile["gop_seconds"] * frame_rate)))]
+    if threads > 0:
+        args += ['-threads', str(threads)]
+    return args
+
+
+# 生成音频编码的 ffmpeg 参数
+def get_audio_encode_args(profile) -> list:
+    args = ['-c:a', 'aac']
+    if profile.get("audio_bitrate"):
+        args += ['-b:a', profile["audio_bitrate"]]
+    return args
+
+
+# 自动测试候选编码参数（配置 + 不同 preset/crf 组合）
+def get_tune_candidates() -> dict:
+    candidates = {}
+    for name in ENCODE_PROFILES:
+        candidates[name] = get_encode_profile(name)
+    for preset in ("ultrafast", "veryfast", "medium"):
+        for crf in (20, 26, 32):
+            candidates["{}-crf{}".format(preset, crf)] = get_encode_profile(DEFAULT_ENCODE_PROFILE, preset=preset, crf=crf)
+    return candidates
+
+
+# 计算编码结果和原图的画质分数（ssim / psnr）
+def get_quality_score(video_file, img_file, video_size, metric="ssim"):
+    width, height = video_size.split("x")
+    lavfi = "[1:v]scale={}:{},format=yuv420p[ref];[0:v]format=yuv420p[out];[out][ref]{}".format(width, height, metric)
+    # 画质分数在 info 级别的日志中输出
+    try:
+        stderr = run_ffmpeg(['-i', video_file, '-loop', '1', '-i', img_file, '-lavfi', lavfi, '-shortest', '-f', 'null', '-'],
+                            name=metric, loglevel='info')["stderr"]
+    except FFmpegError:
+        return None
+    if metric == "ssim":
+        match = re.search(r'SSIM .*All:([0-9.]+)', stderr)
+    else:
+        match = re.search(r'PSNR .*average:([0-9.]+|inf)', stderr)
+    if match is None:
+        return None
+    return float(match.group(1))
+
+
+# 用样例分段测试多组编码参数
+def auto_tune_profiles(img_file, audio_file, output_dir, candidates=None, duration=30, frame_rate=1, threads=0) -> list:
+    """
+    用一张样例图片和样例音频，按每组候选参数编码一段视频，记录编码耗时、CPU时间、文件大小、码率和画质分数，
+    结果保存到 output_dir/encode_tune.json
+
+    参数：
+    img_file：str，样例图片
+    audio_file：str，样例音频
+    output_dir：str，测试视频和结果的保存目录
+    candidates：dict，候选参数 名称 -> 配置，None 表示使用 get_tune_candidates()
+    duration：float，测试视频时长（秒）
+    frame_rate：int，视频帧率
+    threads：int，编码线程数，0表示自动
+
+    返回值：
+    list，每组参数的测试结果
+    """
+    if candidates is None:
+        candidates = get_tune_candidates()
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    results = []
+    for name, profile in candidates.items():
+        output_file = os.path.join(output_dir, "tune_{}.mp4".format(name)).replace("\\", "/")
+        args = ['-y', '-loop', '1', '-framerate', str(frame_rate), '-i', img_file, '-i', audio_file, '-t', str(duration)]
+        args += get_video_encode_args(profile, frame_rate, threads)
+        args += get_audio_encode_args(profile)
+        args += ['-map', '0:v:0', '-map', '1:a:0', output_file]
+
+        # 耗时和CPU时间由 ffmpeg 执行记录提供（CPU时间只统计这一个 ffmpeg 进程）
+        try:
+            record = run_ffmpeg(args, name=name)
+        except FFmpegError as e:
+            print("Encode failed for candidate: {}\n{}".format(name, e.stderr))
+            continue
+        elapsed = record["wall_seconds"]
+        if not os.path.exists(output_file):
+            print("Encode failed for candidate: {}".format(name))
+            continue
+
+        # 码率按输出文件实际时长计算（样例音频比 duration 短时输出也会变短，按 duration 计算码率会偏低）
+        size = os.path.getsize(output_file)
+        try:
+            info = get_media_info(output_file)
+            output_duration = info.get("format_duration") or info["duration"]
+        except Exception as e:
+            print("Probe failed for candidate: {}, {}".format(name, e))
+            output_duration = 0
+        if output_duration <= 0:
+            output_duration = duration
+        result = {
+            "name": name,
+            "profile": profile,
+            "encode_seconds": round(elapsed, 3),
+            "cpu_seconds": record["cpu_seconds"],
+            "duration": round(output_duration, 3),
+            "speed": round(output_duration / elapsed, 2) if elapsed > 0 else None,
+            "size_bytes": size,
+            "bitrate_kbps": round(size * 8 / output_duration / 1000, 1),
+            "ssim": get_quality_score(output_file, img_file, profile["video_size"], "ssim"),
+            "psnr": get_quality_score(output_file, img_file, profile["video_size"], "psnr"),
+        }
+        print("{name}: {encode_seconds}s, {bitrate_kbps}kbps, ssim={ssim}, psnr={psnr}".format(**result))
+        results.append(result)
+
+    with open(os.path.join(output_dir, "encode_tune.json"), "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    return results
+
+
+# 从测试结果中选出满足码率预算（和最低画质）的最快参数
+def choose_profile(results: list, max_bitrate_kbps: float, min_ssim: float = 0):
+    fits = [r for r in results if r["bitrate_kbps"] <= max_bitrate_kbps and (r["ssim"] or 0) >= min_ssim]
+    if len(fits) == 0:
+        return None
+    return min(fits, key=lambda r: r["encode_seconds"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Encode a sample segment with candidate settings and pick the fastest one within budget")
+    parser.add_argument("--image", required=True, help="sample slide image")
+    parser.add_argument("--audio", required=True, help="sample audio file")
+    parser.add_argument("--output-dir", default="output/tune", help="directory for test videos and encode_tune.json")
+    parser.add_argument("--duration", type=float, default=30, help="sample duration in seconds")
+    parser.add_argument("--fps", type=int, default=1, help="video frame rate")
+    parser.add_argument("--budget", type=float, default=0, help="max bitrate in kbps (0 = no budget)")
+    parser.add_argument("--min-ssim", type=float, default=0, help="minimum ssim score")
+    args = parser.parse_args()
+
+    results = auto_tune_profiles(args.image, args.audio, args.output_dir, duration=args.duration, frame_rate=args.fps)
+    best = choose_profile(results, args.budget if args.budget > 0 else float("inf"), args.min_ssim)
+    if best is None:
+        print("No candidate fits the budget")
+        sys.exit(1)
+    print("Best: {}".format(best["name"]))
+    print(json.dumps(best["profile"], ensure_ascii=False, indent=2))
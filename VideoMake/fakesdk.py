@@ -0,0 +1,296 @@
+# -*- encoding: utf-8 -*-
+
+'''
+Fake Speech SDK
+本地模拟的 azure.cognitiveservices.speech，只实现本程序用到的接口，不访问网络
+语音合成返回正弦波+噪声的PCM（时长和文本长度成正比），语音识别按音频时长返回固定文本
+用于性能测试（bench）和没有网络的环境
+
+site: github.com/heiyeluren
+
+调用示例：
+from VideoMake import fakesdk
+fakesdk.install()     # 替换 audio / voice 模块中使用的 speechsdk
+
+'''
+
+import math
+import time
+import queue
+import array
+import random
+import datetime
+import threading
+
+
+# 每个字符对应的语音时长（秒），中文正常语速约每秒4-5个字
+SECONDS_PER_CHAR = 0.2
+
+# 每次请求模拟的网络延迟（秒）
+REQUEST_LATENCY = 0.0
+
+# 模拟识别时每多少秒音频返回一条识别结果
+RECOGNIZE_CHUNK_SECONDS = 5.0
+
+
+class ResultReason:
+    SynthesizingAudioCompleted = "SynthesizingAudioCompleted"
+    RecognizedSpeech = "RecognizedSpeech"
+    Canceled = "Canceled"
+
+
+class CancellationReason:
+    Error = "Error"
+    EndOfStream = "EndOfStream"
+
+
+class CancellationErrorCode:
+    NoError = "NoError"
+    AuthenticationFailure = "AuthenticationFailure"
+    BadRequest = "BadRequest"
+    TooManyRequests = "TooManyRequests"
+    Forbidden = "Forbidden"
+    ConnectionFailure = "ConnectionFailure"
+    ServiceTimeout = "ServiceTimeout"
+    ServiceError = "ServiceError"
+    ServiceUnavailable = "ServiceUnavailable"
+    RuntimeError = "RuntimeError"
+
+
+class SpeechSynthesisBoundaryType:
+    Word = "Word"
+    Punctuation = "Punctuation"
+    Sentence = "Sentence"
+
+
+class SpeechSynthesisOutputFormat:
+    Raw24Khz16BitMonoPcm = "Raw24Khz16BitMonoPcm"
+    Riff24Khz16BitMonoPcm = "Riff24Khz16BitMonoPcm"
+
+
+class SpeechConfig:
+    def __init__(self, subscription=None, region=None, **kwargs):
+        self.subscription = subscription
+        self.region = region
+        self.speech_synthesis_language = ''
+        self.speech_synthesis_voice_name = ''
+        self.speech_recognition_language = ''
+        self.output_format = SpeechSynthesisOutputFormat.Riff24Khz16BitMonoPcm
+
+    def set_speech_synthesis_output_format(self, output_format):
+        self.output_format = output_format
+
+
+class AudioOutputConfig:
+    def __init__(self, use_default_speaker=False, filename=None, **kwargs):
+        self.filename = filename
+
+
+class AudioConfig:
+    def __init__(self, use_default_microphone=False, filename=None, stream=None, **kwargs):
+        self.filename = filename
+        self.stream = stream
+
+
+class AudioStreamFormat:
+    def __init__(self, samples_per_second=16000, bits_per_sample=16, channels=1, **kwargs):
+        self.samples_per_second = samples_per_second
+        self.bits_per_sample = bits_per_sample
+        self.channels = channels
+
+
+# 推送流：写入的数据放入队列，由识别线程读取，close 后读取结束
+class PushAudioInputStream:
+    def __init__(self, stream_format=None, **kwargs):
+        self.stream_format = stream_format or AudioStreamFormat()
+        self.queue = queue.Queue()
+
+    def write(self, data):
+        self.queue.put(bytes(data))
+
+    def close(self):
+        self.queue.put(None)
+
+    def read_all(self):
+        while True:
+            data = self.queue.get()
+            if data is None:
+                return
+            yield data
+
+
+# 和 speechsdk.audio 一样提供子模块形式的访问
+class audio:
+    AudioOutputConfig = AudioOutputConfig
+    AudioConfig = AudioConfig
+    AudioStreamFormat = AudioStreamFormat
+    PushAudioInputStream = PushAudioInputStream
+
+
+class _Future:
+    def __init__(self, result):
+        self.result = result
+
+    def get(self):
+        return self.result
+
+
+class _CancellationDetails:
+    def __init__(self, reason=CancellationReason.Error, error_code=CancellationErrorCode.NoError, error_details=''):
+        self.reason = reason
+        self.error_code = error_code
+        self.error_details = error_details
+
+
+class _SynthesisResult:
+    def __init__(self, audio_data, reason=ResultReason.SynthesizingAudioCompleted):
+        self.audio_data = audio_data
+        self.reason = reason
+        self.cancellation_details = _CancellationDetails()
+
+
+# 生成指定时长的正弦波+噪声PCM（16bit 单声道）
+def make_pcm(seconds: float, sample_rate: int = 24000, frequency: float = 220.0, seed: int = 0) -> bytes:
+    frames = int(seconds * sample_rate)
+    # 生成一个周期再重复，避免逐个采样计算
+    period = max(1, int(sample_rate / frequency))
+    rnd = random.Random(seed)
+    block = array.array('h', [int(8000 * math.sin(2 * math.pi * i / period) + rnd.randint(-500, 500)) for i in range(period)])
+    data = block.tobytes() * (frames // period + 1)
+    return data[:frames * 2]
+
+
+class _WordBoundaryEvent:
+    def __init__(self, text, text_offset, audio_offset, duration, boundary_type):
+        self.text = text
+        self.text_offset = text_offset
+        self.word_length = len(text)
+        self.audio_offset = audio_offset
+        self.duration = duration
+        self.boundary_type = boundary_type
+
+
+class SpeechSynthesizer:
+    def __init__(self, speech_config=None, audio_config=None, **kwargs):
+        self.speech_config = speech_config
+        self.audio_config = audio_config
+        self.synthesis_word_boundary = _EventSignal()
+
+    def speak_text_async(self, text):
+        if REQUEST_LATENCY > 0:
+            time.sleep(REQUEST_LATENCY)
+        # 每个字符一个词边界事件，时间均匀分布
+        for i, char in enumerate(text):
+            if char.isspace():
+                continue
+            boundary_type = SpeechSynthesisBoundaryType.Word if char.isalnum() else SpeechSynthesisBoundaryType.Punctuation
+            evt = _WordBoundaryEvent(char, i, int(i * SECONDS_PER_CHAR * 10 ** 7), datetime.timedelta(seconds=SECONDS_PER_CHAR), boundary_type)
+            self.synthesis_word_boundary.fire(evt)
+        pcm = make_pcm(len(text) * SECONDS_PER_CHAR, seed=len(text))
+        if self.audio_config is not None and self.audio_config.filename:
+            AudioDataStream(_SynthesisResult(pcm)).save_to_wav_file(self.audio_config.filename)
+        return _Future(_SynthesisResult(pcm))
+
+
+class AudioDataStream:
+    def __init__(self, result):
+        self.result = result
+
+    def save_to_wav_file(self, filename):
+        import wave
+        with wave.open(filename, 'wb') as w:
+            w.setnchannels(1)
+            w.setsampwidth(2)
+            w.setframerate(24000)
+            w.writeframes(self.result.audio_data)
+        return True
+
+
+class _EventSignal:
+    def __init__(self):
+        self.callbacks = []
+
+    def connect(self, callback):
+        self.callbacks.append(callback)
+
+    def disconnect_all(self):
+        self.callbacks = []
+
+    def fire(self, evt):
+        for callback in list(self.callbacks):
+            callback(evt)
+
+
+class _RecognitionResult:
+    def __init__(self, text, offset=0, duration=0):
+        self.text = text
+        self.reason = ResultReason.RecognizedSpeech
+        self.offset = offset
+        self.duration = duration
+
+
+class _RecognitionEvent:
+    def __init__(self, result=None):
+        self.result = result
+        self.cancellation_details = _CancellationDetails(CancellationReason.EndOfStream)
+
+
+class SpeechRecognizer:
+    def __init__(self, speech_config=None, audio_config=None, **kwargs):
+        self.speech_config = speech_config
+        self.audio_config = audio_config
+        self.recognizing = _EventSignal()
+        self.recognized = _EventSignal()
+        self.session_started = _EventSignal()
+        self.session_stopped = _EventSignal()
+        self.canceled = _EventSignal()
+        self.thread = None
+
+    # 每满 RECOGNIZE_CHUNK_SECONDS 秒音频返回一条识别结果
+    def _recognize_until(self, offset, duration, final):
+        while offset < duration and (final or duration - offset >= RECOGNIZE_CHUNK_SECONDS):
+            if REQUEST_LATENCY > 0:
+                time.sleep(REQUEST_LATENCY)
+            chunk = min(RECOGNIZE_CHUNK_SECONDS, duration - offset)
+            # offset / duration 和 SDK 一样使用 100 纳秒为单位
+            result = _RecognitionResult("测试字幕文本", int(offset * 10 ** 7), int(chunk * 10 ** 7))
+            self.recognized.fire(_RecognitionEvent(result))
+            offset += chunk
+        return offset
+
+    def _run(self):
+        from .media import get_media_duration
+        self.session_started.fire(_RecognitionEvent())
+        stream = self.audio_config.stream
+        if stream is not None:
+            # 推送流：边接收数据边返回结果
+            fmt = stream.stream_format
+            bytes_per_second = fmt.samples_per_second * fmt.bits_per_sample // 8 * fmt.channels
+            received = 0
+            offset = 0.0
+            for data in stream.read_all():
+                received += len(data)
+                offset = self._recognize_until(offset, received / bytes_per_second, False)
+            self._recognize_until(offset, received / bytes_per_second, True)
+        else:
+            self._recognize_until(0.0, get_media_duration(self.audio_config.filename), True)
+        self.session_stopped.fire(_RecognitionEvent())
+
+    def start_continuous_recognition(self):
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop_continuous_recognition(self):
+        if self.thread is not None:
+            self.thread.join()
+
+
+# 替换各模块中使用的 speechsdk 为本模块
+def install():
+    import sys
+    from . import audio as audio_module
+    from . import voice as voice_module
+    fake = sys.modules[__name__]
+    audio_module.speechsdk = fake
+    voice_module.speechsdk = fake
+    return fake
@@ -0,0 +1,380 @@
+# -*- encoding: utf-8 -*-
+
+'''
+FFmpeg runner
+统一的 ffmpeg 调用：参数使用列表（不经过 shell，路径中有空格、引号也不会出错），
+解析 -progress 输出得到实时的帧率、速度、预计剩余时间，记录每次调用的耗时和CPU时间，
+失败时抛出带 stderr 内容的 FFmpegError，支持超时、取消，以及全局同时运行的 ffmpeg 进程数上限
+
+site: github.com/heiyeluren
+
+调用示例：
+run_ffmpeg(['-i', 'input/audio/01.wav', '-b:a', '192k', 'output/01.mp3'], name="mp3")
+
+# 带进度回调（duration 为输出时长，用于计算百分比和剩余时间）
+run_ffmpeg(args, name="final", duration=120, progress=lambda p: print(p["percent"], p["speed"], p["eta"]))
+
+# 通过 stdin 写入数据
+process = FFmpegProcess(['-f', 'rawvideo', ..., '-i', '-', ..., 'output.mp4'], stdin=True)
+process.stdin.write(data)
+process.stdin.close()
+process.wait()
+
+'''
+
+import os
+import sys
+import time
+import threading
+import subprocess
+from collections import deque
+
+from .deps import get_tool_command
+from .trace import add_span
+
+
+# 同时运行的 ffmpeg 进程数上限（所有线程共享，0表示不限）
+FFMPEG_MAX_PROCESSES = max(2, os.cpu_count() or 1)
+
+# 超过这个耗时（秒）的调用输出一行耗时统计，方便发现慢的编码
+FFMPEG_SLOW_SECONDS = 30
+
+# 保留的 stderr 行数（出错时附在异常中）
+FFMPEG_STDERR_LINES = 50
+
+# 保留的调用记录数
+FFMPEG_STATS_SIZE = 1000
+
+# 超时、取消的检查间隔（秒）
+FFMPEG_POLL_INTERVAL = 0.05
+
+_ffmpeg_slots = threading.BoundedSemaphore(FFMPEG_MAX_PROCESSES)
+_ffmpeg_slots_size = FFMPEG_MAX_PROCESSES
+_ffmpeg_stats = deque(maxlen=FFMPEG_STATS_SIZE)
+_ffmpeg_stats_lock = threading.Lock()
+
+
+# ffmpeg 执行失败（返回值不为0、超时、取消）
+class FFmpegError(Exception):
+    """
+    属性：
+    args_list：ffmpeg 参数列表
+    returncode：进程返回值（超时、取消时为被结束后的返回值）
+    stderr：ffmpeg 最后输出的错误信息
+    timeout：是否超时
+    canceled：是否被取消
+    """
+    def __init__(self, message, args_list=None, returncode=None, stderr='', timeout=False, canceled=False):
+        super().__init__(message)
+        self.args_list = args_list or []
+        self.returncode = returncode
+        self.stderr = stderr
+        self.timeout = timeout
+        self.canceled = canceled
+
+
+# 设置同时运行的 ffmpeg 进程数上限（在启动任何 ffmpeg 之前调用）
+def set_ffmpeg_concurrency(max_processes: int):
+    global _ffmpeg_slots, _ffmpeg_slots_size
+    _ffmpeg_slots_size = max_processes
+    _ffmpeg_slots = threading.BoundedSemaphore(max(1, max_processes))
+
+
+# 获取最近的 ffmpeg 调用记录
+def get_ffmpeg_stats() -> list:
+    """
+    返回值：
+    list，[{"name", "args", "wall_seconds", "cpu_seconds", "wait_seconds", "returncode"}, ...]，
+    cpu_seconds 在不支持的平台（Windows）上为 None，wait_seconds 是等待进程数上限的时间
+    """
+    with _ffmpeg_stats_lock:
+        return list(_ffmpeg_stats)
+
+
+# 清空 ffmpeg 调用记录
+def clear_ffmpeg_stats():
+    with _ffmpeg_stats_lock:
+        _ffmpeg_stats.clear()
+
+
+# wait4 返回的进程状态转换为返回值，和 Popen.returncode 一致（被信号结束时为负的信号编号）
+def decode_wait_status(status: int) -> int:
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    if os.WIFEXITED(status):
+        return os.WEXITSTATUS(status)
+    return status
+
+
+# 解析 -progress 输出中的时间（out_time_us / out_time_ms 的单位都是微秒）
+def parse_progress_time(values: dict):
+    for key in ("out_time_us", "out_time_ms"):
+        value = values.get(key, "")
+        if value.lstrip('-').isdigit():
+            return max(0, int(value)) / 1000000
+    return None
+
+
+# 解析 -progress 输出中的数字（N/A 等无效值返回 None）
+def parse_progress_number(value: str):
+    try:
+        return float(value.rstrip('x'))
+    except (AttributeError, ValueError):
+        return None
+
+
+# 一个 ffmpeg 进程
+class FFmpegProcess:
+    """
+    启动时先获取全局进程数名额（取消时不再等待），wait 结束后释放
+
+    参数：
+    args：list，ffmpeg 参数（不包含 ffmpeg 本身），自动加上 -hide_banner、-nostdin（stdin=True 时不加）、-progress
+    name：str，名称，用于进度回调、耗时统计和错误信息
+    duration：float，输出时长（秒），用于计算进度百分比和剩余时间，可选
+    progress：进度回调 progress(dict)，dict 包含 name、frame、fps、speed、out_time、percent、eta、elapsed、end，
+              没有的值为 None；stdout=True 时 stdout 用于输出数据，没有进度
+    timeout：float，超时时间（秒），超时后结束进程并抛出 FFmpegError
+    cancel_event：threading.Event，设置后结束进程并抛出 FFmpegError
+    cwd：str，工作目录
+    stdin：bool，是否通过 process.stdin 写入输入数据
+    stdout：bool，是否通过 process.stdout 读取输出数据
+    loglevel：str，ffmpeg 日志级别
+    """
+    def __init__(self, args: list, name: str = '', duration: float = None, progress=None, timeout: float = None,
+                 cancel_event=None, cwd: str = None, stdin: bool = False, stdout: bool = False, loglevel: str = 'error'):
+        self.args = list(args)
+        if not name and len(self.args) > 0:
+            name = os.path.basename(str(self.args[-1]))
+        self.name = name
+        self.duration = duration
+        self.progress_callback = progress
+        self.timeout = timeout
+        self.cancel_event = cancel_event
+        self.stderr_tail = deque(maxlen=FFMPEG_STDERR_LINES)
+        self.returncode = None
+        self.cpu_seconds = None
+        self.timed_out = False
+        self.canceled = False
+        self.record = None
+
+        cmd = [get_tool_command('ffmpeg'), '-hide_banner', '-loglevel', loglevel]
+        if not stdin:
+            cmd.append('-nostdin')
+        if not stdout:
+            cmd += ['-nostats', '-progress', 'pipe:1']
+        cmd += [str(arg) for arg in self.args]
+
+        wait_start = time.perf_counter()
+        self._acquire_slot()
+        self.wait_seconds = time.perf_counter() - wait_start
+        self.start_time = time.perf_counter()
+        try:
+            self.process = subprocess.Popen(cmd, cwd=cwd, stdin=subprocess.PIPE if stdin else subprocess.DEVNULL,
+                                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        except OSError as e:
+            self._release_slot()
+            raise FFmpegError("ffmpeg is not installed or failed to start: {}".format(e), self.args)
+        self.stdin = self.process.stdin
+        self.stdout = self.process.stdout if stdout else None
+
+        # stderr 和 -progress 输出由后台线程读取，避免管道写满阻塞 ffmpeg
+        self.threads = [threading.Thread(target=self._read_stderr, daemon=True)]
+        if not stdout:
+            self.threads.append(threading.Thread(target=self._read_progress, daemon=True))
+        for thread in self.threads:
+            thread.start()
+
+    # 获取进程数名额（等待时检查取消）
+    def _acquire_slot(self):
+        self.slots = _ffmpeg_slots if _ffmpeg_slots_size > 0 else None
+        if self.slots is None:
+            return
+        while not self.slots.acquire(timeout=FFMPEG_POLL_INTERVAL * 4):
+            if self.cancel_event is not None and self.cancel_event.is_set():
+                self.canceled = True
+                raise FFmpegError("ffmpeg canceled before start: {}".format(self.name), self.args, canceled=True)
+
+    def _release_slot(self):
+        if self.slots is not None:
+            self.slots.release()
+            self.slots = None
+
+    def _read_stderr(self):
+        for line in self.process.stderr:
+            self.stderr_tail.append(line.decode('utf-8', errors='ignore').rstrip())
+
+    # 解析 -progress 输出：key=value 逐行输出，每组以 progress=continue/end 结束
+    def _read_progress(self):
+        values = {}
+        for line in self.process.stdout:
+            key, _, value = line.decode('utf-8', errors='ignore').strip().partition('=')
+            if key != "progress":
+                values[key] = value
+                continue
+            if self.progress_callback is not None:
+                self.progress_callback(self._make_progress(values, value == "end"))
+            values = {}
+
+    def _make_progress(self, values: dict, end: bool) -> dict:
+        elapsed = time.perf_counter() - self.start_time
+        out_time = parse_progress_time(values)
+        speed = parse_progress_number(values.get("speed"))
+        if speed is None and out_time is not None and elapsed > 0:
+            speed = out_time / elapsed
+        percent = None
+        eta = None
+        if self.duration and out_time is not None:
+            percent = min(100.0, out_time * 100 / self.duration)
+            if speed:
+                eta = max(0.0, (self.duration - out_time) / speed)
+        frame = parse_progress_number(values.get("frame"))
+        return {
+            "name": self.name,
+            "frame": None if frame is None else int(frame),
+            "fps": parse_progress_number(values.get("fps")),
+            "speed": speed,
+            "out_time": out_time,
+            "percent": 100.0 if end else percent,
+            "eta": 0.0 if end else eta,
+            "elapsed": elapsed,
+            "end": end,
+        }
+
+    # 等待进程结束（同时检查超时和取消），Linux / macOS 上同时获取这个进程的CPU时间
+    def _wait_process(self):
+        deadline = None if self.timeout is None else self.start_time + self.timeout
+        while True:
+            if hasattr(os, 'wait4'):
+                try:
+                    pid, status, usage = os.wait4(self.process.pid, os.WNOHANG)
+                except ChildProcessError:
+                    # 进程已经被其他地方回收（没有CPU时间），由 Popen 给出返回值
+                    return self.process.wait()
+                if pid != 0:
+                    # wait4 已经回收了进程，Popen 不会再得到返回值，需要记录到 Popen 对象上（poll / wait 直接返回这个值）
+                    self.process.returncode = decode_wait_status(status)
+                    self.cpu_seconds = usage.ru_utime + usage.ru_stime
+                    return self.process.returncode
+            else:
+                try:
+                    return self.process.wait(timeout=FFMPEG_POLL_INTERVAL)
+                except subprocess.TimeoutExpired:
+                    pass
+            if deadline is not None and time.perf_counter() > deadline:
+                self.timed_out = True
+                self.kill()
+            elif self.cancel_event is not None and self.cancel_event.is_set() and not self.canceled:
+                self.canceled = True
+                self.kill()
+            if hasattr(os, 'wait4'):
+                time.sleep(FFMPEG_POLL_INTERVAL)
+
+    # 结束进程（不等待）
+    def kill(self):
+        if self.process.returncode is None:
+            try:
+                self.process.kill()
+            except OSError:
+                pass
+
+    # 等待结束，失败时抛出 FFmpegError
+    def wait(self) -> dict:
+        """
+        返回值：
+        dict，调用记录（格式见 get_ffmpeg_stats）
+        """
+        if self.record is not None:
+            return self.record
+        try:
+            if self.stdin is not None:
+                try:
+                    self.stdin.close()
+                except OSError:
+                    pass
+            returncode = self._wait_process()
+            for thread in self.threads:
+                thread.join()
+        finally:
+            self._release_slot()
+        for pipe in (self.process.stdout, self.process.stderr):
+            if pipe is not None:
+                pipe.close()
+        self.returncode = returncode
+
+        wall_seconds = time.perf_counter() - self.start_time
+        self.record = {
+            "name": self.name,
+            "args": self.args,
+            "wall_seconds": round(wall_seconds, 3),
+            "cpu_seconds": None if self.cpu_seconds is None else round(self.cpu_seconds, 3),
+            "wait_seconds": round(self.wait_seconds, 3),
+            "returncode": returncode,
+        }
+        with _ffmpeg_stats_lock:
+            _ffmpeg_stats.append(self.record)
+        add_span("ffmpeg", "ffmpeg", self.start_time, wall_seconds, {"name": self.name, "cpu_seconds": self.record["cpu_seconds"],
+                                                                     "wait_seconds": self.record["wait_seconds"], "returncode": returncode})
+        if wall_seconds > FFMPEG_SLOW_SECONDS:
+            print("Slow ffmpeg [{}]: {:.1f}s, cpu {}s".format(self.name, wall_seconds, self.record["cpu_seconds"]), file=sys.stderr)
+
+        stderr = "\n".join(self.stderr_tail)
+        if self.canceled:
+            raise FFmpegError("ffmpeg canceled: {}".format(self.name), self.args, returncode, stderr, canceled=True)
+        if self.timed_out:
+            raise FFmpegError("ffmpeg timed out after {}s: {}".format(self.timeout, self.name), self.args, returncode, stderr, timeout=True)
+        if returncode != 0:
+            raise FFmpegError("ffmpeg exited with code {}: {}\n{}".format(returncode, self.name, stderr), self.args, returncode, stderr)
+        return self.record
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.wait()
+        else:
+            # 调用方出错时结束 ffmpeg，不再等待编码，抛出调用方的异常
+            self.kill()
+            try:
+                self.wait()
+            except FFmpegError:
+                pass
+        return False
+
+
+# 创建输出进度的回调（进度每增加 step_percent 输出一行，没有时长时每 step_seconds 秒输出一行）
+def make_progress_printer(step_percent: float = 5, step_seconds: float = 10):
+    """
+    调用示例：
+    run_ffmpeg(args, name="final", duration=120, progress=make_progress_printer())
+    """
+    last = {"percent": -step_percent, "elapsed": 0}
+
+    def print_progress(p):
+        if p["percent"] is not None:
+            if p["percent"] - last["percent"] < step_percent and not p["end"]:
+                return
+            last["percent"] = p["percent"]
+        elif p["elapsed"] - last["elapsed"] < step_seconds and not p["end"]:
+            return
+        last["elapsed"] = p["elapsed"]
+        print("ffmpeg [{}]: {}% speed={} fps={} eta={} elapsed={:.1f}s".format(
+            p["name"], "-" if p["percent"] is None else "{:.1f}".format(p["percent"]),
+            "-" if p["speed"] is None else "{:.2f}x".format(p["speed"]), "-" if p["fps"] is None else p["fps"],
+            "-" if p["eta"] is None else "{:.0f}s".format(p["eta"]), p["elapsed"]))
+    return print_progress
+
+
+# 运行 ffmpeg 并等待结束，失败时抛出 FFmpegError
+def run_ffmpeg(args: list, name: str = '', duration: float = None, progress=None, timeout: float = None,
+               cancel_event=None, cwd: str = None, loglevel: str = 'error') -> dict:
+    """
+    参数含义见 FFmpegProcess
+
+    返回值：
+    dict，调用记录，另外包含 stderr（ffmpeg 最后输出的日志，比如 loglevel='info' 时的画质分数）
+    """
+    process = FFmpegProcess(args, name, duration, progress, timeout, cancel_event, cwd, loglevel=loglevel)
+    record = process.wait()
+    return dict(record, stderr="\n".join(process.stderr_tail))
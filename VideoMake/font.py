@@ -0,0 +1,67 @@
+# -*- encoding: utf-8 -*-
+
+'''
+Font registry
+字体加载和文字测量缓存：每个 (字体文件, 字号) 在进程内只加载一次，文字尺寸测量结果按行缓存
+
+site: github.com/heiyeluren
+
+'''
+
+from functools import lru_cache
+from PIL import ImageFont
+
+from .trace import span
+
+
+# 加载字体（msyh.ttc / msyhbd.ttc 这类中文字体文件有十几MB，进程内每个字号只解析一次）
+@lru_cache(maxsize=64)
+def get_font(font_file: str, font_size: int):
+    with span("font.load", "image", font=font_file, size=font_size):
+        return ImageFont.truetype(font_file, font_size)
+
+
+# 测量一行文字的边框 (left, top, right, bottom)，结果和 ImageDraw.textbbox((0, 0), text, font) 一致
+@lru_cache(maxsize=65536)
+def get_text_bbox(font_file: str, font_size: int, text: str) -> tuple:
+    return tuple(get_font(font_file, font_size).getbbox(text))
+
+
+# 测量一行文字的宽度
+def get_text_width(font_file: str, font_size: int, text: str) -> int:
+    bbox = get_text_bbox(font_file, font_size, text)
+    return bbox[2] - bbox[0]
+
+
+# 测量一行文字的高度
+def get_text_height(font_file: str, font_size: int, text: str) -> int:
+    bbox = get_text_bbox(font_file, font_size, text)
+    return bbox[3] - bbox[1]
+
+
+# 测量一行文字的排版宽度（包含行尾空格，用于换行时累加宽度）
+@lru_cache(maxsize=65536)
+def get_text_length(font_file: str, font_size: int, text: str) -> int:
+    return int(round(get_font(font_file, font_size).getlength(text)))
+
+
+# 字体行高（上升高度 + 下降高度，和文字内容无关，换行后每一行高度一致）
+@lru_cache(maxsize=256)
+def get_font_line_height(font_file: str, font_size: int) -> int:
+    ascent, descent = get_font(font_file, font_size).getmetrics()
+    return ascent + descent
+
+
+# 多行文字的统一行高（取最高的一行）
+def get_line_height(font_file: str, font_size: int, lines: list) -> int:
+    if len(lines) == 0:
+        return 0
+    return max([get_text_height(font_file, font_size, line) for line in lines])
+
+
+# 清空字体和测量缓存（字体文件被替换后使用）
+def clear_font_cache():
+    get_text_bbox.cache_clear()
+    get_text_length.cache_clear()
+    get_font_line_height.cache_clear()
+    get_font.cache_clear()
@@ -10,6 +10,7 @@ site: github.com/heiyeluren
 
 '''
 
+import io
 import os
 import subprocess
 from typing import List, Tuple
@@ -19,11 +20,29 @@ from . import defined
 from .defined import *
 from . import util
 from .util import *
+from .cache import FileCache, file_hash, hash_key, link_or_copy
+from . import layout
+from .layout import get_line_styles, fit_text_layout, draw_text_layout, LAYOUT_VERSION
+from .trace import span
+
+
+# 显示图片缓存（每个缓存目录一个对象，进程内复用）
+_slide_caches = {}
+
+
+# 获取显示图片缓存（容量检查使用进程内累加的占用空间，没有超过上限时不扫描缓存目录）
+def get_slide_cache() -> FileCache:
+    cache_dir = defined.SLIDE_CACHE_ROOT_PATH
+    cache = _slide_caches.get(cache_dir)
+    if cache is None:
+        cache = _slide_caches[cache_dir] = FileCache(get_slide_cache_dir_path(), SLIDE_CACHE_MAX_SIZE)
+    return cache
 
 
 # 添加文字到图片上
 def add_text_to_image(image_file: str, text: List[str], font_size: int, text_color: Tuple, bg_color: str, output_file: str, 
-                      bold_lines: int, bold_font_file = BOLD_FONT_FILE, normal_font_file = NORMAL_FONT_FILE):
+                      bold_lines: int, bold_font_file = BOLD_FONT_FILE, normal_font_file = NORMAL_FONT_FILE,
+                      valign: str = "top", line_styles: list = None, auto_fit: bool = True, line_markers: bool = False):
     
     """
     参数说明：
@@ -36,11 +55,17 @@ def add_text_to_image(image_file: str, text: List[str], font_size: int, text_col
         font_size : int : 字体的大小（磅值）
         text_color : str : 文本的颜色，格式为 "R, G, B"（整数值，范围为0-255）
         bg_color : str : 背景色，格式为 "R, G, B"（整数值，范围为0-255）
-        output_file : str : 输出图像的文件路径
+        output_file : str : 输出图像的文件路径（传 None 时不保存文件）
         bold_lines : int : 前多少行文本需要加粗显示
+        valign : str : 垂直对齐 top / middle / bottom（相对于画面安全区域）
+        line_styles : list : 每一行的样式（见 layout 模块），None 表示按 bold_lines 和行首标记
+        auto_fit : bool : 文字放不下时是否自动缩小字号（font_size 是最大字号）
+        line_markers : bool : 是否解析行首标记（"# " 标题、"## " 小标题、"- " 列表项），默认原样显示
+
+    超过安全区域宽度的行自动换行（中文按字、英文按单词），换行后高度超出时二分查找能放下的最大字号
 
     输出：
-        无返回值
+        Image : 绘制好的图片（RGBA）
 
     调用示例：
     image_file = "input.png"
@@ -76,7 +101,8 @@ def add_text_to_image(image_file: str, text: List[str], font_size: int, text_col
     """
     
     # 打开原始图像
-    base_image = Image.open(image_file).convert("RGBA")
+    with span("image.open", "image", file=os.path.basename(image_file)):
+        base_image = Image.open(image_file).convert("RGBA")
     # 创建 draw 对象
     draw = ImageDraw.Draw(base_image)
 
@@ -86,36 +112,43 @@ def add_text_to_image(image_file: str, text: List[str], font_size: int, text_col
     if normal_font_file == '':
         normal_font_file = NORMAL_FONT_FILE
 
-    bold_font = ImageFont.truetype(bold_font_file, font_size)
-    normal_font = ImageFont.truetype(normal_font_file, font_size)
-
-    # 设置文本行高
-    line_height = max([draw.textbbox((0, 0), line, font=bold_font)[3] - draw.textbbox((0, 0), line, font=bold_font)[1] for line in text])
-
-    # line_height = max([draw.textsize(line, font=bold_font)[1] for line in text])
-    text_height = 0
+    # 排版：每一行的样式（前面 bold_lines 行加粗 + 行首标记），自动换行、自动缩小字号
+    # 字体和文字测量都走进程内缓存，批量生成时不会重复解析字体文件
+    styles = get_line_styles(text, bold_lines, bold_font_file, normal_font_file, text_color, line_styles, line_markers)
+    text_layout = fit_text_layout(styles, base_image.width, base_image.height, font_size, valign=valign, auto_fit=auto_fit)
 
     # 绘制文本
-    # i = 0
-    # print(bold_lines)
-    # a = "aaaaaaa"
-    # A = "AAAAAAA"
-    # return
-    for i in range(len(text)):
-        line = text[i]
-        # font_type = normal_font
-        font_type = bold_font if i < bold_lines else normal_font  # 前面 bold_lines 行加粗
-        bbox = draw.textbbox((0, 0), line, font=font_type)
-        text_width, _ = bbox[2] - bbox[0], bbox[3] - bbox[1]
-        if line:  # 如果该行不为空，则绘制
-            draw.text(((base_image.width - text_width) // 2, text_height), line, fill=text_color, font=font_type)
-        text_height += line_height    
+    draw_text_layout(draw, text_layout)
+
+    # 不传输出文件时直接返回内存中的图片（用于直接编码视频，不生成中间图片文件）
+    if output_file is None or output_file == '':
+        return base_image
     # 保存图像
-    base_image.save(output_file)
+    with span("image.save", "image", file=os.path.basename(output_file)):
+        base_image.save(output_file)
+    return base_image
+
+
+# 计算显示图片的缓存key
+def get_slide_cache_key(bg_img_file, text, font_size, text_color, bg_color, bold_lines, normal_font_file, bold_font_file, valign="top", line_styles=None, line_markers=False):
+    """
+    缓存key：hash(背景图内容哈希, 文本内容, 字体文件, 字号, 颜色, 加粗行数, 输出分辨率, 排版参数)
+    字体文件较大，使用 路径+大小+修改时间 代替内容哈希
+    """
+    fonts = []
+    for font_file in (normal_font_file, bold_font_file):
+        st = os.stat(font_file)
+        fonts.append([font_file, st.st_size, st.st_mtime_ns])
+    # 只读取图片头信息获取分辨率，不解码图片
+    with Image.open(bg_img_file) as im:
+        size = im.size
+    # 排版版本和排版常量变化时重新绘制
+    layout_params = [LAYOUT_VERSION, layout.LAYOUT_SAFE_MARGIN, layout.LAYOUT_MIN_FONT_SIZE, layout.LAYOUT_LINE_SPACING, valign, line_styles, line_markers]
+    return hash_key(file_hash(bg_img_file), text, fonts, font_size, text_color, bg_color, bold_lines, size, layout_params)
 
 
 # 绘制文本到图片基础函数
-def draw_text2img_base(input_text_file, output_img_file, bg_img_file, font_size, text_color, bg_color, bold_lines, normal_font_file, bold_font_file):
+def draw_text2img_base(input_text_file, output_img_file, bg_img_file, font_size, text_color, bg_color, bold_lines, normal_font_file, bold_font_file, use_cache=True, valign="top", line_styles=None, line_markers=False):
     # 输入文字的参数
     # fontfile = BOLD_FONT_FILE # 字体文件的全路径
     # fontcolor = "white" # 字体颜色
@@ -136,39 +169,90 @@ def draw_text2img_base(input_text_file, output_img_file, bg_img_file, font_size,
 
 
     text = get_file_contents(input_text_file)
-    add_text_to_image(bg_img_file, text, font_size, text_color, bg_color, output_img_file, bold_lines, bold_font_file=bold_font_file, normal_font_file=normal_font_file)   
+
+    if bold_font_file == '':
+        bold_font_file = BOLD_FONT_FILE
+    if normal_font_file == '':
+        normal_font_file = NORMAL_FONT_FILE
+
+    # 不传输出文件时返回内存中的图片（分段视频直接编码），同样使用缓存：只有语音变化时不重新绘制
+    if output_img_file is None or output_img_file == '':
+        if use_cache is False:
+            return add_text_to_image(bg_img_file, text, font_size, text_color, bg_color, None, bold_lines, bold_font_file=bold_font_file, normal_font_file=normal_font_file,
+                                     valign=valign, line_styles=line_styles, line_markers=line_markers)
+        cache = get_slide_cache()
+        key = get_slide_cache_key(bg_img_file, text, font_size, text_color, bg_color, bold_lines, normal_font_file, bold_font_file, valign, line_styles, line_markers)
+        cached_file = cache.get(key, PNG_SUFFIX)
+        if cached_file is not None:
+            with span("image.open", "image", file=os.path.basename(cached_file), cache=True):
+                with Image.open(cached_file) as cached_image:
+                    return cached_image.convert("RGBA")
+        image = add_text_to_image(bg_img_file, text, font_size, text_color, bg_color, None, bold_lines, bold_font_file=bold_font_file, normal_font_file=normal_font_file,
+                                  valign=valign, line_styles=line_styles, line_markers=line_markers)
+        with span("image.save", "image", file=key + PNG_SUFFIX, cache=True):
+            buffer = io.BytesIO()
+            image.save(buffer, format="PNG")
+        cache.put_bytes(key, PNG_SUFFIX, buffer.getvalue())
+        cache.evict()
+        return image
+
+    # 输出文件可能是缓存文件的硬链接，先删除再写入，避免修改到缓存内容
+    if os.path.exists(output_img_file):
+        os.remove(output_img_file)
+
+    if use_cache is False:
+        add_text_to_image(bg_img_file, text, font_size, text_color, bg_color, output_img_file, bold_lines, bold_font_file=bold_font_file, normal_font_file=normal_font_file,
+                          valign=valign, line_styles=line_styles, line_markers=line_markers)
+        return output_img_file
+
+    # 背景、文字、样式都没有变化时直接使用缓存的图片（硬链接），不重新绘制
+    cache = get_slide_cache()
+    key = get_slide_cache_key(bg_img_file, text, font_size, text_color, bg_color, bold_lines, normal_font_file, bold_font_file, valign, line_styles, line_markers)
+    cached_file = cache.get(key, PNG_SUFFIX)
+    if cached_file is not None:
+        link_or_copy(cached_file, output_img_file)
+        return output_img_file
+
+    add_text_to_image(bg_img_file, text, font_size, text_color, bg_color, output_img_file, bold_lines, bold_font_file=bold_font_file, normal_font_file=normal_font_file,
+                      valign=valign, line_styles=line_styles, line_markers=line_markers)
+    cache.put_file(key, PNG_SUFFIX, output_img_file)
+    cache.evict()
+    return output_img_file
 
 
 
 # 首页图片文字绘制
 '''
-字体大小：100
+字体大小：100（最大字号，放不下时自动缩小）
 字体颜色：深灰色
 背景颜色：白色
 输出内容前多少行加粗显示: 10行
+垂直对齐：顶部（valign="middle" 时居中）
 '''
-def draw_first_page(text_file, output_img_file, bg_img_file, font_size=100, text_color=(64, 64, 64), bg_color="0, 0, 0", bold_lines=10, normal_font_file = BOLD_FONT_FILE, bold_font_file = BOLD_FONT_FILE):
-     draw_text2img_base(text_file, output_img_file, bg_img_file, font_size, text_color, bg_color, bold_lines, normal_font_file, bold_font_file)
+def draw_first_page(text_file, output_img_file, bg_img_file, font_size=100, text_color=(64, 64, 64), bg_color="0, 0, 0", bold_lines=10, normal_font_file = BOLD_FONT_FILE, bold_font_file = BOLD_FONT_FILE, use_cache=True, valign="top", line_styles=None, line_markers=False):
+    return draw_text2img_base(text_file, output_img_file, bg_img_file, font_size, text_color, bg_color, bold_lines, normal_font_file, bold_font_file, use_cache, valign, line_styles, line_markers)
 
 
 # 内容页图片文字绘制
 '''
-字体大小: 70
+字体大小: 70（最大字号，放不下时自动缩小）
 字体颜色：深灰色
 背景颜色：白色
 输出内容前多少行加粗显示: 1行
+垂直对齐：顶部（valign="middle" 时居中）
 '''
-def draw_contents_page(text_file, output_img_file, bg_img_file, font_size=70, text_color=(64, 64, 64), bg_color="0, 0, 0", bold_lines=1, normal_font_file = BOLD_FONT_FILE, bold_font_file = BOLD_FONT_FILE):
-    draw_text2img_base(text_file, output_img_file, bg_img_file, font_size, text_color, bg_color, bold_lines, normal_font_file, bold_font_file)
+def draw_contents_page(text_file, output_img_file, bg_img_file, font_size=70, text_color=(64, 64, 64), bg_color="0, 0, 0", bold_lines=1, normal_font_file = BOLD_FONT_FILE, bold_font_file = BOLD_FONT_FILE, use_cache=True, valign="top", line_styles=None, line_markers=False):
+    return draw_text2img_base(text_file, output_img_file, bg_img_file, font_size, text_color, bg_color, bold_lines, normal_font_file, bold_font_file, use_cache, valign, line_styles, line_markers)
 
 
 # 尾页图片文字绘制
 '''
-字体大小：100
+字体大小：100（最大字号，放不下时自动缩小）
 字体颜色：深灰色
 背景颜色：白色
 输出内容前多少行加粗显示: 10行
+垂直对齐：顶部（valign="middle" 时居中）
 '''
-def draw_end_page(text_file, output_img_file, bg_img_file, font_size=100, text_color=(64, 64, 64), bg_color="0, 0, 0", bold_lines=10, normal_font_file = BOLD_FONT_FILE, bold_font_file = BOLD_FONT_FILE):
-    draw_text2img_base(text_file, output_img_file, bg_img_file, font_size, text_color, bg_color, bold_lines, normal_font_file, bold_font_file)
+def draw_end_page(text_file, output_img_file, bg_img_file, font_size=100, text_color=(64, 64, 64), bg_color="0, 0, 0", bold_lines=10, normal_font_file = BOLD_FONT_FILE, bold_font_file = BOLD_FONT_FILE, use_cache=True, valign="top", line_styles=None, line_markers=False):
+    return draw_text2img_base(text_file, output_img_file, bg_img_file, font_size, text_color, bg_color, bold_lines, normal_font_file, bold_font_file, use_cache, valign, line_styles, line_markers)
 
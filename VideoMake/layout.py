@@ -0,0 +1,281 @@
+# -*- encoding: utf-8 -*-
+
+'''
+Slide text layout
+显示图片的文字排版：按画面安全区域自动换行（中文按字、英文按单词，避免标点出现在行首），
+在最大字号和最小字号之间二分查找能放下全部文字的最大字号，支持垂直居中和每一行单独的样式
+默认排版和原来一致（顶部对齐、居中显示、原样输出每一行文字），只有放不下时才换行、缩小字号
+
+字号不再需要按页面类型手工调整：draw_first_page 的 100、draw_contents_page 的 70 是最大字号，
+文字放不下时自动缩小；文字测量走 font 模块的进程内缓存，换行结果也按 (文字, 字体, 字号, 宽度) 缓存，
+一张图片只需要几次测量（字号二分查找 log2(最大-最小) 次，而不是逐个字号尝试）
+
+site: github.com/heiyeluren
+
+行样式（line_styles 中的每一项，没有的键使用默认值，None 表示使用默认样式）：
+{
+    "bold": True,            # 是否使用粗体字体
+    "font_file": "...",      # 指定字体文件（优先于 bold）
+    "scale": 1.2,            # 相对字号（标题可以比正文大）
+    "color": (64, 64, 64),   # 文字颜色
+    "align": "center",       # 水平对齐 left / center / right
+}
+
+文本文件中的行标记（写在行首，绘制时去掉；需要 line_markers=True 开启，默认按原文字显示）：
+"# 标题"   粗体，字号放大 1.3 倍
+"## 小标题" 粗体
+"- 列表项"  左对齐，显示为 "• 列表项"
+
+调用示例：
+styles = get_line_styles(lines, bold_lines=1, bold_font_file=BOLD_FONT_FILE, normal_font_file=NORMAL_FONT_FILE, text_color=(64, 64, 64), line_markers=True)
+layout = fit_text_layout(styles, 1920, 1080, max_font_size=70, valign="middle")
+draw_text_layout(ImageDraw.Draw(image), layout)
+
+'''
+
+import unicodedata
+from functools import lru_cache
+
+from .font import get_font, get_text_length, get_font_line_height
+from .trace import span
+
+
+# 排版版本（排版规则变化时修改，已经生成的图片和分段视频会重新生成）
+LAYOUT_VERSION = 2
+
+# 画面安全区域：四周留出的边距（占画面宽、高的比例）
+LAYOUT_SAFE_MARGIN = 0.05
+
+# 自动缩小时的最小字号
+LAYOUT_MIN_FONT_SIZE = 24
+
+# 行距（相对于字体行高）
+LAYOUT_LINE_SPACING = 1.0
+
+# 行首标记 -> (样式, 替换成的前缀)
+LAYOUT_LINE_MARKERS = [
+    ("## ", {"bold": True}, ""),
+    ("# ", {"bold": True, "scale": 1.3}, ""),
+    ("- ", {"align": "left"}, "• "),
+]
+
+# 不能出现在行首的标点（放到上一行末尾）
+LAYOUT_NO_LINE_START = set("，。、；：？！）】》」』”’,.;:?!)]}%…—～·")
+
+# 不能出现在行尾的标点（和下一个字放在同一行）
+LAYOUT_NO_LINE_END = set("（【《「『“‘([{")
+
+
+# 判断是否是可以在任意位置换行的字符（中日韩文字和全角标点）
+def is_wide_char(char: str) -> bool:
+    return unicodedata.east_asian_width(char) in ("W", "F")
+
+
+# 把一行文字切分为换行单位：中文每个字一个单位，英文单词（连同后面的空格）一个单位，标点附在相邻的单位上
+def split_wrap_tokens(text: str) -> list:
+    tokens = []
+    word = ''
+    for char in text:
+        if is_wide_char(char) or char in LAYOUT_NO_LINE_START or char in LAYOUT_NO_LINE_END:
+            if word:
+                tokens.append(word)
+                word = ''
+            tokens.append(char)
+        elif char == ' ':
+            word += char
+            tokens.append(word)
+            word = ''
+        else:
+            # 英文单词中间不能断开；单词前面是中文时也单独成为一个单位
+            if word.endswith(' '):
+                tokens.append(word)
+                word = ''
+            word += char
+    if word:
+        tokens.append(word)
+
+    # 行首禁用的标点（和标点后面的空格）合并到前一个单位，行尾禁用的标点合并到后一个单位
+    merged = []
+    pending = ''
+    for token in tokens:
+        if (token in LAYOUT_NO_LINE_START or token.strip() == '') and len(merged) > 0 and pending == '':
+            merged[-1] += token
+        elif token in LAYOUT_NO_LINE_END:
+            pending += token
+        else:
+            merged.append(pending + token)
+            pending = ''
+    if pending:
+        merged.append(pending)
+    return merged
+
+
+# 一行文字按最大宽度换行（结果缓存，同一张图片二分查找字号、重复生成时不重复计算）
+@lru_cache(maxsize=16384)
+def wrap_line(text: str, font_file: str, font_size: int, max_width: int) -> tuple:
+    """
+    参数：
+    text：str，一行文字（不包含换行符）
+    font_file：str，字体文件
+    font_size：int，字号
+    max_width：int，最大宽度（像素）
+
+    返回值：
+    tuple，换行后的每一行（行尾空格去掉）
+    """
+    if text.strip() == '':
+        return ('',)
+    lines = []
+    line = ''
+    line_width = 0
+    for token in split_wrap_tokens(text):
+        token_width = get_text_length(font_file, font_size, token)
+        # 单个单位（很长的英文单词、网址）比一行还宽时按字符拆开
+        if token_width > max_width:
+            if line.strip():
+                lines.append(line.rstrip())
+            line, line_width = '', 0
+            for char in token:
+                char_width = get_text_length(font_file, font_size, char)
+                if line and line_width + char_width > max_width:
+                    lines.append(line.rstrip())
+                    line, line_width = '', 0
+                line += char
+                line_width += char_width
+            continue
+        # 按单位宽度累加判断，行尾空格不计入宽度
+        if line and line_width + get_text_length(font_file, font_size, token.rstrip()) > max_width:
+            lines.append(line.rstrip())
+            line, line_width = '', 0
+            token = token.lstrip()
+        line += token
+        line_width += token_width
+    if line.strip() or len(lines) == 0:
+        lines.append(line.rstrip())
+
+    # 单位宽度之和和整行宽度有细微差别（字距调整），整行超出时把最后一个字移到下一行
+    result = []
+    while len(lines) > 0:
+        line = lines.pop(0)
+        while len(line) > 1 and get_text_length(font_file, font_size, line) > max_width:
+            lines.insert(0, line[-1] + (lines.pop(0) if len(lines) > 0 else ''))
+            line = line[:-1]
+        result.append(line)
+    return tuple(result)
+
+
+# 解析每一行的样式：bold_lines（前几行加粗）+ 行首标记（开启时）+ 调用方指定的行样式
+def get_line_styles(lines: list, bold_lines: int, bold_font_file: str, normal_font_file: str, text_color, line_styles: list = None,
+                    line_markers: bool = False) -> list:
+    """
+    参数：
+    line_markers：bool，是否解析行首标记（"# "、"## "、"- "），默认 False，以这些字符开头的行原样显示
+
+    返回值：
+    list，每一行一个 dict：{"text", "font_file", "scale", "color", "align"}，text 是去掉行首标记后的文字
+    """
+    result = []
+    for i, line in enumerate(lines):
+        style = {"bold": i < bold_lines, "scale": 1.0, "color": text_color, "align": "center"}
+        for marker, marker_style, prefix in (LAYOUT_LINE_MARKERS if line_markers else []):
+            if line.startswith(marker):
+                style.update(marker_style)
+                line = prefix + line[len(marker):]
+                break
+        if line_styles is not None and i < len(line_styles) and line_styles[i]:
+            style.update(line_styles[i])
+        font_file = style.get("font_file") or (bold_font_file if style["bold"] else normal_font_file)
+        result.append({"text": line, "font_file": font_file, "scale": style["scale"], "color": style["color"], "align": style["align"]})
+    return result
+
+
+# 按指定字号排版，返回排版结果（不检查高度）
+def layout_text(styles: list, font_size: int, box_width: int, line_spacing: float = LAYOUT_LINE_SPACING) -> dict:
+    """
+    返回值：
+    dict，{"font_size", "width", "height", "lines": [{"text", "font_file", "font_size", "color", "align", "width", "height"}, ...]}
+    """
+    lines = []
+    height = 0
+    width = 0
+    for style in styles:
+        size = max(1, int(round(font_size * style["scale"])))
+        line_height = int(round(get_font_line_height(style["font_file"], size) * line_spacing))
+        for text in wrap_line(style["text"], style["font_file"], size, box_width):
+            text_width = get_text_length(style["font_file"], size, text) if text else 0
+            lines.append({"text": text, "font_file": style["font_file"], "font_size": size, "color": style["color"],
+                          "align": style["align"], "width": text_width, "height": line_height})
+            height += line_height
+            width = max(width, text_width)
+    return {"font_size": font_size, "width": width, "height": height, "lines": lines}
+
+
+# 二分查找能放下全部文字的最大字号并排版
+def fit_text_layout(styles: list, image_width: int, image_height: int, max_font_size: int, min_font_size: int = LAYOUT_MIN_FONT_SIZE,
+                    margin: float = LAYOUT_SAFE_MARGIN, line_spacing: float = LAYOUT_LINE_SPACING, valign: str = "top", auto_fit: bool = True) -> dict:
+    """
+    参数：
+    styles：list，get_line_styles 的结果
+    image_width / image_height：int，画面尺寸
+    max_font_size：int，最大字号（文字放得下时使用这个字号）
+    min_font_size：int，最小字号（最小字号也放不下时使用最小字号，超出部分被裁掉并输出警告）
+    margin：float，安全区域边距（占画面宽、高的比例）
+    valign：str，垂直对齐 top / middle / bottom
+    auto_fit：bool，是否自动缩小字号（False 时只换行，使用 max_font_size）
+
+    返回值：
+    dict，layout_text 的结果，另外包含 "x"、"y"（安全区域左上角）、"box_width"、"box_height"、"top"（第一行的位置）、"fits"
+    """
+    box_x = int(image_width * margin)
+    box_y = int(image_height * margin)
+    box_width = image_width - 2 * box_x
+    box_height = image_height - 2 * box_y
+    min_font_size = min(min_font_size, max_font_size)
+
+    with span("layout.fit", "image", lines=len(styles), max_font_size=max_font_size) as fit_span:
+        layout = layout_text(styles, max_font_size, box_width, line_spacing)
+        if auto_fit and layout["height"] > box_height:
+            # 二分查找：low 一定放得下（或者是最小字号），high 放不下
+            low, high = min_font_size, max_font_size
+            best = layout_text(styles, low, box_width, line_spacing)
+            while best["height"] <= box_height and high - low > 1:
+                middle = (low + high) // 2
+                candidate = layout_text(styles, middle, box_width, line_spacing)
+                if candidate["height"] <= box_height:
+                    low, best = middle, candidate
+                else:
+                    high = middle
+            layout = best
+        fit_span.set(font_size=layout["font_size"])
+
+    layout["fits"] = layout["height"] <= box_height
+    if not layout["fits"]:
+        print("Warning: slide text does not fit at font size {}, overflowing lines are clipped".format(layout["font_size"]))
+    if valign == "middle":
+        top = box_y + max(0, (box_height - layout["height"]) // 2)
+    elif valign == "bottom":
+        top = box_y + max(0, box_height - layout["height"])
+    else:
+        top = box_y
+    layout.update({"x": box_x, "y": box_y, "box_width": box_width, "box_height": box_height, "top": top})
+    return layout
+
+
+# 按排版结果绘制文字
+def draw_text_layout(draw, layout: dict):
+    y = layout["top"]
+    for line in layout["lines"]:
+        if line["text"]:
+            if line["align"] == "left":
+                x = layout["x"]
+            elif line["align"] == "right":
+                x = layout["x"] + layout["box_width"] - line["width"]
+            else:
+                x = layout["x"] + (layout["box_width"] - line["width"]) // 2
+            draw.text((int(x), y), line["text"], fill=line["color"], font=get_font(line["font_file"], line["font_size"]))
+        y += line["height"]
+
+
+# 清空换行缓存（字体文件被替换后使用）
+def clear_layout_cache():
+    wrap_line.cache_clear()
@@ -0,0 +1,201 @@
+# -*- encoding: utf-8 -*-
+
+'''
+Media metadata probe
+媒体文件信息读取：wav 直接解析文件头，其他格式调用一次 ffprobe，结果按 (路径, 大小, 修改时间) 缓存
+
+site: github.com/heiyeluren
+
+'''
+
+import os
+import json
+import wave
+import struct
+import threading
+import subprocess
+
+from .ffmpeg import FFmpegProcess
+from .deps import get_tool_command
+from .trace import span
+
+
+# 流式提取音频时每次读取的字节数
+PCM_CHUNK_SIZE = 64 * 1024
+
+# wav 声道布局（按声道数推断）
+WAV_CHANNEL_LAYOUTS = {1: "mono", 2: "stereo", 3: "2.1", 4: "quad", 6: "5.1", 8: "7.1"}
+
+# 已经读取过的媒体信息：(路径, 大小, 修改时间) -> 信息
+_media_info_cache = {}
+_media_info_lock = threading.Lock()
+
+
+# 解析 wav 文件头
+def probe_wav(file_path: str) -> dict:
+    """
+    只读取 RIFF 文件头中的 fmt 和 data 块信息，不读取音频数据，耗时和文件大小无关
+
+    返回值：
+    dict，包含 duration（秒）、sample_rate、channels、channel_layout、sample_width（字节）、frames、
+    format_tag（1为整数PCM，3为浮点，扩展格式取实际格式）、data_offset（音频数据在文件中的位置）
+    """
+    with open(file_path, 'rb') as f:
+        riff = f.read(12)
+        if len(riff) < 12 or riff[0:4] not in (b'RIFF', b'RF64') or riff[8:12] != b'WAVE':
+            raise Exception("Not a wav file: {}".format(file_path))
+        file_size = os.fstat(f.fileno()).st_size
+
+        fmt = None
+        data_size = None
+        data_offset = None
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                break
+            chunk_id, chunk_size = struct.unpack('<4sI', header)
+            skip = chunk_size + (chunk_size & 1)
+            if chunk_id == b'fmt ':
+                fmt = f.read(chunk_size)
+                skip -= len(fmt)
+            elif chunk_id == b'data':
+                # 流式写入的 wav 文件 data 块大小可能没有回填（0 或 0xFFFFFFFF），按文件实际大小计算
+                data_size = chunk_size
+                data_offset = f.tell()
+                if data_size == 0 or data_size == 0xFFFFFFFF or f.tell() + data_size > file_size:
+                    data_size = file_size - f.tell()
+                if fmt is not None:
+                    break
+            f.seek(skip, os.SEEK_CUR)
+
+    if fmt is None or data_size is None or len(fmt) < 16:
+        raise Exception("Invalid wav header: {}".format(file_path))
+
+    format_tag, channels, sample_rate, byte_rate, block_align, bits = struct.unpack('<HHIIHH', fmt[:16])
+    # 扩展格式的实际格式在 SubFormat GUID 的前两个字节
+    if format_tag == 0xFFFE and len(fmt) >= 26:
+        format_tag = struct.unpack('<H', fmt[24:26])[0]
+    channel_layout = WAV_CHANNEL_LAYOUTS.get(channels, "{} channels".format(channels))
+    if block_align == 0 or sample_rate == 0:
+        raise Exception("Invalid wav header: {}".format(file_path))
+    frames = data_size // block_align
+    return {
+        "duration": frames / sample_rate,
+        "sample_rate": sample_rate,
+        "channels": channels,
+        "channel_layout": channel_layout,
+        "sample_width": bits // 8,
+        "frames": frames,
+        "format_tag": format_tag,
+        "data_offset": data_offset,
+    }
+
+
+# 调用 ffprobe 读取媒体信息（mp3、mp4 等非 wav 格式）
+def probe_ffprobe(file_path: str) -> dict:
+    cmd = [get_tool_command('ffprobe'), '-v', 'error', '-print_format', 'json', '-show_format', '-show_streams', file_path]
+    try:
+        with span("ffprobe", "ffmpeg", file=os.path.basename(file_path)):
+            output = subprocess.check_output(cmd)
+    except (OSError, subprocess.CalledProcessError) as e:
+        raise Exception("ffprobe failed for {}: {}".format(file_path, e))
+    info = json.loads(output.decode('utf-8', errors='ignore'))
+
+    format_duration = float(info.get("format", {}).get("duration", 0) or 0)
+    result = {
+        "duration": format_duration,
+        "format_duration": format_duration,   # 整个文件的时长（duration 有音频流时是音频流的时长）
+        "sample_rate": 0,
+        "channels": 0,
+        "channel_layout": "",
+        "sample_width": 0,
+        "frames": 0,
+    }
+    for stream in info.get("streams", []):
+        if stream.get("codec_type") != "audio":
+            continue
+        result["sample_rate"] = int(stream.get("sample_rate", 0) or 0)
+        result["channels"] = int(stream.get("channels", 0) or 0)
+        result["channel_layout"] = stream.get("channel_layout", "")
+        result["sample_width"] = int(stream.get("bits_per_sample", 0) or 0) // 8
+        if stream.get("duration"):
+            result["duration"] = float(stream["duration"])
+        if result["sample_rate"] > 0:
+            result["frames"] = int(round(result["duration"] * result["sample_rate"]))
+        break
+    return result
+
+
+# 获取媒体文件信息（带缓存）
+def get_media_info(file_path: str) -> dict:
+    """
+    获取媒体文件的时长、采样率、声道等信息，文件没有变化时直接返回缓存结果
+
+    调用示例：
+    info = get_media_info("input/audio/01.wav")
+    print(info["duration"], info["sample_rate"], info["channels"])
+    """
+    file_path = file_path.replace("\\", "/")
+    if not os.path.exists(file_path):
+        raise Exception("media file is not exists: {}".format(file_path))
+    st = os.stat(file_path)
+    key = (os.path.abspath(file_path), st.st_size, st.st_mtime_ns)
+    with _media_info_lock:
+        info = _media_info_cache.get(key)
+    if info is not None:
+        return dict(info)
+
+    if file_path.lower().endswith(".wav"):
+        try:
+            info = probe_wav(file_path)
+        except Exception:
+            info = probe_ffprobe(file_path)
+    else:
+        info = probe_ffprobe(file_path)
+
+    with _media_info_lock:
+        _media_info_cache[key] = info
+    return dict(info)
+
+
+# 获取媒体文件时长（秒）
+def get_media_duration(file_path: str) -> float:
+    return get_media_info(file_path)["duration"]
+
+
+# 流式解码任意媒体文件的音频，按固定大小逐块返回 16bit PCM 数据
+def iter_media_pcm(file_path: str, sample_rate: int = 16000, channels: int = 1, chunk_size: int = PCM_CHUNK_SIZE):
+    """
+    ffmpeg 解码后的 PCM 通过管道逐块读取，内存占用只和 chunk_size 有关，和媒体时长无关
+
+    调用示例：
+    for pcm in iter_media_pcm("input/video/base.mp4"):
+        push_stream.write(pcm)
+    """
+    if not os.path.exists(file_path):
+        raise Exception("media file is not exists: {}".format(file_path))
+    args = ['-i', file_path, '-vn', '-ac', channels, '-ar', sample_rate, '-f', 's16le', '-']
+    # 调用方提前结束（异常、取消）时结束 ffmpeg；解码失败时抛出带 stderr 的 FFmpegError
+    with FFmpegProcess(args, name=os.path.basename(file_path), stdout=True) as proc:
+        while True:
+            data = proc.stdout.read(chunk_size)
+            if not data:
+                break
+            yield data
+
+
+# 流式提取媒体文件的音频保存为 wav（边解码边写入，内存占用固定）
+def extract_audio_to_wav(file_path: str, output_wav_file: str, sample_rate: int = 16000, channels: int = 1, chunk_size: int = PCM_CHUNK_SIZE) -> float:
+    """
+    返回值：
+    float，音频时长（秒）
+    """
+    frames = 0
+    with wave.open(output_wav_file, 'wb') as w:
+        w.setnchannels(channels)
+        w.setsampwidth(2)
+        w.setframerate(sample_rate)
+        for pcm in iter_media_pcm(file_path, sample_rate, channels, chunk_size):
+            w.writeframesraw(pcm)
+            frames += len(pcm) // (2 * channels)
+    return frames / sample_rate
@@ -0,0 +1,214 @@
+# -*- encoding: utf-8 -*-
+
+'''
+Segment pipeline
+分段流水线：每个分段依次经过 语音合成 -> 绘制显示图片 -> 视频编码，前一步完成后立即进入下一步，
+不用等所有分段的语音都合成完再开始绘图和编码
+
+语音合成主要是等待网络（线程池），绘图是 Pillow 计算（进程池，不受 GIL 限制），编码是等待 ffmpeg 子进程（线程池），
+三步同时进行：第 N 个分段编码时第 N+1 个分段正在合成语音，总耗时接近最慢的一步单独运行的时间
+步骤之间是有长度上限的队列，下游处理不过来时上游暂停，已经画好等待编码的图片不会无限堆积
+
+site: github.com/heiyeluren
+
+调用示例：
+run_segment_pipeline(graph, [(voice_artifact, segment_artifact), ...], build_voice, draw_segment, encode_segment,
+                     tts_workers=4, draw_workers=4, encode_workers=4)
+
+'''
+
+import os
+import asyncio
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from . import defined
+from .trace import span, take_trace_events, add_trace_events, trace_is_enabled
+
+
+# 每个步骤之后的队列长度上限（相对于下一步的并发数）
+PIPELINE_QUEUE_FACTOR = 2
+
+# 队列结束标记
+PIPELINE_END = None
+
+# 绘图进程池（进程内复用，多次生成之间保持已经加载的模块和字体）
+_draw_executor = None
+_draw_executor_workers = 0
+_draw_executor_lock = threading.Lock()
+
+
+# 按步骤运行流水线
+async def run_stages(items: list, stages: list, queue_size: int = 0, cancel_event=None):
+    """
+    参数：
+    items：list，输入第一步的数据
+    stages：list，[(步骤名称, 处理函数, 执行器, 并发数), ...]，处理函数在执行器中运行（执行器为 None 时处理函数是协程函数），
+            返回值放入下一步的队列，返回 None 表示这一项不需要后面的步骤
+    queue_size：int，步骤之间的队列长度上限，0表示按下一步并发数的 PIPELINE_QUEUE_FACTOR 倍
+    cancel_event：threading.Event，出错时设置，用于通知正在处理的项（比如结束正在运行的 ffmpeg）
+
+    任意一项出错后不再处理新的数据，等正在处理的完成后抛出第一个错误
+    """
+    loop = asyncio.get_running_loop()
+    queues = [asyncio.Queue(maxsize=queue_size or max(1, workers * PIPELINE_QUEUE_FACTOR)) for _, _, _, workers in stages]
+    errors = []
+
+    async def worker(index: int):
+        _, func, executor, _ = stages[index]
+        while True:
+            item = await queues[index].get()
+            if item is PIPELINE_END:
+                return
+            if len(errors) > 0:
+                continue
+            try:
+                if executor is None:
+                    result = await func(item)
+                else:
+                    result = await loop.run_in_executor(executor, func, item)
+            except Exception as e:
+                errors.append(e)
+                if cancel_event is not None:
+                    cancel_event.set()
+                continue
+            if result is not None and index + 1 < len(stages):
+                await queues[index + 1].put(result)
+
+    tasks = [[asyncio.ensure_future(worker(i)) for _ in range(stage[3])] for i, stage in enumerate(stages)]
+    try:
+        for item in items:
+            await queues[0].put(item)
+        # 每一步的所有工作协程结束后，再通知下一步结束
+        for i in range(len(stages)):
+            for _ in tasks[i]:
+                await queues[i].put(PIPELINE_END)
+            await asyncio.gather(*tasks[i])
+    finally:
+        for stage_tasks in tasks:
+            for task in stage_tasks:
+                task.cancel()
+    if len(errors) > 0:
+        raise errors[0]
+
+
+# 获取绘图进程池（进程数变化时重新创建）
+def get_draw_executor(workers: int):
+    """
+    使用 spawn 方式启动进程（和 Windows 一致，不会复制主进程中的线程和锁），
+    主程序脚本必须有 if __name__ == "__main__" 保护
+
+    渲染服务的工作进程（daemon 进程）不能再启动子进程，取消任务时也会被直接结束，这时使用线程池绘图
+    """
+    global _draw_executor, _draw_executor_workers
+    with _draw_executor_lock:
+        if _draw_executor is None or _draw_executor_workers != workers:
+            if _draw_executor is not None:
+                _draw_executor.shutdown()
+            if multiprocessing.current_process().daemon:
+                _draw_executor = ThreadPoolExecutor(max_workers=workers)
+            else:
+                _draw_executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+            _draw_executor_workers = workers
+        return _draw_executor
+
+
+# 绘图进程异常退出后丢弃进程池，下次重新创建
+def reset_draw_executor():
+    global _draw_executor
+    with _draw_executor_lock:
+        if _draw_executor is not None:
+            _draw_executor.shutdown(wait=False)
+        _draw_executor = None
+
+
+# 在绘图进程中绘图：项目目录和主进程一致（spawn 方式启动的进程不会继承 set_root_path 的设置）
+def draw_in_project(root_path: str, cache_root_path: str, draw_func, artifact, parent_pid: int = 0):
+    """
+    返回值：
+    tuple，(图片, 绘图进程中记录的追踪区间)，在主进程中运行（线程池）时区间直接记录在主进程中，返回空列表
+    """
+    if defined.ROOT_PATH != root_path or defined.CACHE_ROOT_PATH != cache_root_path:
+        defined.set_root_path(root_path, cache_root_path)
+    with span("draw", "image", output=os.path.basename(artifact.output)):
+        image = draw_func(artifact)
+    if os.getpid() == parent_pid or not trace_is_enabled():
+        return image, []
+    return image, take_trace_events()
+
+
+# 分段流水线：语音 -> 显示图片 -> 分段视频
+def run_segment_pipeline(graph, segments: list, synthesize_func, draw_func, encode_func,
+                         tts_workers: int = 4, draw_workers: int = 4, encode_workers: int = 4, progress=None):
+    """
+    参数：
+    graph：BuildGraph，产物是否需要重新构建由构建图判断，构建成功后提交
+    segments：list，按顺序排列的 [(语音产物, 分段视频产物), ...]，分段视频产物的输入中包含语音产物的输出
+    synthesize_func：语音构建函数 synthesize_func(语音产物)，和 graph.run_stage 的构建函数一样写入 tmp_output
+    draw_func：绘图函数 draw_func(分段视频产物) -> 图片，在进程池中运行，必须是模块级函数
+    encode_func：编码函数 encode_func(分段视频产物, 图片)，写入 tmp_output
+    progress：进度回调 progress(步骤名称, 已处理数, 总数)，分段视频不需要重新构建时也计入已处理数
+
+    返回值：
+    dict，{"voice": 重新合成的语音数, "segment": 重新生成的分段视频数}
+    """
+    voice_total = len([1 for voice, _ in segments if graph.is_outdated(voice)])
+    counts = {"voice": 0, "segment": 0, "processed": 0}
+    if progress is not None:
+        progress("voice", 0, voice_total)
+        progress("segment", 0, len(segments))
+
+    # 第一步：语音（有变化时合成），然后判断分段视频是否需要重新生成
+    def synthesize(item):
+        voice, segment = item
+        if graph.is_outdated(voice):
+            graph.build(voice, synthesize_func)
+            with graph.lock:
+                counts["voice"] += 1
+                done = counts["voice"]
+            if progress is not None:
+                progress("voice", done, voice_total)
+        if graph.is_outdated(segment):
+            return segment
+        report_segment(False)
+        return None
+
+    # 第二步：在内存中绘制显示图片（进程池）
+    async def draw(segment):
+        try:
+            image, events = await asyncio.get_running_loop().run_in_executor(draw_executor, draw_in_project, defined.ROOT_PATH,
+                                                                             defined.CACHE_ROOT_PATH, draw_func, segment, os.getpid())
+        except BrokenProcessPool:
+            reset_draw_executor()
+            raise
+        add_trace_events(events)
+        return segment, image
+
+    # 第三步：编码分段视频
+    def encode(item):
+        segment, image = item
+        graph.build(segment, lambda artifact: encode_func(artifact, image))
+        report_segment(True)
+
+    def report_segment(built: bool):
+        with graph.lock:
+            counts["processed"] += 1
+            if built:
+                counts["segment"] += 1
+            done = counts["processed"]
+        if progress is not None:
+            progress("segment", done, len(segments))
+
+    draw_executor = get_draw_executor(max(1, draw_workers))
+    with ThreadPoolExecutor(max_workers=max(1, tts_workers)) as tts_executor, \
+            ThreadPoolExecutor(max_workers=max(1, encode_workers)) as encode_executor:
+        stages = [
+            ("voice", synthesize, tts_executor, max(1, tts_workers)),
+            ("draw", draw, None, max(1, draw_workers)),
+            ("encode", encode, encode_executor, max(1, encode_workers)),
+        ]
+        with span("stage:pipeline", "stage", count=len(segments), tts_workers=tts_workers, draw_workers=draw_workers, encode_workers=encode_workers):
+            asyncio.run(run_stages(segments, stages, cancel_event=graph.cancel_event))
+    return {"voice": counts["voice"], "segment": counts["segment"]}
@@ -0,0 +1,204 @@
+# -*- encoding: utf-8 -*-
+
+'''
+Project manifest
+项目输入文件清单：一次 os.scandir 扫描找出所有分段的输入文件（背景图、显示文本、语音文本），按序号数值排序并校验，
+连同每个文件的大小、修改时间、内容哈希保存为清单文件 input/.project_manifest.json
+
+之后再次运行（以及各个步骤、子进程）只需要列一次目录名和清单比较，文件名没有变化时直接使用清单，
+不再逐个 stat、计算哈希和校验，几千个分段也可以在毫秒级完成加载
+
+输入文件可以直接放在 input/ 目录中，也可以按章节放在 input/ 的子目录中（序号在整个项目中不能重复），
+input/ 下的 img、audio、video、srt 等生成文件目录和 . 开头的目录不扫描
+
+site: github.com/heiyeluren
+
+清单文件格式：
+{
+    "version": 1,
+    "root": "/data/project/input/",
+    "names": ["video_bg_01.png", "chapter2/video_bg_02.png", ...],
+    "files": {"video_bg_01.png": [大小, 修改时间(纳秒), sha1], ...},
+    "segments": [["01", {"video_bg_file": "video_bg_01.png", "video_text_file": ..., "voice_text_file": ...}], ...]
+}
+
+调用示例：
+manifest = load_project_manifest()
+dnames = get_project_segments(manifest)
+graph.add_file_hashes(get_project_file_hashes(manifest))
+
+命令行：
+python -m VideoMake.project --rescan
+
+'''
+
+import os
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from . import defined
+from .defined import *
+from .cache import file_hash, atomic_write_bytes
+
+
+# 清单文件格式版本（格式变化时旧清单自动作废）
+PROJECT_MANIFEST_VERSION = 1
+
+# 每个分段的输入文件：(文件名前缀, 后缀, 关键文件名KEY)
+PROJECT_INPUT_FILES = [
+    (VIDEO_BG_PREFIX, PNG_SUFFIX, VIDEO_BG_FILE),
+    (VIDEO_TEXT_PREFIX, TEXT_SUFFIX, VIDEO_TEXT_FILE),
+    (VOICE_TEXT_PREFIX, TEXT_SUFFIX, VOICE_TEXT_FILE),
+]
+
+# input/ 下不扫描的目录（程序生成的文件）
+PROJECT_SKIP_DIRS = {"img", "audio", "video", "srt"}
+
+
+# 获取项目清单文件路径
+def get_project_manifest_file_path(input_root: str = '') -> str:
+    return (input_root or defined.INPUT_ROOT_PATH) + PROJECT_MANIFEST_FILE
+
+
+# 判断文件名是否是分段输入文件，返回 (关键文件名KEY, 序号)，不是时返回 None
+def parse_input_file_name(name: str):
+    for prefix, suffix, key in PROJECT_INPUT_FILES:
+        if name.startswith(prefix) and name.endswith(suffix):
+            num = name[len(prefix):len(name) - len(suffix)]
+            if num.isdigit() == False:
+                raise Exception("{} file name must be number: {}".format(key, name))
+            return key, num
+    return None
+
+
+# 扫描输入目录，返回所有分段输入文件的相对路径（只读取目录项，不 stat 文件）
+def scan_input_names(input_root: str) -> list:
+    names = []
+    dirs = ['']
+    while len(dirs) > 0:
+        rel_dir = dirs.pop()
+        with os.scandir(input_root + rel_dir) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    if (rel_dir == '' and entry.name in PROJECT_SKIP_DIRS) or entry.name.startswith('.'):
+                        continue
+                    dirs.append(rel_dir + entry.name + "/")
+                elif parse_input_file_name(entry.name) is not None:
+                    names.append(rel_dir + entry.name)
+    names.sort()
+    return names
+
+
+# 按序号分组并校验：每个分段三个输入文件齐全，序号不重复，按序号数值排序
+def group_input_files(names: list, input_root: str = '') -> list:
+    """
+    返回值：
+    list，[(序号, {关键文件名KEY: 相对路径, ...}), ...]
+    """
+    segments = {}
+    nums = {}
+    for name in names:
+        key, num = parse_input_file_name(os.path.basename(name))
+        # 01 和 1 是同一个分段，文件名中的写法必须一致
+        if nums.setdefault(int(num), num) != num:
+            raise Exception("Input file sequence number is duplicated: {} and {}".format(nums[int(num)], num))
+        files = segments.setdefault(num, {})
+        if key in files:
+            raise Exception("Input file is duplicated: {} and {}".format(files[key], name))
+        files[key] = name
+
+    for num, files in segments.items():
+        missing = [prefix + num + suffix for prefix, suffix, key in PROJECT_INPUT_FILES if key not in files]
+        if len(missing) > 0:
+            print("Error: Input ' video_text_files / voice_text_files / video_bg_img ' must be same sequence number, please check path:", input_root, "\n")
+            raise Exception("Input files not found for sequence number {}: {}".format(num, ", ".join(missing)))
+    return sorted(segments.items(), key=lambda item: int(item[0]))
+
+
+# 读取清单文件，不存在、损坏或者版本不一致时返回 None
+def read_project_manifest(manifest_file: str, input_root: str):
+    if not os.path.exists(manifest_file):
+        return None
+    try:
+        with open(manifest_file, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except ValueError:
+        return None
+    if manifest.get("version") != PROJECT_MANIFEST_VERSION or manifest.get("root") != input_root:
+        return None
+    return manifest
+
+
+# 加载项目清单（文件名有变化或者没有清单时重新生成）
+def load_project_manifest(input_root: str = '', rescan: bool = False, workers: int = 4) -> dict:
+    """
+    参数：
+    input_root：str，输入目录，为空时使用 defined.INPUT_ROOT_PATH
+    rescan：bool，忽略已有清单，重新校验并计算所有文件的哈希
+    workers：int，同时计算哈希的线程数
+
+    返回值：
+    dict，清单内容（格式见模块说明）
+    """
+    input_root = input_root or defined.INPUT_ROOT_PATH
+    if os.path.exists(input_root) is False:
+        raise Exception("Input path is not exists: {}".format(input_root))
+    manifest_file = get_project_manifest_file_path(input_root)
+    names = scan_input_names(input_root)
+
+    old = read_project_manifest(manifest_file, input_root)
+    # 文件名没有变化：分段和校验结果不变，直接使用清单（文件内容的变化由构建图按大小和修改时间判断）
+    if old is not None and not rescan and old.get("names") == names:
+        return old
+
+    segments = group_input_files(names, input_root)
+
+    # 大小和修改时间都没有变化的文件沿用上次的哈希
+    old_files = old.get("files", {}) if old is not None and not rescan else {}
+    def stat_file(name):
+        st = os.stat(input_root + name)
+        cached = old_files.get(name)
+        if cached is not None and cached[0] == st.st_size and cached[1] == st.st_mtime_ns:
+            return cached
+        return [st.st_size, st.st_mtime_ns, file_hash(input_root + name)]
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        stats = list(executor.map(stat_file, names))
+
+    manifest = {
+        "version": PROJECT_MANIFEST_VERSION,
+        "root": input_root,
+        "names": names,
+        "files": dict(zip(names, stats)),
+        "segments": segments,
+    }
+    atomic_write_bytes(manifest_file, json.dumps(manifest, ensure_ascii=False, indent=1).encode('utf-8'))
+    return manifest
+
+
+# 清单中的分段输入文件（格式和 util.check_input_files 的返回值一致，按序号数值排序）
+def get_project_segments(manifest: dict) -> dict:
+    """
+    返回值：
+    dict，{序号: {关键文件名KEY: 相对 input 目录的文件路径, ...}, ...}
+    """
+    return {num: dict(files) for num, files in manifest["segments"]}
+
+
+# 清单中记录的文件哈希，路径和 util.get_input_text_file_path 的结果一致（用于预填构建图的哈希缓存）
+def get_project_file_hashes(manifest: dict) -> dict:
+    return {manifest["root"] + name: list(info) for name, info in manifest["files"].items()}
+
+
+if __name__ == "__main__":
+    import time
+    import argparse
+    parser = argparse.ArgumentParser(description="Scan input files and write the project manifest")
+    parser.add_argument("--root", default='', help="project root path containing input/ (default: the package root)")
+    parser.add_argument("--rescan", action="store_true", help="ignore the existing manifest and hash all files again")
+    args = parser.parse_args()
+    if args.root:
+        defined.set_root_path(args.root)
+    start = time.time()
+    manifest = load_project_manifest(rescan=args.rescan)
+    print("{} segments, {} files loaded in {:.3f}s: {}".format(len(manifest["segments"]), len(manifest["names"]),
+                                                        time.time() - start, get_project_manifest_file_path()))
@@ -0,0 +1,282 @@
+# -*- encoding: utf-8 -*-
+
+'''
+Render pipeline
+一个项目的完整生成流程（登记产物 -> 语音 -> 图片 -> 分段视频 -> 基本视频 -> 字幕 -> 最终视频），
+由 video_make.py 命令行和渲染服务（daemon）共同使用
+
+项目目录由 defined.set_root_path 指定，调用前设置好；语音合成后端可以由调用方创建后传入，
+在多次生成之间复用（pyttsx3 引擎进程、Azure 连接配置不用每次重新初始化）
+
+site: github.com/heiyeluren
+
+调用示例：
+defined.set_root_path("/data/projects/demo")
+render_project(dict(RENDER_DEFAULT_CONFIG, tts_backend="pyttsx3"), progress=lambda stage, done, total: print(stage, done, total))
+
+'''
+
+import os
+
+from . import defined
+from .defined import *
+from .util import get_output_wav_file_path, get_output_img_file_path, get_input_text_file_path, get_input_video_file_path, \
+    get_output_video_file_path, get_input_srt_file_path, get_input_srt_audio_file_path, get_input_video_list_file_path, \
+    get_build_state_file_path, get_tts_key
+from .img import draw_first_page, draw_contents_page, draw_end_page
+from .layout import LAYOUT_VERSION
+from .video import stream_image_to_video, merge_videos, make_final_video, get_render_jobs, get_segment_threads
+from .voice import SpeechToText
+from .scheduler import RateLimiter, synthesize_with_retry
+from .build import BuildGraph
+from .encode import get_encode_profile
+from .tts import get_tts_backend, Pyttsx3TTSBackend
+from .subtitle import get_timing_file_path, build_srt_from_timings
+from .project import load_project_manifest, get_project_segments, get_project_file_hashes
+from .pipeline import run_segment_pipeline
+from .ffmpeg import make_progress_printer
+from .media import get_media_duration
+from .trace import span
+
+
+# 默认生成配置（各项含义见 video_make.py 的第0步配置）
+RENDER_DEFAULT_CONFIG = {
+    "base_video_name": 'base',
+    "final_video_name": 'final',
+    "tts_srt_name": 'tts',
+    "make_tts_srt": True,
+    "make_raw_srt": False,
+    "raw_srt_method": 'align',
+    "keep_base_video": False,
+    "save_images": False,
+    "voice_name": 'zh-CN-YunzeNeural',
+    "tts_backend": 'azure',
+    "tts_workers": 4,
+    "tts_rps": 0.3,
+    "tts_cpm": 0,
+    "stt_workers": 4,
+    "video_fps": 1,
+    "encode_profile": 'standard',
+    "render_jobs": 0,
+    "pipeline": True,
+    "line_markers": False,
+    "force": False,
+    "rescan": False,
+}
+
+
+# 按配置创建语音合成后端
+def create_tts_backend(config: dict):
+    if config["tts_backend"] == Pyttsx3TTSBackend.name:
+        return get_tts_backend(config["tts_backend"], voice_name=config["voice_name"], workers=config["tts_workers"])
+    return get_tts_backend(config["tts_backend"], voice_name=config["voice_name"])
+
+
+# 按页面类型生成显示图片（line_markers：是否解析文本中的行首标记 "# "、"## "、"- "）
+def draw_page(page, input_text_file, output_img_file, bg_img_file, line_markers=False):
+    # 第一页
+    if page == "first":
+        return draw_first_page(input_text_file, output_img_file, bg_img_file, line_markers=line_markers)
+    # 尾页
+    elif page == "end":
+        return draw_end_page(input_text_file, output_img_file, bg_img_file, line_markers=line_markers)
+    # 内容页
+    else:
+        return draw_contents_page(input_text_file, output_img_file, bg_img_file, line_markers=line_markers)
+
+
+# 在内存中绘制分段视频的显示图片（流水线绘图进程中调用，必须是模块级函数）
+def draw_segment(artifact):
+    bg_img_file, input_text_file, _ = artifact.inputs
+    return draw_page(artifact.params["page"], input_text_file, None, bg_img_file, artifact.params["line_markers"])
+
+
+# 生成当前项目目录的视频
+def render_project(config: dict = None, tts_backend=None, tts_limiter=None, progress=None, cancel_event=None) -> dict:
+    """
+    参数：
+    config：dict，生成配置，没有的项使用 RENDER_DEFAULT_CONFIG
+    tts_backend：语音合成后端，为 None 时按配置创建，用完后关闭；传入时由调用方负责关闭
+    tts_limiter：RateLimiter，语音合成限流器，多个项目共享同一个账号时传入同一个
+    progress：进度回调 progress(步骤名称, 已完成数, 需要构建数)
+    cancel_event：Event，设置后结束正在运行的 ffmpeg，还没开始的产物不再构建（渲染服务取消任务）
+
+    返回值：
+    dict，{步骤名称: 重新构建的产物数, ...}
+    """
+    config = dict(RENDER_DEFAULT_CONFIG, **(config or {}))
+    render_jobs = get_render_jobs(config["render_jobs"])
+    encode_profile = config["encode_profile"]
+
+    # 第一步：输入文件清单，登记所有需要生成的产物
+    with span("project.load_manifest", "stage"):
+        manifest = load_project_manifest(rescan=config["rescan"])
+    dnames = get_project_segments(manifest)
+
+    graph = BuildGraph(get_build_state_file_path(), force=config["force"], progress=progress, cancel_event=cancel_event)
+    graph.add_file_hashes(get_project_file_hashes(manifest))
+    own_backend = tts_backend is None
+    if own_backend:
+        tts_backend = create_tts_backend(config)
+    total_num = len(dnames)
+    segment_video_list = []
+    segment_audio_list = []
+    segment_pairs = []
+    voice_text_list = []
+    for num in dnames:
+        num_int = int(num)
+
+        # 第二步产物：语音
+        voice_text_file = get_input_text_file_path(dnames[num][VOICE_TEXT_FILE])
+        audio_file = get_output_wav_file_path(num)
+        voice_artifact = graph.add("voice", audio_file, [voice_text_file], dict(tts_backend.get_params(), timing=True))
+        segment_audio_list.append(audio_file)
+        voice_text_list.append(voice_text_file)
+
+        # 第三步产物：显示图片（第一页、尾页、内容页使用不同的样式）
+        if num_int == 1:
+            page = "first"
+        elif num_int == total_num:
+            page = "end"
+        else:
+            page = "contents"
+        bg_img_file = get_input_text_file_path(dnames[num][VIDEO_BG_FILE])
+        video_text_file = get_input_text_file_path(dnames[num][VIDEO_TEXT_FILE])
+        page_params = {"page": page, "fonts": [BOLD_FONT_FILE, NORMAL_FONT_FILE], "layout": LAYOUT_VERSION, "line_markers": config["line_markers"]}
+        if config["save_images"] == True:
+            graph.add("image", get_output_img_file_path(num), [bg_img_file, video_text_file], page_params)
+
+        # 第四步产物：分段视频（显示图片在内存中生成后直接编码）
+        segment_video_file = get_input_video_file_path(num)
+        segment_artifact = graph.add("segment", segment_video_file, [bg_img_file, video_text_file, audio_file], dict(page_params, fps=config["video_fps"], profile=get_encode_profile(encode_profile)))
+        segment_video_list.append(segment_video_file)
+        segment_pairs.append((voice_artifact, segment_artifact))
+
+    # 第五步产物：根据语音合成时间生成的字幕
+    tts_srt_file = get_input_srt_file_path(config["tts_srt_name"])
+    if config["make_tts_srt"] == True:
+        # 时间文件（XX.timing.json）是字幕实际使用的数据，重新生成、删除、损坏时字幕也要重新生成
+        graph.add("subtitle", tts_srt_file, segment_audio_list + voice_text_list,
+                  optional_inputs=[get_timing_file_path(audio_file) for audio_file in segment_audio_list])
+
+    # 第五步产物：根据分段语音文件生成的字幕（可选，离线对齐或者语音识别）
+    raw_srt_file = get_input_srt_file_path(config["base_video_name"])
+    if config["make_raw_srt"] == True:
+        if config["raw_srt_method"] == 'align':
+            graph.add("srt", raw_srt_file, segment_audio_list + voice_text_list, {"method": config["raw_srt_method"]})
+        else:
+            graph.add("srt", raw_srt_file, segment_audio_list, {"method": config["raw_srt_method"]})
+
+    # 第六步产物：最终视频（字幕优先使用手工准备的 input/srt/final.srt，其次是第五步生成的字幕，由分段视频和字幕一次编码生成）
+    final_srt_file = get_input_srt_file_path(config["final_video_name"])
+    if not os.path.exists(final_srt_file):
+        if config["make_raw_srt"] == True:
+            final_srt_file = raw_srt_file
+        elif config["make_tts_srt"] == True:
+            final_srt_file = tts_srt_file
+    is_make_final_video = os.path.exists(final_srt_file) or final_srt_file in (raw_srt_file, tts_srt_file)
+    if is_make_final_video:
+        graph.add("final", get_output_video_file_path(config["final_video_name"]), segment_video_list + [final_srt_file], {"profile": get_encode_profile(encode_profile)})
+    else:
+        print("Srt file not found, final video will not be generated: {}".format(final_srt_file))
+
+    # 第四步产物：基本视频（没有字幕或者指定保留时才生成）
+    base_video_file = get_output_video_file_path(config["base_video_name"])
+    if config["keep_base_video"] == True or is_make_final_video == False:
+        graph.add("base", base_video_file, segment_video_list)
+
+    built = {}
+
+    # 第二步：生成视频中的语音内容（并发合成，由令牌桶限流，服务限流/取消时自动退避重试）
+    if tts_limiter is None:
+        tts_limiter = RateLimiter(config["tts_rps"], config["tts_cpm"])
+
+    def build_voice(artifact):
+        synthesize_with_retry(dict(
+            input_text_file=artifact.inputs[0],
+            output_wav_file=artifact.tmp_output,
+            is_output_mp3=False,
+            is_play=False,
+            timing_file=get_timing_file_path(artifact.output)
+        ), tts_limiter, synthesize_func=tts_backend.synthesize)
+
+    # 第四步：各分段视频并行生成（显示图片在内存中生成，通过管道直接输入ffmpeg），再按原始顺序合并
+    segment_threads = get_segment_threads(render_jobs)
+
+    def build_segment(artifact, image=None):
+        if image is None:
+            image = draw_segment(artifact)
+        stream_image_to_video(image, artifact.tmp_output, artifact.inputs[2], config["video_fps"], threads=segment_threads, profile=encode_profile,
+                              cancel_event=graph.cancel_event)
+
+    try:
+        if config["pipeline"] == True:
+            # 第二步到第四步流水线：每个分段合成语音后立即绘图、编码，不等其他分段
+            built.update(run_segment_pipeline(graph, segment_pairs, build_voice, draw_segment, build_segment,
+                                              config["tts_workers"], render_jobs, render_jobs, progress))
+        else:
+            built["voice"] = len(graph.run_stage("voice", build_voice, config["tts_workers"]))
+    finally:
+        if own_backend:
+            tts_backend.close()
+
+    # 第三步：生成视频中的显示内容（只有开启 save_images 时才保存图片文件用于调试）
+    def build_image(artifact):
+        bg_img_file, input_text_file = artifact.inputs
+        draw_page(artifact.params["page"], input_text_file, artifact.tmp_output, bg_img_file, artifact.params["line_markers"])
+        print("Image file generated: {}".format(artifact.output))
+
+    built["image"] = len(graph.run_stage("image", build_image))
+
+    if config["pipeline"] == False:
+        built["segment"] = len(graph.run_stage("segment", build_segment, render_jobs))
+
+    def build_base(artifact):
+        merge_videos(artifact.inputs, artifact.tmp_output, get_input_video_list_file_path())
+        print("Base video file generated: {}".format(artifact.output))
+
+    built["base"] = len(graph.run_stage("base", build_base))
+
+    # 第五步：根据语音合成时记录的句子/词时间生成字幕
+    def build_subtitle(artifact):
+        count = len(artifact.inputs) // 2
+        cues = build_srt_from_timings(artifact.inputs[:count], artifact.tmp_output, artifact.inputs[count:])
+        print("Srt file generated from speech timings: {} ({} cues)".format(artifact.output, len(cues)))
+
+    built["subtitle"] = len(graph.run_stage("subtitle", build_subtitle))
+
+    # 第五步：根据分段语音文件生成字幕（align 离线对齐 / stt 语音识别）
+    def build_srt(artifact):
+        if config["raw_srt_method"] == 'align':
+            # 离线对齐：分析音频中的停顿，把语音文本的句子分配到有声音的区间（用到时才加载 numpy）
+            from .align import align_segments_to_srt
+            count = len(artifact.inputs) // 2
+            cues = align_segments_to_srt(artifact.inputs[:count], artifact.inputs[count:], artifact.tmp_output)
+            print("Raw srt file generated by alignment: {} ({} cues)".format(artifact.output, len(cues)))
+            return
+
+        # 设置 API 密钥和服务区域
+        speech_key = get_tts_key('subscription')
+        service_region = get_tts_key('region')
+
+        if config["stt_workers"] > 1:
+            stt = SpeechToText(speech_key, service_region, "", srt_file_path=artifact.tmp_output)
+            stt.recognize_files_and_save_as_srt(artifact.inputs, config["stt_workers"])
+        else:
+            # 单个识别会话：分段语音直接拼接为识别音频
+            stt = SpeechToText(speech_key, service_region, "", get_input_srt_audio_file_path(config["base_video_name"]), artifact.tmp_output, segment_audio_files=artifact.inputs)
+            stt.recognize_and_save_as_srt()
+        print("Raw srt file generated: {}".format(artifact.output))
+
+    built["srt"] = len(graph.run_stage("srt", build_srt))
+
+    # 第六步：分段视频通过 concat 读取后直接叠加字幕编码一次生成最终视频
+    def build_final(artifact):
+        video_list, srt_file_path = artifact.inputs[:-1], artifact.inputs[-1]
+        make_final_video(video_list, srt_file_path, artifact.tmp_output, get_input_video_list_file_path(), frame_rate=config["video_fps"], profile=encode_profile,
+                         progress=make_progress_printer(), cancel_event=graph.cancel_event,
+                         duration=sum(get_media_duration(audio_file) for audio_file in segment_audio_list))
+        print("Final video file generated: {}".format(artifact.output))
+
+    built["final"] = len(graph.run_stage("final", build_final))
+    return built
@@ -0,0 +1,114 @@
+# -*- encoding: utf-8 -*-
+
+'''
+TTS scheduler
+语音合成并发调度：令牌桶限流 + 失败指数退避重试
+
+site: github.com/heiyeluren
+
+'''
+
+import time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .audio import synthesize_text_to_voice, SpeechSynthesisError
+from .trace import span
+
+
+# 令牌桶
+class TokenBucket:
+    """
+    线程安全的令牌桶，rate 为每秒补充的令牌数，capacity 为桶容量（允许的突发量）
+
+    调用示例：
+    bucket = TokenBucket(rate=0.5, capacity=1)   # 每2秒一个请求
+    bucket.acquire()
+    """
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens: float = 1):
+        # rate <= 0 表示不限流
+        if self.rate <= 0:
+            return
+        # 单次请求超过桶容量时按桶容量计算，避免永远等不到
+        tokens = min(tokens, self.capacity)
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = (tokens - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+# 语音合成限流器（请求数/秒 + 字符数/分钟）
+class RateLimiter:
+    def __init__(self, requests_per_second: float = 0, chars_per_minute: float = 0):
+        self.request_bucket = TokenBucket(requests_per_second, max(1, requests_per_second))
+        self.char_bucket = TokenBucket(chars_per_minute / 60, chars_per_minute)
+
+    def acquire(self, chars: int = 0):
+        self.request_bucket.acquire(1)
+        if chars > 0:
+            self.char_bucket.acquire(chars)
+
+
+# 并发语音合成
+def synthesize_batch(tasks: list, workers: int = 4, requests_per_second: float = 0.3, chars_per_minute: float = 0,
+                     max_retries: int = 5, base_delay: float = 2.0, max_delay: float = 60.0, synthesize_func=synthesize_text_to_voice):
+    """
+    多个语音合成任务并发执行，所有请求经过令牌桶限流，服务限流/取消时指数退避重试
+    限流器通过 rate_limiter 参数传给合成函数，只有真正请求服务（句子缓存没有命中）时才消耗令牌
+
+    参数：
+    tasks：list，任务列表，每一项是传给 synthesize_func 的参数字典（必须包含 input_text_file）
+    workers：int，同时进行的合成数量
+    requests_per_second：float，每秒最多请求数，0表示不限（Azure F0免费账号约20次/分钟）
+    chars_per_minute：float，每分钟最多合成字符数，0表示不限
+    max_retries：int，单个任务最多重试次数
+    base_delay：float，首次重试等待秒数，之后每次翻倍
+    max_delay：float，重试等待的最大秒数
+    synthesize_func：合成函数，默认 synthesize_text_to_voice
+
+    返回值：
+    list，按任务顺序返回每个任务的合成结果
+
+    调用示例：
+    synthesize_batch([{"input_text_file": "input/voice_text_01.txt", "output_wav_file": "input/audio/01.wav"}], workers=4)
+    """
+    limiter = RateLimiter(requests_per_second, chars_per_minute)
+
+    def run_task(task):
+        return synthesize_with_retry(task, limiter, max_retries, base_delay, max_delay, synthesize_func)
+
+    if len(tasks) == 0:
+        return []
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(tasks)))) as executor:
+        return list(executor.map(run_task, tasks))
+
+
+# 单个语音合成任务（限流 + 指数退避重试）
+def synthesize_with_retry(task: dict, limiter: RateLimiter = None, max_retries: int = 5, base_delay: float = 2.0, max_delay: float = 60.0, synthesize_func=synthesize_text_to_voice):
+    attempt = 0
+    while True:
+        try:
+            with span("tts.synthesize", "tts", file=task['input_text_file'], attempt=attempt):
+                return synthesize_func(rate_limiter=limiter, **task)
+        except SpeechSynthesisError as e:
+            if not e.retryable or attempt >= max_retries:
+                raise
+            # 指数退避 + 随机抖动，避免多个线程同时重试
+            delay = min(max_delay, base_delay * (2 ** attempt)) * random.uniform(0.5, 1.0)
+            print("Speech synthesis retry {}/{} after {:.1f}s: {}".format(attempt + 1, max_retries, delay, task['input_text_file']))
+            time.sleep(delay)
+            attempt += 1
@@ -0,0 +1,242 @@
+# -*- encoding: utf-8 -*-
+
+'''
+Subtitle builder
+字幕生成：语音合成时记录每个句子、每个词的时间（时间文件 XX.timing.json），
+按分段音频时长累加偏移，合并生成多条字幕的 srt 文件，不需要再做语音识别
+
+site: github.com/heiyeluren
+
+时间文件格式：
+{
+    "duration": 12.5,
+    "sentences": [
+        {"text": "第一句。", "start": 0.0, "end": 2.1, "words": [{"text": "第一", "start": 0.05, "end": 0.4}, ...]},
+        ...
+    ]
+}
+
+调用示例：
+build_srt_from_timings(["input/audio/01.wav", "input/audio/02.wav"], "input/srt/tts.srt")
+
+'''
+
+import os
+import re
+import json
+
+from .cache import atomic_write_bytes
+from .media import get_media_duration
+
+
+# 每条字幕最多字符数（超过时按词拆分成多条）
+SUBTITLE_MAX_CHARS = 20
+
+# 字幕结尾去掉的标点
+SUBTITLE_STRIP_PUNCTUATION = "。，、；：,;:"
+
+# 长句拆分时优先断开的位置（这些标点之后）
+SUBTITLE_BREAK_PUNCTUATION = "，、；：,;:"
+
+
+# 秒数转换为 srt 时间格式 00:00:00,000
+def format_srt_time(seconds: float) -> str:
+    ms = int(round(seconds * 1000))
+    return "{:02d}:{:02d}:{:02d},{:03d}".format(ms // 3600000, ms // 60000 % 60, ms // 1000 % 60, ms % 1000)
+
+
+# 保存 srt 字幕文件
+def write_srt_file(cues: list, srt_file_path: str):
+    """
+    参数：
+    cues：list，字幕列表 [(开始秒数, 结束秒数, 文本), ...]
+    srt_file_path：str，输出的 srt 文件
+    """
+    with open(srt_file_path, "w", encoding='utf-8', errors='ignore') as srt_file:
+        for i, (start, end, text) in enumerate(cues, 1):
+            srt_file.write("{}\n{} --> {}\n{}\n\n".format(i, format_srt_time(start), format_srt_time(end), text))
+
+
+# 音频文件对应的时间文件路径
+def get_timing_file_path(wav_file_path: str) -> str:
+    return os.path.splitext(wav_file_path)[0] + ".timing.json"
+
+
+# 保存时间文件
+def save_timing_file(timing_file_path: str, sentences: list, duration: float):
+    data = {"duration": round(duration, 3), "sentences": sentences}
+    atomic_write_bytes(timing_file_path, json.dumps(data, ensure_ascii=False, indent=1).encode('utf-8'))
+
+
+# 读取时间文件，文件不存在或者损坏时返回 None
+def load_timing_file(timing_file_path: str):
+    if not os.path.exists(timing_file_path):
+        return None
+    try:
+        with open(timing_file_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except ValueError:
+        return None
+
+
+# 没有词边界信息时，按字符数比例估算每个句子的时间
+def estimate_sentence_timings(sentences: list, duration: float, start: float = 0.0) -> list:
+    total_chars = sum([len(s) for s in sentences])
+    result = []
+    offset = start
+    for sentence in sentences:
+        length = duration * len(sentence) / total_chars if total_chars > 0 else 0
+        result.append({"text": sentence, "start": round(offset, 3), "end": round(offset + length, 3), "words": []})
+        offset += length
+    return result
+
+
+# 按词边界把整段文本的词分配给各个句子，计算句子时间
+def assign_words_to_sentences(text: str, sentences: list, words: list, duration: float) -> list:
+    """
+    参数：
+    text：str，合成的整段文本
+    sentences：list，从 text 中拆分出的句子
+    words：list，词边界 [{"text", "start", "end", "text_offset"}, ...]，text_offset 为词在整段文本中的字符位置
+    duration：float，整段音频时长
+
+    返回值：
+    list，句子时间列表（格式同时间文件中的 sentences）
+    """
+    if len(words) == 0:
+        return estimate_sentence_timings(sentences, duration)
+
+    result = []
+    pos = 0
+    word_index = 0
+    for sentence in sentences:
+        found = text.find(sentence, pos)
+        if found >= 0:
+            pos = found
+        end_pos = pos + len(sentence)
+        sentence_words = []
+        while word_index < len(words) and words[word_index].get("text_offset", pos) < end_pos:
+            word = words[word_index]
+            sentence_words.append({"text": word["text"], "start": word["start"], "end": word["end"]})
+            word_index += 1
+        result.append({"text": sentence, "words": sentence_words})
+        pos = end_pos
+
+    # 句子开始时间取第一个词，结束时间取下一句的开始（包含句间停顿），没有词的句子按前后句插值
+    for i, item in enumerate(result):
+        item["start"] = item["words"][0]["start"] if item["words"] else (result[i - 1]["end"] if i > 0 else 0.0)
+        if i + 1 < len(result) and result[i + 1]["words"]:
+            item["end"] = result[i + 1]["words"][0]["start"]
+        elif item["words"]:
+            item["end"] = item["words"][-1]["end"] if i + 1 < len(result) else max(item["words"][-1]["end"], duration)
+        else:
+            item["end"] = item["start"]
+    return result
+
+
+# 把一个句子拆成若干条字幕（句子太长时按词拆分）
+def sentence_to_cues(sentence: dict, max_chars: int = SUBTITLE_MAX_CHARS) -> list:
+    text = sentence["text"].strip()
+    words = sentence.get("words") or []
+    if len(text) <= max_chars or len(words) == 0:
+        return [(sentence["start"], sentence["end"], text)]
+
+    # 每个词在句子中的字符位置（词边界不包含标点，字幕文本从原句中截取）
+    positions = []
+    pos = 0
+    for word in words:
+        index = text.find(word["text"], pos)
+        if index < 0:
+            index = pos
+        positions.append(index)
+        pos = index + len(word["text"])
+
+    cues = []
+    cut = 0
+    cut_time = sentence["start"]
+    last_break = None
+    for word, index in zip(words, positions):
+        # 英文的词前面是标点后的空格，跳过空白再判断前一个字符是不是标点
+        previous = text[cut:index].rstrip()[-1:]
+        if previous != '' and previous in SUBTITLE_BREAK_PUNCTUATION:
+            last_break = (index, word["start"])
+        if index > cut and index + len(word["text"]) - cut > max_chars:
+            # 优先在本条字幕中最后一个标点处断开，没有标点时在当前词前断开
+            if last_break is not None and last_break[0] > cut:
+                break_index, break_time = last_break
+            else:
+                break_index, break_time = index, word["start"]
+            cues.append((cut_time, break_time, text[cut:break_index]))
+            cut, cut_time = break_index, break_time
+    cues.append((cut_time, sentence["end"], text[cut:]))
+    return cues
+
+
+# 整理字幕文本：去掉换行、多余空白和结尾标点
+def clean_cue_text(text: str) -> str:
+    text = re.sub(r'\s+', ' ', text).strip()
+    return text.rstrip(SUBTITLE_STRIP_PUNCTUATION).strip()
+
+
+# 多个分段的句子时间转换为字幕（每个分段的时间加上前面所有分段的总时长）
+def timings_to_cues(segments: list, max_chars: int = SUBTITLE_MAX_CHARS) -> list:
+    """
+    参数：
+    segments：list，[(分段时长, 句子时间列表), ...]，句子时间格式同时间文件中的 sentences
+
+    返回值：
+    list，字幕列表 [(开始秒数, 结束秒数, 文本), ...]
+    """
+    cues = []
+    offset = 0.0
+    for duration, sentences in segments:
+        for sentence in sentences:
+            for start, end, text in sentence_to_cues(sentence, max_chars):
+                text = clean_cue_text(text)
+                if text == '':
+                    continue
+                # 字幕不超出本分段
+                start = min(start, duration)
+                end = min(max(end, start), duration)
+                cues.append((offset + start, offset + end, text))
+        offset += duration
+    return cues
+
+
+# 合并多个分段的时间文件生成 srt 字幕
+def build_srt_from_timings(wav_files: list, srt_file_path: str, text_files: list = None, max_chars: int = SUBTITLE_MAX_CHARS) -> list:
+    """
+    每个分段的字幕时间加上前面所有分段音频的总时长，合并为一个 srt 文件
+
+    参数：
+    wav_files：list，按播放顺序排列的分段语音文件，时间文件为同名的 .timing.json
+    srt_file_path：str，输出的 srt 文件
+    text_files：list，和 wav_files 对应的语音文本文件，时间文件不存在时按文本字数估算时间
+    max_chars：int，每条字幕最多字符数
+
+    返回值：
+    list，字幕列表 [(开始秒数, 结束秒数, 文本), ...]
+    """
+    from .audio import split_sentences
+
+    segments = []
+    for i, wav_file in enumerate(wav_files):
+        # 使用音频文件的实际时长累加（和分段视频时长一致）
+        duration = get_media_duration(wav_file)
+        timing = load_timing_file(get_timing_file_path(wav_file))
+        # 时间文件和音频时长对不上（音频被替换过）时不使用
+        if timing is not None and abs(timing.get("duration", duration) - duration) > 1.0:
+            print("Warning: timing file does not match audio, estimate by text:", wav_file)
+            timing = None
+        if timing is not None:
+            sentences = timing["sentences"]
+        elif text_files is not None:
+            with open(text_files[i], 'r', encoding='utf-8', errors='ignore') as f:
+                sentences = estimate_sentence_timings(split_sentences(f.read()), duration)
+        else:
+            raise Exception("Timing file not found: {}".format(get_timing_file_path(wav_file)))
+        segments.append((duration, sentences))
+
+    cues = timings_to_cues(segments, max_chars)
+    write_srt_file(cues, srt_file_path)
+    return cues
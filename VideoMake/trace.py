@@ -0,0 +1,247 @@
+# -*- encoding: utf-8 -*-
+
+'''
+Tracing
+耗时追踪：在各个步骤、每个分段的操作（语音合成、绘图、字体加载、图片保存、ffmpeg 子进程、语音识别）外面记录耗时区间，
+可以导出为 Chrome trace 格式（chrome://tracing 或者 https://ui.perfetto.dev 打开，按线程显示时间线），
+也可以输出最慢的 N 个区间和按名称汇总的耗时表
+
+设置环境变量 VIDEOMAKE_TRACE=trace.json 开启（或者 video_make.py --trace trace.json），
+程序结束时保存到这个文件并输出汇总表；没有开启时 span 直接返回一个空操作对象，不记录任何内容
+
+site: github.com/heiyeluren
+
+调用示例：
+with span("draw_page", "image", page="first"):
+    image = draw_first_page(...)
+
+enable_trace("trace.json")
+...
+save_trace()
+print(format_trace_summary(top=20))
+
+'''
+
+import os
+import sys
+import json
+import time
+import atexit
+import threading
+import multiprocessing
+
+
+# 开启追踪的环境变量（值为输出文件路径）
+TRACE_ENV = "VIDEOMAKE_TRACE"
+
+# 汇总表中最慢区间数量的环境变量
+TRACE_TOP_ENV = "VIDEOMAKE_TRACE_TOP"
+
+# 默认输出最慢的区间数量
+TRACE_DEFAULT_TOP = 20
+
+# 最多保留的区间数量（超过后不再记录，避免长时间运行的服务占用太多内存）
+TRACE_MAX_EVENTS = 200000
+
+_trace_enabled = False
+_trace_file = ''
+_trace_events = []
+_trace_lock = threading.Lock()
+_trace_exit_registered = False
+
+
+# 空操作区间（没有开启追踪时使用）
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set(self, **args):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+# 一个耗时区间
+class Span:
+    def __init__(self, name: str, category: str, args: dict):
+        self.name = name
+        self.category = category
+        self.args = args
+        self.start = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.args["error"] = "{}: {}".format(exc_type.__name__, exc)
+        add_span(self.name, self.category, self.start, time.perf_counter() - self.start, self.args)
+        return False
+
+    # 区间结束前补充参数（比如缓存是否命中）
+    def set(self, **args):
+        self.args.update(args)
+
+
+# 记录一个区间（with 语句使用）
+def span(name: str, category: str = '', **args):
+    """
+    参数：
+    name：str，区间名称（汇总表按名称统计）
+    category：str，分类（stage / build / tts / image / ffmpeg / stt 等）
+    args：区间参数，显示在 Chrome trace 的详情中
+    """
+    if not _trace_enabled:
+        return _NULL_SPAN
+    return Span(name, category, args)
+
+
+# 判断是否开启了追踪
+def trace_is_enabled() -> bool:
+    return _trace_enabled
+
+
+# 直接添加一个已经结束的区间（比如 ffmpeg 子进程，开始时间和耗时由调用方测量）
+def add_span(name: str, category: str, start: float, duration: float, args: dict = None, pid: int = None, tid: int = None):
+    """
+    参数：
+    start：float，开始时间 time.perf_counter()（同一台机器上不同进程的 perf_counter 可以比较）
+    duration：float，耗时（秒）
+    """
+    if not _trace_enabled:
+        return
+    event = {
+        "name": name,
+        "cat": category,
+        "ph": "X",
+        "ts": round(start * 1000000, 1),
+        "dur": round(duration * 1000000, 1),
+        "pid": pid if pid is not None else os.getpid(),
+        "tid": tid if tid is not None else threading.get_ident(),
+        "args": args or {},
+    }
+    with _trace_lock:
+        if len(_trace_events) < TRACE_MAX_EVENTS:
+            _trace_events.append(event)
+
+
+# 取出当前进程记录的区间并清空（子进程把区间返回给主进程合并）
+def take_trace_events() -> list:
+    with _trace_lock:
+        events = list(_trace_events)
+        del _trace_events[:]
+    return events
+
+
+# 合并其他进程记录的区间
+def add_trace_events(events: list):
+    if not _trace_enabled or not events:
+        return
+    with _trace_lock:
+        _trace_events.extend(events[:max(0, TRACE_MAX_EVENTS - len(_trace_events))])
+
+
+# 获取记录的区间（副本）
+def get_trace_events() -> list:
+    with _trace_lock:
+        return list(_trace_events)
+
+
+# 开启追踪
+def enable_trace(trace_file: str = '', save_at_exit: bool = True):
+    """
+    参数：
+    trace_file：str，保存的文件路径，为空时只在内存中记录
+    save_at_exit：bool，主进程结束时自动保存并输出汇总表
+    """
+    global _trace_enabled, _trace_file, _trace_exit_registered
+    _trace_enabled = True
+    _trace_file = trace_file
+    # 环境变量传给子进程（绘图进程、渲染服务工作进程也开启追踪）
+    os.environ[TRACE_ENV] = trace_file or os.environ.get(TRACE_ENV, '') or '-'
+    if save_at_exit and not _trace_exit_registered and multiprocessing.current_process().name == "MainProcess":
+        atexit.register(finish_trace)
+        _trace_exit_registered = True
+
+
+# 关闭追踪并清空记录
+def disable_trace():
+    global _trace_enabled
+    _trace_enabled = False
+    os.environ.pop(TRACE_ENV, None)
+    take_trace_events()
+
+
+# 保存为 Chrome trace 格式
+def save_trace(trace_file: str = '') -> str:
+    trace_file = trace_file or _trace_file
+    if not trace_file or trace_file == '-':
+        return ''
+    events = get_trace_events()
+    # 进程名称（主进程和子进程分开显示）
+    names = []
+    for pid in sorted(set(event["pid"] for event in events)):
+        label = "main" if pid == os.getpid() else "worker {}".format(pid)
+        names.append({"name": "process_name", "ph": "M", "pid": pid, "tid": 0, "args": {"name": label}})
+    trace_dir = os.path.dirname(trace_file)
+    if trace_dir != '' and not os.path.exists(trace_dir):
+        os.makedirs(trace_dir, exist_ok=True)
+    with open(trace_file, 'w', encoding='utf-8') as f:
+        json.dump({"traceEvents": names + events, "displayTimeUnit": "ms"}, f, ensure_ascii=False)
+    return trace_file
+
+
+# 汇总：最慢的 N 个区间 + 按名称统计
+def get_trace_summary(top: int = TRACE_DEFAULT_TOP, events: list = None) -> dict:
+    """
+    返回值：
+    dict，{"slowest": [(名称, 耗时秒, 参数), ...], "totals": [(名称, 次数, 总耗时秒, 最大耗时秒), ...]}，
+    totals 按总耗时从大到小排列
+    """
+    if events is None:
+        events = get_trace_events()
+    slowest = sorted(events, key=lambda event: event["dur"], reverse=True)[:top]
+    totals = {}
+    for event in events:
+        total = totals.setdefault(event["name"], [0, 0.0, 0.0])
+        total[0] += 1
+        total[1] += event["dur"]
+        total[2] = max(total[2], event["dur"])
+    return {
+        "slowest": [(event["name"], event["dur"] / 1000000, event["args"]) for event in slowest],
+        "totals": sorted([(name, count, total / 1000000, peak / 1000000) for name, (count, total, peak) in totals.items()],
+                         key=lambda item: item[2], reverse=True)[:top],
+    }
+
+
+# 汇总表文本
+def format_trace_summary(top: int = TRACE_DEFAULT_TOP, events: list = None) -> str:
+    summary = get_trace_summary(top, events)
+    lines = ["Slowest spans:", "{:>10}  {:<28} {}".format("seconds", "name", "args")]
+    for name, seconds, args in summary["slowest"]:
+        lines.append("{:>10.3f}  {:<28} {}".format(seconds, name, json.dumps(args, ensure_ascii=False)[:100]))
+    lines += ["", "Totals by name:", "{:>10}  {:>6}  {:>10}  {}".format("seconds", "count", "max", "name")]
+    for name, count, seconds, peak in summary["totals"]:
+        lines.append("{:>10.3f}  {:>6}  {:>10.3f}  {}".format(seconds, count, peak, name))
+    return "\n".join(lines)
+
+
+# 程序结束：保存追踪文件，输出汇总表
+def finish_trace():
+    if not _trace_enabled or len(_trace_events) == 0:
+        return
+    trace_file = save_trace()
+    top = int(os.environ.get(TRACE_TOP_ENV, '') or TRACE_DEFAULT_TOP)
+    print(format_trace_summary(top), file=sys.stderr)
+    if trace_file:
+        print("Trace saved: {} (open in chrome://tracing or https://ui.perfetto.dev)".format(trace_file), file=sys.stderr)
+
+
+# 导入时按环境变量开启（子进程只记录，由主进程合并保存）
+if os.environ.get(TRACE_ENV):
+    enable_trace(os.environ[TRACE_ENV])
@@ -0,0 +1,325 @@
+# -*- encoding: utf-8 -*-
+
+'''
+TTS backend
+语音合成后端：统一的合成接口，支持 Azure 语音服务（在线）和 pyttsx3 本地引擎（离线，多进程引擎池）
+
+site: github.com/heiyeluren
+
+调用示例：
+backend = get_tts_backend("pyttsx3", workers=4)
+synthesize_batch(tasks, workers=4, requests_per_second=0, synthesize_func=backend.synthesize)
+backend.close()
+
+'''
+
+import os
+import sys
+import json
+import queue
+import shutil
+import threading
+import subprocess
+from abc import ABC, abstractmethod
+
+from .audio import synthesize_text_to_voice, split_sentences, SynthesizerPool
+from .media import get_media_duration
+from .ffmpeg import run_ffmpeg
+from .deps import tool_is_installed
+from .trace import span
+from .subtitle import get_timing_file_path, save_timing_file, estimate_sentence_timings
+
+
+# pyttsx3 工作进程合成一个文件的最长等待时间（秒），超时后结束工作进程
+PYTTSX3_SYNTHESIS_TIMEOUT = 300
+
+# 等待空闲工作进程时重新检查（后端关闭、工作进程退出）的间隔（秒）
+PYTTSX3_POLL_INTERVAL = 1.0
+
+
+# 语音合成后端基类
+class TTSBackend(ABC):
+    """
+    所有后端实现 synthesize(input_text_file, output_wav_file, ...)，参数和 audio.synthesize_text_to_voice 一致，
+    可以直接作为 scheduler.synthesize_batch / synthesize_with_retry 的 synthesize_func 使用
+    没有实现 synthesize 的后端在创建时就会报错
+    """
+    name = ''
+
+    # 合成一个文本文件为 wav 文件
+    @abstractmethod
+    def synthesize(self, input_text_file: str, output_wav_file: str, rate_limiter=None, **kwargs):
+        """
+        参数：
+        input_text_file：str，输入文本文件
+        output_wav_file：str，输出 wav 文件
+        rate_limiter：RateLimiter，请求限流（本地引擎不需要时忽略）
+        kwargs：其他参数（timing_file 等），和 audio.synthesize_text_to_voice 一致
+        """
+
+    # 影响合成结果的参数（用于构建图判断语音文件是否需要重新生成）
+    def get_params(self) -> dict:
+        return {"backend": self.name}
+
+    # 释放后端占用的资源
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+# Azure 语音服务
+class AzureTTSBackend(TTSBackend):
+    name = 'azure'
+
+    def __init__(self, voice_name: str = 'zh-CN-YunzeNeural', subscription: str = '', region: str = '', use_cache: bool = True):
+        self.voice_name = voice_name
+        self.subscription = subscription
+        self.region = region
+        self.use_cache = use_cache
+        # 合成器在多次合成之间复用（后端长期使用时不用每个文件重新建立连接）
+        self.synthesizer_pool = SynthesizerPool()
+
+    def synthesize(self, input_text_file: str, output_wav_file: str, rate_limiter=None, **kwargs):
+        kwargs.setdefault('voice_name', self.voice_name)
+        kwargs.setdefault('synthesizer_pool', self.synthesizer_pool)
+        return synthesize_text_to_voice(input_text_file, output_wav_file, subscription=self.subscription, region=self.region,
+                                        use_cache=self.use_cache, rate_limiter=rate_limiter, **kwargs)
+
+    def get_params(self) -> dict:
+        return {"backend": self.name, "voice_name": self.voice_name}
+
+    def close(self):
+        self.synthesizer_pool.clear()
+
+
+# pyttsx3 本地引擎（离线）
+class Pyttsx3TTSBackend(TTSBackend):
+    """
+    pyttsx3 引擎只能在创建它的线程中使用，并且 runAndWait 期间不能并发，
+    所以启动多个工作进程（python -m VideoMake.tts --worker），每个进程初始化一次引擎，
+    通过标准输入输出逐行传递任务，合成时从空闲进程中取一个使用
+
+    参数：
+    voice_name：str，声音ID或名称（部分匹配），Azure 风格的名称（如 zh-CN-YunzeNeural）按语言匹配，找不到时使用系统默认声音
+    rate：int，语速（每分钟字数），0表示默认
+    volume：float，音量 0-1，None表示默认
+    workers：int，工作进程数，0表示CPU核数
+    timeout：float，合成一个文件的最长等待时间（秒），超时后结束工作进程并抛出异常
+    """
+    name = 'pyttsx3'
+
+    def __init__(self, voice_name: str = '', rate: int = 0, volume: float = None, workers: int = 0, timeout: float = PYTTSX3_SYNTHESIS_TIMEOUT):
+        self.voice_name = voice_name
+        self.rate = rate
+        self.volume = volume
+        self.workers = workers if workers > 0 else (os.cpu_count() or 1)
+        self.timeout = timeout
+        self.idle = queue.Queue()
+        self.procs = []
+        self.lock = threading.Lock()
+        self.closed = False
+
+    # 启动一个工作进程（调用方持有 self.lock）
+    def start_worker(self):
+        cmd = [sys.executable, '-m', 'VideoMake.tts', '--worker', '--voice', self.voice_name, '--rate', str(self.rate)]
+        if self.volume is not None:
+            cmd += ['--volume', str(self.volume)]
+        cwd = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, cwd=cwd, bufsize=1,
+                                universal_newlines=True, encoding='utf-8')
+        self.procs.append(proc)
+        return proc
+
+    # 取一个空闲的工作进程（进程数没有达到上限时启动新进程）
+    def acquire_worker(self):
+        """
+        空闲队列中的 None 表示有工作进程退出或者后端已关闭，等待的线程取到后重新检查：
+        进程数低于上限时启动新的工作进程代替，不会一直等待已经退出的进程
+        """
+        while True:
+            with self.lock:
+                if self.closed:
+                    raise Exception("pyttsx3 backend is closed")
+                if self.idle.empty() and len(self.procs) < self.workers:
+                    return self.start_worker()
+            try:
+                proc = self.idle.get(timeout=PYTTSX3_POLL_INTERVAL)
+            except queue.Empty:
+                continue
+            if proc is not None:
+                return proc
+
+    # 结束一个工作进程（通知等待空闲进程的线程重新检查）
+    def stop_worker(self, proc):
+        with self.lock:
+            if proc in self.procs:
+                self.procs.remove(proc)
+        self.idle.put(None)
+        try:
+            proc.stdin.close()
+        except OSError:
+            pass
+        try:
+            proc.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+    # 读取工作进程返回的一行结果，超时后结束工作进程（readline 随之返回空字符串）
+    def read_result(self, proc) -> str:
+        lines = []
+        reader = threading.Thread(target=lambda: lines.append(proc.stdout.readline()), daemon=True)
+        reader.start()
+        reader.join(self.timeout)
+        if reader.is_alive():
+            proc.kill()
+            reader.join()
+            raise TimeoutError("pyttsx3 synthesis timeout after {}s".format(self.timeout))
+        return lines[0] if len(lines) > 0 else ''
+
+    def synthesize(self, input_text_file: str, output_wav_file: str, rate_limiter=None, timing_file: str = '', **kwargs):
+        with open(input_text_file, 'r', encoding='utf-8', errors='ignore') as f:
+            text = f.read()
+        if text == '':
+            raise Exception("input_text_file is empty")
+
+        proc = self.acquire_worker()
+        try:
+            with span("pyttsx3.synthesize", "tts", chars=len(text)):
+                proc.stdin.write(json.dumps({"text": text, "output": os.path.abspath(output_wav_file)}, ensure_ascii=False) + "\n")
+                proc.stdin.flush()
+                line = self.read_result(proc)
+        except (OSError, TimeoutError) as e:
+            self.stop_worker(proc)
+            raise Exception("pyttsx3 worker failed: {}".format(e))
+        if line == '':
+            # 工作进程异常退出，丢弃，下次合成时重新启动
+            self.stop_worker(proc)
+            raise Exception("pyttsx3 worker exited unexpectedly, return code: {}".format(proc.poll()))
+        self.idle.put(proc)
+
+        result = json.loads(line)
+        if not result.get("ok"):
+            raise Exception("pyttsx3 synthesis failed for {}: {}".format(input_text_file, result.get("error")))
+
+        # 本地引擎没有词边界事件，按字数估算句子时间
+        if timing_file is not None:
+            duration = get_media_duration(output_wav_file)
+            save_timing_file(timing_file or get_timing_file_path(output_wav_file), estimate_sentence_timings(split_sentences(text), duration), duration)
+        print("Speech synthesized (pyttsx3) for text [{}]\n".format(text))
+
+    def get_params(self) -> dict:
+        return {"backend": self.name, "voice_name": self.voice_name, "rate": self.rate, "volume": self.volume}
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            procs = list(self.procs)
+        for proc in procs:
+            self.stop_worker(proc)
+
+
+# 所有可用的语音合成后端
+TTS_BACKENDS = {
+    AzureTTSBackend.name: AzureTTSBackend,
+    Pyttsx3TTSBackend.name: Pyttsx3TTSBackend,
+}
+
+
+# 按名称创建语音合成后端
+def get_tts_backend(name: str = 'azure', **kwargs) -> TTSBackend:
+    """
+    参数：
+    name：str，后端名称（azure / pyttsx3）
+    kwargs：传给后端构造函数的参数
+
+    调用示例：
+    backend = get_tts_backend("azure", voice_name="zh-CN-YunzeNeural")
+    """
+    if name not in TTS_BACKENDS:
+        raise Exception("Unknown tts backend: {}, support: {}".format(name, ", ".join(TTS_BACKENDS)))
+    return TTS_BACKENDS[name](**kwargs)
+
+
+# 在 pyttsx3 引擎中选择声音
+def select_pyttsx3_voice(engine, voice_name: str):
+    if not voice_name:
+        return
+    voices = engine.getProperty('voices')
+    # 先按ID或名称匹配
+    for voice in voices:
+        if voice_name == voice.id or voice_name.lower() in (voice.name or '').lower():
+            engine.setProperty('voice', voice.id)
+            return
+    # Azure 风格名称（zh-CN-YunzeNeural）按语言匹配
+    language = voice_name.split('-')[0].lower()
+    for voice in voices:
+        languages = [l.decode('utf-8', errors='ignore') if isinstance(l, bytes) else str(l) for l in (voice.languages or [])]
+        if any(language in l.lower() for l in languages) or language in voice.id.lower():
+            engine.setProperty('voice', voice.id)
+            return
+    print("Warning: pyttsx3 voice not found, use default voice: {}".format(voice_name), file=sys.stderr)
+
+
+# 合成结果统一为 wav（macOS 的 nsss 驱动输出 aiff 格式）
+def ensure_wav_file(tmp_file: str, output_wav_file: str):
+    with open(tmp_file, 'rb') as f:
+        header = f.read(4)
+    if header == b'RIFF':
+        os.replace(tmp_file, output_wav_file)
+        return
+    if not tool_is_installed('ffmpeg'):
+        raise Exception("pyttsx3 output is not wav and ffmpeg is not installed: {}".format(tmp_file))
+    try:
+        run_ffmpeg(['-y', '-i', tmp_file, output_wav_file], name="pyttsx3-wav")
+    finally:
+        os.remove(tmp_file)
+
+
+# 工作进程：初始化一次引擎，逐行读取任务并合成
+def run_pyttsx3_worker(voice_name: str = '', rate: int = 0, volume: float = None):
+    # 标准输出只用于返回结果，引擎和驱动的输出转到标准错误
+    result_out = os.fdopen(os.dup(sys.stdout.fileno()), 'w', encoding='utf-8')
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+
+    import pyttsx3
+    engine = pyttsx3.init()
+    select_pyttsx3_voice(engine, voice_name)
+    if rate > 0:
+        engine.setProperty('rate', rate)
+    if volume is not None:
+        engine.setProperty('volume', volume)
+
+    for line in sys.stdin:
+        if line.strip() == '':
+            continue
+        job = json.loads(line)
+        try:
+            base, ext = os.path.splitext(job["output"])
+            tmp_file = base + ".tts" + ext
+            engine.save_to_file(job["text"], tmp_file)
+            engine.runAndWait()
+            if not os.path.exists(tmp_file):
+                raise Exception("pyttsx3 did not write output file")
+            ensure_wav_file(tmp_file, job["output"])
+            result = {"ok": True}
+        except Exception as e:
+            result = {"ok": False, "error": "{}: {}".format(type(e).__name__, e)}
+        result_out.write(json.dumps(result) + "\n")
+        result_out.flush()
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="pyttsx3 synthesis worker")
+    parser.add_argument("--worker", action="store_true", help="run as a worker reading jobs from stdin")
+    parser.add_argument("--voice", default='', help="voice id or name")
+    parser.add_argument("--rate", type=int, default=0, help="speech rate (words per minute)")
+    parser.add_argument("--volume", type=float, default=None, help="volume 0-1")
+    args = parser.parse_args()
+    if args.worker:
+        run_pyttsx3_worker(args.voice, args.rate, args.volume)
@@ -15,12 +15,10 @@ import time
 import datetime
 import platform
 import subprocess
-import pyttsx3
 from PIL import Image
-from pydub import AudioSegment
-import azure.cognitiveservices.speech as speechsdk
 from . import defined
 from .defined import *
+from .deps import find_tool, tool_is_installed, get_tool_command
 
 
 
@@ -47,18 +45,10 @@ def check_command_exist(command):
     
     返回值：
     如果命令存在，则返回命令所在的路径；否则返回 None。
+
+    查找结果每个进程只查找一次（参考 deps.find_tool），不再启动 which / where 子进程
     """
-    if platform.system() == "Windows":
-        where_command = "where"
-    else:
-        where_command = "which"
-    try:
-        output = subprocess.check_output([where_command, command], shell=True)
-    except subprocess.CalledProcessError:
-        return None
-    else:
-        command_path = output.decode("utf-8").strip()
-        return command_path
+    return find_tool(command)
 
 
 # 判断ffmpeg是否已安装
@@ -72,16 +62,7 @@ def ffmpeg_is_installed() -> bool:
     返回值：
     如果已安装则返回True，否则返回False
     """
-    if check_command_exist("ffmpeg") is None:
-        return False
-    else:
-        return True
-    
-    ret = os.system("ffmpeg -version")  # 运行ffmpeg命令
-    if ret == 0:  # 命令执行成功，说明ffmpeg已安装
-        return True
-    else:  # 命令执行失败，说明ffmpeg未安装
-        return False
+    return tool_is_installed("ffmpeg")
     
 #判断vlc播放器是否安装
 def vlc_is_installed() -> bool:
@@ -94,16 +75,7 @@ def vlc_is_installed() -> bool:
     返回值：
     如果已安装则返回True，否则返回False
     """
-    if check_command_exist("vlc") is None:
-        return False
-    else:
-        return True
-    
-    try:
-        subprocess.call(['vlc', '--version'])
-        return True
-    except OSError:
-        return False
+    return tool_is_installed("vlc")
 
 # 播放视频
 def play_video(video_path):
@@ -113,10 +85,10 @@ def play_video(video_path):
         return False
     if vlc_is_installed() is True:
         # s = f'vlc {video_path}'
-        subprocess.call(f'vlc {video_path}', shell=True)
+        subprocess.call([get_tool_command('vlc'), video_path])
         return True
-    elif ffmpeg_is_installed() is True:
-        subprocess.call(f'ffplay -autoexit {video_path}', shell=True)
+    elif tool_is_installed("ffplay") is True:
+        subprocess.call([get_tool_command('ffplay'), '-autoexit', video_path])
         return True
     else:
         print("No video player(vlc or ffmpeg) installed, please install video player!")
@@ -177,14 +149,12 @@ def is_ffmpeg_installed() -> bool:
     返回值：
     如果已安装则返回True，否则返回False
     """
-    ret = os.system("ffmpeg -version")  # 运行ffmpeg命令
-    if ret == 0:  # 命令执行成功，说明ffmpeg已安装
-        return True
-    else:  # 命令执行失败，说明ffmpeg未安装
-        return False
+    return tool_is_installed("ffmpeg")
 
 # 调用内置tts引擎播放文字
 def ttsx3_say(text):
+    # pyttsx3 只在这里使用，用到时才导入
+    import pyttsx3
     #	语音模块初始化
     engine = pyttsx3.init()
     #	设置要播报的字符串
@@ -196,103 +166,54 @@ def ttsx3_say(text):
 
 
 # 扫描原始文件是否准备好
-def check_input_files():
-    video_bg_files = []
-    video_text_files = []
-    voice_text_files = []
-    video_bg_files_seq = []
-    video_text_files_seq = []
-    voice_text_files_seq = []
-
-    result = {}
-
-    # 扫描背景图文件
-    # print(defined.INPUT_ROOT_PATH)
-    for file in os.listdir(defined.INPUT_ROOT_PATH):
-        # print(file)
-        # 处理视频背景图文件
-        if file.startswith(VIDEO_BG_PREFIX) and file.endswith(PNG_SUFFIX):            
-            tmp_name = file.replace(VIDEO_BG_PREFIX, "").replace(PNG_SUFFIX, "")
-            if tmp_name.isdigit() == False:
-                raise Exception("video_bg_files file name must be number")
-            video_bg_files.append(file)
-            video_bg_files_seq.append(int(tmp_name))
-            result.setdefault(tmp_name, {})
-            result[tmp_name][VIDEO_BG_FILE] = file
-
-
-        #处理视频显示文本文件
-        if file.startswith(VIDEO_TEXT_PREFIX) and file.endswith(TEXT_SUFFIX):
-            tmp_name = file.replace(VIDEO_TEXT_PREFIX, "").replace(TEXT_SUFFIX, "")
-            if tmp_name.isdigit() == False:
-                raise Exception("video_text_files file name must be number")
-            video_text_files.append(file)
-            video_text_files_seq.append(int(tmp_name))
-            result.setdefault(tmp_name, {})
-            result[tmp_name][VIDEO_TEXT_FILE] = file
-
-        #处理视频语音文本文件
-        if file.startswith(VOICE_TEXT_PREFIX) and file.endswith(TEXT_SUFFIX):
-            tmp_name = file.replace(VOICE_TEXT_PREFIX, "").replace(TEXT_SUFFIX, "")
-            if tmp_name.isdigit() == False:
-                raise Exception("voice_text_files file name must be number")
-            voice_text_files.append(file)
-            voice_text_files_seq.append(int(tmp_name))
-            result.setdefault(tmp_name, {})
-            result[tmp_name][VOICE_TEXT_FILE] = file
-
-
-    # 判断三个文件列表是否一致
-    if len(video_bg_files) != len(video_text_files) or len(video_bg_files) != len(voice_text_files):
-        print("Error: Input ' video_text_files / voice_text_files / video_bg_img ' must be same length, please check path:", defined.INPUT_ROOT_PATH, "\n")
-        raise Exception("video_bg_files and video_text_files and voice_text_files must be same length")
-    
-    #判断列表中序列号是否一致
-    if video_bg_files_seq != video_text_files_seq or video_bg_files_seq != voice_text_files_seq:
-        print("Error: Input video_bg_files and video_text_files and voice_text_files must be same sequence number, please check path:", defined.INPUT_ROOT_PATH, "\n")
-        raise Exception("video_bg_files and video_text_files and voice_text_files must be same sequence number")
-        
-    #返回文件列表
-    return result
+def check_input_files(rescan: bool = False):
+    """
+    扫描和校验由 project 模块完成，结果保存在项目清单中，输入文件名没有变化时不再重复校验
+
+    返回值：
+    dict，{序号: {VIDEO_BG_FILE: 文件名, VIDEO_TEXT_FILE: 文件名, VOICE_TEXT_FILE: 文件名}, ...}，按序号数值排序
+    """
+    from .project import load_project_manifest, get_project_segments
+    return get_project_segments(load_project_manifest(rescan=rescan))
 
 # 获取输出的wav文件路径
 def get_output_wav_file_path(num):
-    if os.path.exists(INPUT_AUDIO_ROOT_PATH) is False:
-        os.makedirs(INPUT_AUDIO_ROOT_PATH)        
-    output_file = INPUT_AUDIO_ROOT_PATH + num +''+ WAV_SUFFIX 
+    if os.path.exists(defined.INPUT_AUDIO_ROOT_PATH) is False:
+        os.makedirs(defined.INPUT_AUDIO_ROOT_PATH)        
+    output_file = defined.INPUT_AUDIO_ROOT_PATH + num +''+ WAV_SUFFIX 
     return output_file
 
 # 获取输出的mp3文件路径
 def get_output_mp3_file_path(num):
-    if os.path.exists(INPUT_AUDIO_ROOT_PATH) is False:
-        os.makedirs(INPUT_AUDIO_ROOT_PATH)    
-    output_file = INPUT_AUDIO_ROOT_PATH + num +''+ MP3_SUFFIX
+    if os.path.exists(defined.INPUT_AUDIO_ROOT_PATH) is False:
+        os.makedirs(defined.INPUT_AUDIO_ROOT_PATH)    
+    output_file = defined.INPUT_AUDIO_ROOT_PATH + num +''+ MP3_SUFFIX
     return output_file
 
 # 获取背景图片文件路径
 def get_bg_img_file_path(num):
-    if os.path.exists(INPUT_ROOT_PATH) is False:
-        os.makedirs(INPUT_ROOT_PATH)
-    output_file = INPUT_ROOT_PATH + num +''+ PNG_SUFFIX
+    if os.path.exists(defined.INPUT_ROOT_PATH) is False:
+        os.makedirs(defined.INPUT_ROOT_PATH)
+    output_file = defined.INPUT_ROOT_PATH + num +''+ PNG_SUFFIX
     return output_file
 
 # 获取输出的图片文件路径
 def get_output_img_file_path(num):
-    if os.path.exists(INPUT_IMGS_ROOT_PATH) is False:
-        os.makedirs(INPUT_IMGS_ROOT_PATH)
-    output_file = INPUT_IMGS_ROOT_PATH + num +''+ PNG_SUFFIX
+    if os.path.exists(defined.INPUT_IMGS_ROOT_PATH) is False:
+        os.makedirs(defined.INPUT_IMGS_ROOT_PATH)
+    output_file = defined.INPUT_IMGS_ROOT_PATH + num +''+ PNG_SUFFIX
     return output_file
 
 # 获取输入的文本文件路径
 def get_input_text_file_path(fname):
-    if os.path.exists(INPUT_ROOT_PATH) is False:
-        os.makedirs(INPUT_ROOT_PATH)
-    output_file = INPUT_ROOT_PATH + fname
+    if os.path.exists(defined.INPUT_ROOT_PATH) is False:
+        os.makedirs(defined.INPUT_ROOT_PATH)
+    output_file = defined.INPUT_ROOT_PATH + fname
     return output_file
 
 # 获取批量生成图片的目录
 def get_batch_img_dir_path(num):
-    img_dir = INPUT_IMGS_ROOT_PATH + num
+    img_dir = defined.INPUT_IMGS_ROOT_PATH + num
     if os.path.exists(img_dir) is False:
         os.makedirs(img_dir)
     return img_dir
@@ -300,49 +221,66 @@ def get_batch_img_dir_path(num):
 # 获取中途视频文件目录
 def get_input_video_file_path(num):
     # print(1111111111111111111111)
-    if os.path.exists(INPUT_VIDEO_ROOT_PATH) is False:
+    if os.path.exists(defined.INPUT_VIDEO_ROOT_PATH) is False:
         # print(222222222222222222222)
-        os.makedirs(INPUT_VIDEO_ROOT_PATH)    
-    video_file_path = INPUT_VIDEO_ROOT_PATH +''+ num + MP4_SUFFIX
+        os.makedirs(defined.INPUT_VIDEO_ROOT_PATH)    
+    video_file_path = defined.INPUT_VIDEO_ROOT_PATH +''+ num + MP4_SUFFIX
     return video_file_path
 
 
 # 获取生成视频的路径
 def get_output_video_file_path(file_name = ''):
     if file_name != '':
-        output_file = OUTPUT_ROOT_PATH + file_name + MP4_SUFFIX
+        output_file = defined.OUTPUT_ROOT_PATH + file_name + MP4_SUFFIX
         return output_file
     
     # 获取年月日时分秒
     now = datetime.datetime.now()
     fname = str(now.year) +""+ str(now.month) +""+ str(now.day) +"-"+ str(now.hour) +""+ str(now.minute) +""+ str(now.second)
 
-    output_file = OUTPUT_ROOT_PATH + 'final'+ '-' + fname + MP4_SUFFIX
+    output_file = defined.OUTPUT_ROOT_PATH + 'final'+ '-' + fname + MP4_SUFFIX
     return output_file
 
 # 获取需要合成最终视频的临时list文件路径
 def get_input_video_list_file_path(file_name = 'videolist'):
-    if os.path.exists(INPUT_VIDEO_ROOT_PATH) is False:
-        os.makedirs(INPUT_VIDEO_ROOT_PATH)    
-    video_list_file = INPUT_VIDEO_ROOT_PATH +''+ file_name + TEXT_SUFFIX
+    if os.path.exists(defined.INPUT_VIDEO_ROOT_PATH) is False:
+        os.makedirs(defined.INPUT_VIDEO_ROOT_PATH)    
+    video_list_file = defined.INPUT_VIDEO_ROOT_PATH +''+ file_name + TEXT_SUFFIX
     return video_list_file   
 
 
 # 获取字幕文件
 def get_input_srt_file_path(video_name = ''):
-    if os.path.exists(INPUT_SRT_ROOT_PATH) is False:
-        os.makedirs(INPUT_SRT_ROOT_PATH)        
+    if os.path.exists(defined.INPUT_SRT_ROOT_PATH) is False:
+        os.makedirs(defined.INPUT_SRT_ROOT_PATH)        
     if video_name == '':
         video_name = 'final'
-    srt_file_path = INPUT_SRT_ROOT_PATH +''+ video_name + SRT_SUFFIX
+    srt_file_path = defined.INPUT_SRT_ROOT_PATH +''+ video_name + SRT_SUFFIX
     return srt_file_path
 
 # 字幕文件来源的临时文件路径
 def get_input_srt_audio_file_path(audio_name = ''):
-    if os.path.exists(INPUT_AUDIO_ROOT_PATH) is False:
-        os.makedirs(INPUT_AUDIO_ROOT_PATH)        
+    if os.path.exists(defined.INPUT_AUDIO_ROOT_PATH) is False:
+        os.makedirs(defined.INPUT_AUDIO_ROOT_PATH)        
     if audio_name == '':
         audio_name = 'final'
-    audio_file_path = INPUT_AUDIO_ROOT_PATH +''+ audio_name + WAV_SUFFIX
+    audio_file_path = defined.INPUT_AUDIO_ROOT_PATH +''+ audio_name + WAV_SUFFIX
     return audio_file_path
 
+# 获取语音合成句子缓存目录
+def get_tts_cache_dir_path():
+    if os.path.exists(defined.TTS_CACHE_ROOT_PATH) is False:
+        os.makedirs(defined.TTS_CACHE_ROOT_PATH)
+    return defined.TTS_CACHE_ROOT_PATH
+
+# 获取增量构建状态文件路径
+def get_build_state_file_path():
+    if os.path.exists(defined.INPUT_ROOT_PATH) is False:
+        os.makedirs(defined.INPUT_ROOT_PATH)
+    return defined.INPUT_ROOT_PATH + BUILD_STATE_FILE
+
+# 获取显示图片缓存目录
+def get_slide_cache_dir_path():
+    if os.path.exists(defined.SLIDE_CACHE_ROOT_PATH) is False:
+        os.makedirs(defined.SLIDE_CACHE_ROOT_PATH)
+    return defined.SLIDE_CACHE_ROOT_PATH
@@ -12,16 +12,21 @@ site: github.com/heiyeluren
 '''
 
 import os
+import queue
 import platform
+import threading
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image
-from pydub import AudioSegment
-import azure.cognitiveservices.speech as speechsdk
 
 from . import defined
 from .defined import *
 from . import util
 from .util import *
+from .media import get_media_duration
+from .encode import get_encode_profile, get_video_encode_args, get_audio_encode_args
+from .ffmpeg import FFmpegProcess, run_ffmpeg
+from .trace import span
 
 
 '''
@@ -52,10 +57,8 @@ def get_audio_duration(file_path: str, is_int = False):
         raise Exception("audio file is not exists")
 
     
-    # 使用pydub读取音频文件
-    audio_file = AudioSegment.from_file(file_path)
-    # 获取音频文件的时长
-    duration = audio_file.duration_seconds
+    # 读取文件头获取时长（wav直接解析文件头，其他格式调用ffprobe），不解码音频数据
+    duration = get_media_duration(file_path)
     if is_int:
         return int(duration)
     else:
@@ -115,9 +118,10 @@ def make_img_from_audio(audio_file_path: str, src_img_file: str, save_img_dir: s
     if not os.path.exists(save_img_dir):
         os.makedirs(save_img_dir)
     # 保存图片
-    for i in range(total):
-        output_image_path = os.path.join(save_img_dir, "{0:03d}.png".format(i))  # 文件名为0到179的三位数字，例如"001.jpg"
-        im.save(output_image_path)
+    with span("make_img_from_audio", "image", file=os.path.basename(src_img_file), count=total):
+        for i in range(total):
+            output_image_path = os.path.join(save_img_dir, "{0:03d}.png".format(i))  # 文件名为0到179的三位数字，例如"001.jpg"
+            im.save(output_image_path)
 
 
 '''
@@ -132,22 +136,271 @@ audio_path = "audio.mp3"
 
 images_to_video(img_path, output_path, audio_path, frame_rate=2, video_size="1920x1080", video_codec='libx264')
 
+
+静态图片模式（is_still_image=True）：
+img_path 直接传入单张图片文件（比如 draw_*_page 生成的 input/img/01.png），不再需要 make_img_from_audio 批量复制图片，
+ffmpeg 只读取一次图片并循环保持画面，视频时长精确等于音频时长（不再取整）；编码使用 -tune stillimage 针对静态画面优化。
+
+images_to_video("input/img/01.png", "input/video/01.mp4", "input/audio/01.wav", frame_rate=1, is_still_image=True)
+
+
+编码参数（profile）：
+video_size / video_codec / 像素格式 / preset / crf / tune / 关键帧间隔 由编码配置决定（参考 encode.ENCODE_PROFILES），
+默认使用 standard 配置，草稿预览可以使用 draft，存档使用 archive；video_size、video_codec 传值时覆盖配置
+
+images_to_video("input/img/01.png", "input/video/01.mp4", "input/audio/01.wav", frame_rate=1, is_still_image=True, profile="draft")
+
 '''
-def images_to_video(img_path, output_path, audio_path=None, frame_rate=2, video_size="1920x1080", video_codec='libx264'):
+def images_to_video(img_path, output_path, audio_path=None, frame_rate=2, video_size=None, video_codec=None, is_still_image=False, threads=0, profile=None):
 
     # 创建一个保存视频的文件夹
     if not os.path.exists(os.path.dirname(output_path)):
         os.makedirs(os.path.dirname(output_path))
 
-    if audio_path is None:
-        subprocess.call(f"ffmpeg -f image2 -r {frame_rate} -i {img_path}/%03d.png -s {video_size} -pix_fmt yuv420p -c:v {video_codec} {output_path}", shell=True)
+    encode_profile = get_encode_profile(profile, video_size=video_size, video_codec=video_codec)
+    video_args = get_video_encode_args(encode_profile, frame_rate, threads, is_still=is_still_image)
+    audio_args = get_audio_encode_args(encode_profile)
+
+    if is_still_image:
+        still_image_to_video(img_path, output_path, audio_path, frame_rate, threads=threads, profile=encode_profile)
+    elif audio_path is None:
+        run_ffmpeg(['-y', '-f', 'image2', '-r', frame_rate, '-i', img_path + '/%03d.png'] + video_args + [output_path])
     else:
-        subprocess.call(f"ffmpeg -f image2 -r {frame_rate} -i {img_path}/%03d.png -i {audio_path} -s {video_size} -pix_fmt yuv420p -c:v {video_codec} -c:a aac -map 0:v:0 -map 1:a:0? {output_path}", shell=True)
+        run_ffmpeg(['-y', '-f', 'image2', '-r', frame_rate, '-i', img_path + '/%03d.png', '-i', audio_path] + video_args + audio_args + ['-map', '0:v:0', '-map', '1:a:0?', output_path])
 
     #修改文件权限
     os.chmod(output_path, 0o777)
 
 
+# 单张静态图片 + 音频生成视频
+def still_image_to_video(img_file, output_path, audio_path=None, frame_rate=1, video_size=None, video_codec=None, duration=None, threads=0, profile=None,
+                         progress=None, cancel_event=None):
+    """
+    单张静态图片直接生成视频，不需要生成逐帧图片
+
+    参数：
+    img_file：str，图片文件路径
+    output_path：str，输出视频路径
+    audio_path：str，音频文件路径（视频时长以音频时长为准）
+    frame_rate：int，视频帧率
+    video_size：str，视频尺寸，不传使用编码配置中的尺寸
+    video_codec：str，视频编码器，不传使用编码配置中的编码器
+    duration：float，视频时长（秒），不传则读取音频的精确时长
+    threads：int，ffmpeg编码线程数，0表示由ffmpeg自动决定（并行渲染时用于分配CPU核数）
+    profile：str 或 dict，编码配置（draft / standard / archive），默认 standard
+    progress：进度回调（参考 ffmpeg.FFmpegProcess）
+    cancel_event：threading.Event，设置后结束编码
+
+    返回值：
+    无
+    """
+    img_file = img_file.replace("\\", "/")
+    if not os.path.isfile(img_file):
+        raise Exception("Image file not found: {}".format(img_file))
+
+    if duration is None:
+        if audio_path is None:
+            raise Exception("duration or audio_path is required for still image video")
+        duration = get_audio_duration(audio_path)
+
+    encode_profile = get_encode_profile(profile, video_size=video_size, video_codec=video_codec)
+
+    # -loop 1 循环读取同一张图片，-t 精确控制时长，-tune stillimage 针对静态画面编码
+    args = ['-y', '-loop', '1', '-framerate', frame_rate, '-i', img_file]
+    if audio_path is not None:
+        args += ['-i', audio_path]
+    args += ['-t', '{:.3f}'.format(duration)] + get_video_encode_args(encode_profile, frame_rate, threads, is_still=True)
+    if audio_path is not None:
+        args += get_audio_encode_args(encode_profile) + ['-map', '0:v:0', '-map', '1:a:0']
+    args += [output_path]
+    run_ffmpeg(args, duration=duration, progress=progress, cancel_event=cancel_event)
+
+
+# 内存帧直接通过管道输入 ffmpeg 编码
+class FrameStreamEncoder:
+    """
+    把内存中的图片帧（PIL Image）以原始视频格式（rawvideo rgb24）通过 stdin 管道写入 ffmpeg，不经过磁盘图片文件
+
+    写入的帧先放入有界队列，由后台线程写入管道；队列满时 write 会阻塞（背压），
+    编码跟不上时生产帧的一方会自动等待，内存占用不会超过 max_buffer 帧
+
+    参数：
+    output_path：str，输出视频路径
+    frame_size：tuple，输入帧尺寸 (宽, 高)，所有帧必须一致
+    frame_rate：int，输入帧率
+    audio_path：str，音频文件路径，可选
+    video_size：str，输出视频尺寸，不传使用编码配置中的尺寸
+    video_codec：str，视频编码器，不传使用编码配置中的编码器
+    duration：float，输出视频时长（秒），不传则以输入帧数为准
+    hold_last_frame：bool，是否一直保持最后一帧直到 duration（静态画面只需要写入一帧）
+    threads：int，ffmpeg编码线程数，0表示自动
+    max_buffer：int，最多缓冲的帧数
+    profile：str 或 dict，编码配置（draft / standard / archive），默认 standard
+    progress：进度回调（参考 ffmpeg.FFmpegProcess）
+    cancel_event：threading.Event，设置后结束编码（比如流水线中其他分段已经失败）
+
+    调用示例：
+    with FrameStreamEncoder("input/video/01.mp4", image.size, 1, "input/audio/01.wav", duration=12.3, hold_last_frame=True) as encoder:
+        encoder.write(image)
+    """
+    def __init__(self, output_path, frame_size, frame_rate=1, audio_path=None, video_size=None, video_codec=None,
+                 duration=None, hold_last_frame=False, threads=0, max_buffer=8, profile=None, progress=None, cancel_event=None):
+        if hold_last_frame and duration is None:
+            if audio_path is None:
+                raise Exception("duration or audio_path is required when hold_last_frame is True")
+            duration = get_audio_duration(audio_path)
+
+        output_dir = os.path.dirname(output_path)
+        if output_dir != '' and not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+
+        self.frame_size = tuple(frame_size)
+        args = ['-y', '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', '{}x{}'.format(*self.frame_size),
+                '-framerate', str(frame_rate), '-i', '-']
+        if audio_path is not None:
+            args += ['-i', audio_path]
+        if hold_last_frame:
+            # 管道输入结束后循环保持最后一帧，由 -t 控制精确时长
+            args += ['-vf', 'tpad=stop=-1:stop_mode=clone']
+        if duration is not None:
+            args += ['-t', '{:.3f}'.format(duration)]
+        encode_profile = get_encode_profile(profile, video_size=video_size, video_codec=video_codec)
+        args += get_video_encode_args(encode_profile, frame_rate, threads, is_still=hold_last_frame)
+        if audio_path is not None:
+            args += get_audio_encode_args(encode_profile) + ['-map', '0:v:0', '-map', '1:a:0']
+        args += [output_path]
+
+        self.output_path = output_path
+        self.error = None
+        self.queue = queue.Queue(maxsize=max(1, max_buffer))
+        self.process = FFmpegProcess(args, duration=duration, progress=progress, cancel_event=cancel_event, stdin=True)
+        self.thread = threading.Thread(target=self._write_loop, daemon=True)
+        self.thread.start()
+
+    # 后台线程：从队列取帧写入 ffmpeg 管道
+    def _write_loop(self):
+        last_frame = None
+        last_bytes = None
+        while True:
+            frame = self.queue.get()
+            if frame is None:
+                break
+            if self.error is not None:
+                continue  # 出错后继续取走队列中的帧，避免写入方一直阻塞
+            try:
+                # 同一张图片重复写入时只转换一次
+                if frame is not last_frame:
+                    if frame.size != self.frame_size:
+                        raise Exception("Frame size {} is not match encoder size {}".format(frame.size, self.frame_size))
+                    last_frame = frame
+                    last_bytes = frame.convert("RGB").tobytes()
+                self.process.stdin.write(last_bytes)
+            except Exception as e:
+                self.error = e
+
+    # 写入一帧（队列满时阻塞）
+    def write(self, frame):
+        if self.error is not None:
+            raise Exception("Frame stream encode failed: {}".format(self.error))
+        self.queue.put(frame)
+
+    # 结束写入，等待编码完成（ffmpeg 失败时抛出带 stderr 的 FFmpegError）
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        self.process.wait()
+        if self.error is not None:
+            raise Exception("Frame stream encode failed: {}".format(self.error))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            # 写入方出错时结束 ffmpeg，不再等待编码
+            self.queue.put(None)
+            self.process.kill()
+            self.thread.join()
+            self.process.__exit__(exc_type, exc, tb)
+        return False
+
+
+# 内存中的单张图片直接编码为视频（不生成中间图片文件）
+def stream_image_to_video(image, output_path, audio_path=None, frame_rate=1, video_size=None, video_codec=None, duration=None, threads=0, profile=None,
+                          progress=None, cancel_event=None):
+    """
+    draw_*_page 在内存中生成的图片直接通过管道输入 ffmpeg，只写入一帧，保持到音频结束
+
+    调用示例：
+    image = draw_contents_page("input/video_text_02.txt", None, "input/video_bg_02.png")
+    stream_image_to_video(image, "input/video/02.mp4", "input/audio/02.wav")
+    """
+    with FrameStreamEncoder(output_path, image.size, frame_rate, audio_path, video_size, video_codec,
+                            duration=duration, hold_last_frame=True, threads=threads, profile=profile,
+                            progress=progress, cancel_event=cancel_event) as encoder:
+        encoder.write(image)
+
+
+# 获取同时渲染的分段数量（0表示使用CPU核数，不超过分段总数）
+def get_render_jobs(jobs: int, total: int = 0) -> int:
+    if jobs <= 0:
+        jobs = os.cpu_count() or 1
+    if total > 0:
+        jobs = min(jobs, total)
+    return max(1, jobs)
+
+
+# 获取每个 ffmpeg 子进程分配的编码线程数（CPU总核数/并行数量）
+def get_segment_threads(jobs: int) -> int:
+    return max(1, (os.cpu_count() or 1) // get_render_jobs(jobs))
+
+
+# 并行渲染多个分段视频，然后按原始顺序合并
+def render_segments(segments: list, output_video_file_path: str, video_list_file: str, jobs: int = 0, frame_rate: int = 1, profile=None):
+    """
+    并行渲染分段视频（静态图片模式），全部完成后按原始分段顺序调用 merge_videos 合并
+
+    每个分段是一个独立的 ffmpeg 子进程，工作线程只负责调度和等待子进程，
+    每个 ffmpeg 子进程分配 CPU总核数/jobs 个编码线程，避免多个进程同时抢占全部CPU
+
+    参数：
+    segments：list，分段列表，每一项为 (图片文件, 音频文件, 分段视频输出文件)，顺序即合并顺序
+    output_video_file_path：str，合并后的视频输出路径
+    video_list_file：str，合并使用的临时list文件路径
+    jobs：int，同时渲染的分段数量，0表示使用CPU核数
+    frame_rate：int，视频帧率
+    profile：str 或 dict，编码配置（draft / standard / archive），默认 standard
+
+    返回值：
+    list，按原始顺序排列的分段视频文件列表
+
+    调用示例：
+    render_segments([("input/img/01.png", "input/audio/01.wav", "input/video/01.mp4")], "output/base.mp4", "input/video/videolist.txt", jobs=4)
+    """
+    jobs = get_render_jobs(jobs, len(segments))
+    threads = get_segment_threads(jobs)
+
+    for src_img_file, audio_file, _ in segments:
+        if os.path.exists(audio_file) is False:
+            raise Exception("Audio file not found: {}".format(audio_file))
+        if os.path.exists(src_img_file) is False:
+            raise Exception("Image file not found: {}".format(src_img_file))
+
+    def render_one(segment):
+        src_img_file, audio_file, video_file = segment
+        images_to_video(src_img_file, video_file, audio_file, frame_rate, is_still_image=True, threads=threads, profile=profile)
+        return video_file
+
+    # map 保证返回结果和输入顺序一致
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        video_list = list(executor.map(render_one, segments))
+
+    merge_videos(video_list, output_video_file_path, video_list_file)
+    return video_list
+
+
 # 把多个视频文件进行合并
 """
 
@@ -161,18 +414,21 @@ file '/path/to/file4'
 """
 def merge_videos(video_list: list, output_video_file_path: str, video_list_file: str): #, output_file_name: str = ""):
     # 创建一个保存视频的文件夹
+    write_video_list_file(video_list, video_list_file)
+
+    # 使用ffmpeg把多个视频文件进行合并
+    run_ffmpeg(['-y', '-f', 'concat', '-safe', '0', '-i', video_list_file, '-c', 'copy', output_video_file_path])
+    # os.remove("videolist.txt")
+
+
+# 生成 ffmpeg concat 使用的视频列表文件
+def write_video_list_file(video_list: list, video_list_file: str):
     with open(video_list_file, "w") as f:
         for item in video_list:
             item = item.replace("\\", "/")
             f.write(f"file '{item}'\n")
         os.chmod(video_list_file, 0o777)
 
-    # 使用ffmpeg把多个视频文件进行合并
-    cmd = f'ffmpeg -f concat -safe 0 -i {video_list_file} -c copy {output_video_file_path}'
-    # print(cmd)
-    subprocess.call(cmd, shell=True)
-    # os.remove("videolist.txt")
-
 
 
 
@@ -214,11 +470,57 @@ def merge_video_srt(video_file_path, srt_file_path, output_file_path, is_play=Fa
     srt_file = os.path.basename(srt_file_path)
 
     # cd d:/Code/self/python/video3 && ffmpeg -i d:/Code/self/python/video3/output/final_raw.mp4 -vf subtitles=output/final_raw.srt d:/Code/self/python/video3/output/final.mp4
-    cmdLine = 'cd {srt_dir_path} && ffmpeg -i {video_file_path} -vf subtitles="{srt_file}" {output_file_path}'
-    cmdLine = cmdLine.format(srt_dir_path=srt_dir_path, video_file_path=video_file_path, srt_file=srt_file, output_file_path=output_file_path)
-    # print(cmdLine)
-    
-    subprocess.call(cmdLine, shell=True)
+    run_ffmpeg(['-y', '-i', video_file_path, '-vf', 'subtitles={}'.format(srt_file), output_file_path], cwd=srt_dir_path or None)
+
+    #播放最终视频
+    if is_play:
+        play_video(output_file_path)
+
+
+"""
+分段视频 + 字幕一次生成最终视频
+
+    merge_videos 生成 base.mp4 再由 merge_video_srt 重新编码一遍，每一帧会被编码两次；
+    这里直接用 concat 读取所有分段视频，经过 subtitles 滤镜后只编码一次，音频直接复制，不需要中间的 base.mp4
+
+    ffmpeg -f concat -safe 0 -i videolist.txt -vf subtitles="final.srt" -c:v libx264 -c:a copy final.mp4
+
+    调用示例：
+    make_final_video(["input/video/01.mp4", "input/video/02.mp4"], "input/srt/final.srt", "output/final.mp4", "input/video/videolist.txt")
+
+    输出编码进度（duration 为总时长，不传时读取分段视频时长）：
+    make_final_video(video_list, "input/srt/final.srt", "output/final.mp4", "input/video/videolist.txt", progress=make_progress_printer())
+
+"""
+def make_final_video(video_list: list, srt_file_path: str, output_file_path: str, video_list_file: str, video_codec=None, is_play=False, frame_rate=1, profile=None,
+                     progress=None, cancel_event=None, duration=None):
+
+    #文件是否存在
+    for video_file_path in video_list:
+        if not os.path.exists(video_file_path):
+            raise Exception("video file not exist: {}".format(video_file_path))
+    if not os.path.exists(srt_file_path):
+        raise Exception("srt file not exist.")
+
+    write_video_list_file(video_list, video_list_file)
+
+    srt_file_path = srt_file_path.replace("\\", "/")
+    video_list_file = video_list_file.replace("\\", "/")
+    output_file_path = output_file_path.replace("\\", "/")
+    srt_dir_path = os.path.dirname(srt_file_path)
+    srt_file = os.path.basename(srt_file_path)
+
+    # 分段视频已经是目标尺寸，不需要再缩放
+    encode_profile = get_encode_profile(profile, video_codec=video_codec)
+    video_args = get_video_encode_args(encode_profile, frame_rate, is_still=True, with_size=False)
+
+    # subtitles 滤镜使用相对路径（Windows 盘符中的冒号需要转义），所以在字幕目录中执行
+    # 总时长（用于进度百分比和剩余时间）没有传入时按分段视频时长相加
+    if duration is None and progress is not None:
+        duration = sum(get_media_duration(video_file_path) for video_file_path in video_list)
+    run_ffmpeg(['-y', '-f', 'concat', '-safe', '0', '-i', os.path.abspath(video_list_file), '-vf', 'subtitles={}'.format(srt_file)]
+               + video_args + ['-c:a', 'copy', os.path.abspath(output_file_path)],
+               name=os.path.basename(output_file_path), duration=duration, progress=progress, cancel_event=cancel_event, cwd=srt_dir_path or None)
 
     #播放最终视频
     if is_play:
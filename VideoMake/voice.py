@@ -12,14 +12,23 @@ site: github.com/heiyeluren
 
 import os
 import time
-import azure.cognitiveservices.speech as speechsdk # pip install azure-cognitiveservices-speech
-from pydub import AudioSegment  # pip install pydub
+import wave
+import threading
 import shutil
+from concurrent.futures import ThreadPoolExecutor
 
 from . import defined
 from .defined import *
 from . import util
 from .util import *
+from .media import get_media_duration, iter_media_pcm, extract_audio_to_wav
+from .subtitle import write_srt_file
+from .audio import concat_wav_files
+from .deps import lazy_import
+from .trace import span
+
+# pip install azure-cognitiveservices-speech（第一次使用时才加载）
+speechsdk = lazy_import("azure.cognitiveservices.speech")
 
 
 '''
@@ -38,15 +47,41 @@ video_file_path = "YOUR_VIDEO_FILE_PATH"
 stt = SpeechToText(speech_key, service_region, video_file_path, audio_file_path="path/to/audio.wav", srt_file_path="path/to/output.srt")
 stt.recognize_and_save_as_srt()
 
+# 识别音频由分段语音文件直接拼接（不解码视频）
+stt = SpeechToText(speech_key, service_region, "", audio_file_path="input/audio/base.wav", srt_file_path="path/to/output.srt",
+                   segment_audio_files=["input/audio/01.wav", "input/audio/02.wav"])
+stt.recognize_and_save_as_srt()
+
+# 分段语音文件并发识别（识别结果按分段时长修正时间后合并）
+stt = SpeechToText(speech_key, service_region, "", srt_file_path="path/to/output.srt")
+stt.recognize_files_and_save_as_srt(["input/audio/01.wav", "input/audio/02.wav"], workers=4)
+
+# 长音频按60秒切分后并发识别
+stt.recognize_chunks_and_save_as_srt(chunk_seconds=60, workers=4)
+
+# 任意音视频文件边解码边识别（内存占用固定，不需要等音频提取完成）
+stt = SpeechToText(speech_key, service_region, "output/final.mkv", srt_file_path="path/to/output.srt")
+stt.recognize_stream_and_save_as_srt()
+
 
 '''
+
+# 识别使用的音频格式：16k 采样、16bit、单声道
+RECOGNIZE_SAMPLE_RATE = 16000
+
+
 class SpeechToText:
-    def __init__(self, speech_key, service_region, video_file_path, audio_file_path=None, srt_file_path=None):
+    def __init__(self, speech_key, service_region, video_file_path, audio_file_path=None, srt_file_path=None, segment_audio_files=None):
         self.speech_key = speech_key
         self.service_region = service_region
         self.video_file_path = video_file_path
+        self.language = "zh-CN"
         self.text = ''
+        self.results = []
         self.done = False
+        # 分段语音文件：提供时直接拼接为识别用的音频，不再从视频中解码
+        self.segment_audio_files = segment_audio_files
+        self.segment_offsets = []
 
         if audio_file_path is not None:
             self.audio_file_path = audio_file_path
@@ -63,6 +98,11 @@ class SpeechToText:
 
     # 提取音频文件
     def extract_audio(self):
+        if self.segment_audio_files:
+            # 分段 wav 的 PCM 数据直接拼接（和视频中的音频一致），记录每个分段的开始时间
+            self.segment_offsets = concat_wav_files(self.segment_audio_files, self.audio_file_path)
+            return
+
         # 判断音频文件格式
         audio_file_format = os.path.splitext(self.video_file_path)[1][1:].lower()
 
@@ -70,85 +110,206 @@ class SpeechToText:
         if not os.path.exists(self.video_file_path):
             raise Exception("Video file is not exists: {}".format(self.video_file_path))
 
-        if audio_file_format in ["mp3", "wav"]:
-            # 将非wav格式的音频文件转换为wav格式
-            if audio_file_format == "mp3":
-                audio = AudioSegment.from_file(self.video_file_path, "mp3")
-                audio.export(self.audio_file_path, format="wav")
-            else:  # 已经是wav格式，直接复制
-                # os.system(f"cp {self.video_file_path} {self.audio_file_path}")
-                if self.audio_file_path != self.video_file_path:
-                    shutil.copy2(self.video_file_path, self.audio_file_path)
-        elif audio_file_format == "mp4":
-            # 从mp4视频中提取音频
-            audio = AudioSegment.from_file(self.video_file_path, "mp4")
-            audio.export(self.audio_file_path, format="wav")            
-            # clip = VideoFileClip(self.video_file_path)
-            # clip.audio.write_audiofile(self.audio_file_path)
+        if audio_file_format == "wav":
+            # 已经是wav格式，直接复制
+            # os.system(f"cp {self.video_file_path} {self.audio_file_path}")
+            if self.audio_file_path != self.video_file_path:
+                shutil.copy2(self.video_file_path, self.audio_file_path)
         else:
-            raise Exception("Only support mp4, mp3 and wav audio format.")
+            # mp3、mp4 等其它格式由 ffmpeg 流式解码为 16k 单声道 wav，不把整段音频读入内存
+            extract_audio_to_wav(self.video_file_path, self.audio_file_path, RECOGNIZE_SAMPLE_RATE)
 
-    def create_speech_recognizer(self):
-        # 创建语音识别器
+    # 创建一个识别指定音频文件的识别器
+    def new_speech_recognizer(self, audio_file_path=None, audio_config=None):
         speech_config = speechsdk.SpeechConfig(subscription=self.speech_key, region=self.service_region)
-        speech_config.speech_recognition_language = "zh-CN"
-        audio_config = speechsdk.AudioConfig(filename=self.audio_file_path)
-        speech_recognizer = speechsdk.SpeechRecognizer(speech_config=speech_config, audio_config=audio_config)
-
-        # 连接回调函数
-        speech_recognizer.recognizing.connect(self.recognizing_cb)
-        speech_recognizer.recognized.connect(self.recognized_cb)
-        speech_recognizer.session_started.connect(self.session_started_cb)
-        speech_recognizer.session_stopped.connect(self.session_stopped_cb)
-        speech_recognizer.canceled.connect(self.canceled_cb)
-        speech_recognizer.session_stopped.connect(self.stop_cb)
-        speech_recognizer.canceled.connect(self.stop_cb)
-
-        self.speech_recognizer = speech_recognizer
-
-    def recognizing_cb(self, evt):
-        pass
-
-    def recognized_cb(self, evt):
-        self.text += evt.result.text
-        self.text += '\n'
-
-    def session_started_cb(self, evt):
-        pass
-
-    def session_stopped_cb(self, evt):
-        pass
+        speech_config.speech_recognition_language = self.language
+        if audio_config is None:
+            audio_config = speechsdk.AudioConfig(filename=audio_file_path)
+        return speechsdk.SpeechRecognizer(speech_config=speech_config, audio_config=audio_config)
+
+    # 识别一个音频文件，返回识别结果列表 [(开始秒数, 时长秒数, 文本), ...]
+    def recognize_file(self, audio_file_path, timeout=None) -> list:
+        """
+        每次调用使用独立的识别器和完成事件，可以在多个线程中同时识别不同的音频文件
+
+        参数：
+        audio_file_path：str，wav 音频文件
+        timeout：float，最长等待秒数，None表示一直等待
+        """
+        return self.run_recognition(self.new_speech_recognizer(audio_file_path), audio_file_path, timeout)
+
+    # 执行一次连续识别，feed 不为空时在识别开始后调用（向推送流写入音频数据）
+    def run_recognition(self, speech_recognizer, name: str, timeout=None, feed=None) -> list:
+        results = []
+        errors = []
+        done = threading.Event()
+
+        def recognized(evt):
+            if evt.result.reason == speechsdk.ResultReason.RecognizedSpeech and evt.result.text:
+                # offset / duration 的单位是 100 纳秒
+                results.append((evt.result.offset / 10 ** 7, evt.result.duration / 10 ** 7, evt.result.text))
+
+        def canceled(evt):
+            details = evt.cancellation_details
+            if details.reason == speechsdk.CancellationReason.Error:
+                errors.append("{} {}".format(details.error_code, details.error_details))
+            done.set()
+
+        speech_recognizer.recognized.connect(recognized)
+        speech_recognizer.session_stopped.connect(lambda evt: done.set())
+        speech_recognizer.canceled.connect(canceled)
+
+        with span("azure.recognize", "stt", file=name):
+            speech_recognizer.start_continuous_recognition()
+            try:
+                if feed is not None:
+                    feed()
+                finished = done.wait(timeout)
+            finally:
+                speech_recognizer.stop_continuous_recognition()
+        if not finished:
+            raise Exception("Speech recognition timeout: {}".format(name))
+        if len(errors) > 0:
+            raise Exception("Speech recognition canceled: {} {}".format(name, errors[0]))
+        return results
+
+    # 边解码边识别：ffmpeg 解码出的 PCM 直接写入识别器的推送流，不需要等音频提取完成
+    def recognize_stream(self, media_file_path: str, timeout=None, wav_file_path: str = '') -> tuple:
+        """
+        参数：
+        media_file_path：str，任意 ffmpeg 能解码的音视频文件
+        timeout：float，音频写完后最长等待识别结束的秒数，None表示一直等待
+        wav_file_path：str，同时把解码出的音频保存为 wav（不需要时为空）
+
+        返回值：
+        tuple，(识别结果列表 [(开始秒数, 时长秒数, 文本), ...], 音频时长)
+        """
+        stream_format = speechsdk.audio.AudioStreamFormat(samples_per_second=RECOGNIZE_SAMPLE_RATE, bits_per_sample=16, channels=1)
+        push_stream = speechsdk.audio.PushAudioInputStream(stream_format=stream_format)
+        audio_config = speechsdk.audio.AudioConfig(stream=push_stream)
+        speech_recognizer = self.new_speech_recognizer(audio_config=audio_config)
+        total = [0]
+
+        def feed():
+            wav_file = None
+            if wav_file_path:
+                wav_file = wave.open(wav_file_path, 'wb')
+                wav_file.setnchannels(1)
+                wav_file.setsampwidth(2)
+                wav_file.setframerate(RECOGNIZE_SAMPLE_RATE)
+            try:
+                for pcm in iter_media_pcm(media_file_path, RECOGNIZE_SAMPLE_RATE):
+                    push_stream.write(pcm)
+                    if wav_file is not None:
+                        wav_file.writeframesraw(pcm)
+                    total[0] += len(pcm)
+            finally:
+                # 关闭推送流后识别器处理完剩余音频会结束会话
+                push_stream.close()
+                if wav_file is not None:
+                    wav_file.close()
+
+        results = self.run_recognition(speech_recognizer, media_file_path, timeout, feed)
+        return results, total[0] / 2 / RECOGNIZE_SAMPLE_RATE
+
+    # 多个音频文件并发识别，识别结果按文件顺序和时长修正时间后合并
+    def recognize_files(self, audio_files: list, workers: int = 4, timeout=None) -> list:
+        """
+        参数：
+        audio_files：list，按播放顺序排列的 wav 音频文件（分段语音文件或者切分后的音频块）
+        workers：int，同时进行的识别数量
+
+        返回值：
+        list，合并后的识别结果 [(开始秒数, 时长秒数, 文本), ...]
+        """
+        offsets = []
+        offset = 0.0
+        for audio_file in audio_files:
+            offsets.append(offset)
+            offset += get_media_duration(audio_file)
+
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(audio_files)))) as executor:
+            file_results = list(executor.map(lambda f: self.recognize_file(f, timeout), audio_files))
+
+        results = []
+        for base, items in zip(offsets, file_results):
+            results += [(base + start, duration, text) for start, duration, text in items]
+        return results
+
+    # 过滤标点（全部是中文时去除标点，否则保留原文本）
+    def filter_text(self, text):
+        punctuation = '！？。＂＃＄％＆＇（）＊＋，－／：；＜＝＞＠［＼］＾＿｀｛｜｝～ '
+        filtered_text = ''.join([char for char in text if char not in punctuation])
+        if all(u'\u4e00' <= char <= u'\u9fff' for char in filtered_text):
+            return filtered_text
+        return text
+
+    def filter_srt(self, duration=None):
+        """
+        参数：
+        duration：float，没有识别结果时整段字幕的时长，None表示使用 audio_file_path 的时长
+        """
+        # 有带时间的识别结果时每条结果一条字幕
+        if len(self.results) > 0:
+            cues = [(start, start + duration, self.filter_text(text)) for start, duration, text in self.results]
+            write_srt_file(cues, self.srt_file_path)
+            return
+
+        # 生成 srt 格式的字幕文件（整段音频一条字幕）
+        if duration is None:
+            duration = get_media_duration(self.audio_file_path)
+        write_srt_file([(0, duration, self.filter_text(self.text))], self.srt_file_path)
+
+    def recognize_and_save_as_srt(self, timeout=None):
+        self.extract_audio()
+        self.results = self.recognize_file(self.audio_file_path, timeout)
+        self.text = ''.join([text + '\n' for _, _, text in self.results])
+        self.done = True
+        self.filter_srt()
 
-    def canceled_cb(self, evt):
-        pass
+    # 边解码边识别并保存为 srt（audio_file_path 不为空时同时保存提取的音频）
+    def recognize_stream_and_save_as_srt(self, timeout=None):
+        if not os.path.exists(self.video_file_path):
+            raise Exception("Video file is not exists: {}".format(self.video_file_path))
+        self.results, duration = self.recognize_stream(self.video_file_path, timeout, self.audio_file_path)
+        self.text = ''.join([text + '\n' for _, _, text in self.results])
+        self.done = True
+        self.filter_srt(duration)
 
-    def stop_cb(self, evt):
+    # 分段音频文件并发识别并保存为 srt（不需要先合并视频、提取音频）
+    def recognize_files_and_save_as_srt(self, audio_files: list, workers: int = 4, timeout=None):
+        self.results = self.recognize_files(audio_files, workers, timeout)
+        self.text = ''.join([text + '\n' for _, _, text in self.results])
         self.done = True
+        # 没有识别结果时整段字幕覆盖所有文件的总时长
+        self.filter_srt(sum([get_media_duration(audio_file) for audio_file in audio_files]))
 
-    def filter_srt(self):
-        # 去除标点符号
-        punctuation = '！？。＂＃＄％＆＇（）＊＋，－／：；＜＝＞＠［＼］＾＿｀｛｜｝～ '
-        filtered_text = ''.join([char for char in self.text if char not in punctuation])
-
-        # 生成 srt 格式的字幕文件
-        duration = len(AudioSegment.from_file(self.audio_file_path)) / 1000
-        with open(self.srt_file_path, "w", encoding='utf-8', errors='ignore') as srt_file:
-            srt_file.write("1\n")
-            srt_file.write("00:00:00,000 --> {:02d}:{:02d}:{:02d},{:03d}\n".format(int(duration // 3600),
-                                                                                int((duration % 3600) // 60),
-                                                                                int(duration % 60),
-                                                                                int((duration % 1) * 1000)))
-            if all(u'\u4e00' <= char <= u'\u9fff' for char in filtered_text):
-                srt_file.write("{}\n\n".format(filtered_text))
-            else:
-                srt_file.write("{}\n\n".format(self.text))
-
-    def recognize_and_save_as_srt(self):
+    # 长音频按固定时长切分后并发识别并保存为 srt
+    def recognize_chunks_and_save_as_srt(self, chunk_seconds: float = 60, workers: int = 4, timeout=None):
         self.extract_audio()
-        self.create_speech_recognizer()
-        self.speech_recognizer.start_continuous_recognition()
-        while not self.done:
-            time.sleep(.5)
-        self.speech_recognizer.stop_continuous_recognition()
-        self.filter_srt()        
-
+        chunk_dir = os.path.splitext(self.audio_file_path)[0] + "_chunks"
+        chunk_files = split_wav_file(self.audio_file_path, chunk_dir, chunk_seconds)
+        try:
+            self.recognize_files_and_save_as_srt(chunk_files, workers, timeout)
+        finally:
+            shutil.rmtree(chunk_dir, ignore_errors=True)
+
+
+# wav 文件按固定时长切分（不重新编码），返回切分后的文件列表
+def split_wav_file(wav_file_path: str, output_dir: str, chunk_seconds: float = 60) -> list:
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    chunk_files = []
+    with wave.open(wav_file_path, 'rb') as w:
+        params = w.getparams()
+        frames_per_chunk = max(1, int(chunk_seconds * params.framerate))
+        while True:
+            data = w.readframes(frames_per_chunk)
+            if len(data) == 0:
+                break
+            chunk_file = os.path.join(output_dir, "{:04d}.wav".format(len(chunk_files))).replace("\\", "/")
+            with wave.open(chunk_file, 'wb') as out:
+                out.setparams(params)
+                out.writeframes(data)
+            chunk_files.append(chunk_file)
+    return chunk_files
@@ -25,12 +25,9 @@ import shutil
 import time
 import datetime
 import random
+import argparse
 
-import pyttsx3
-import win32gui, win32ui, win32con, win32api
 from PIL import Image
-from pydub import AudioSegment
-import azure.cognitiveservices.speech as speechsdk
 
 from VideoMake.util import *
 import VideoMake.util as util
@@ -44,6 +41,24 @@ from VideoMake.video import *
 import VideoMake.video as video
 from VideoMake.voice import *
 import VideoMake.voice  as voice
+from VideoMake.scheduler import *
+import VideoMake.scheduler as scheduler
+from VideoMake.build import *
+import VideoMake.build as build
+from VideoMake.encode import *
+import VideoMake.encode as encode
+from VideoMake.tts import *
+import VideoMake.tts as tts
+from VideoMake.subtitle import *
+import VideoMake.subtitle as subtitle
+from VideoMake.project import *
+import VideoMake.project as project
+from VideoMake.render import *
+import VideoMake.render as render
+from VideoMake.ffmpeg import *
+import VideoMake.ffmpeg as ffmpeg
+from VideoMake.trace import *
+import VideoMake.trace as trace
 
 
 
@@ -143,7 +158,8 @@ voice_text_XX.txt：视频中语音内容的文本内容
 第五步：生成视频中的语音字幕
 
 这一步骤主要是需要生成语音字幕，可以调用某些字幕工具，或者自己把上面生成视频导入进去出字幕srt文件。
-（这一步目前实现了字幕内容还原，但是时间轴无法对齐，会导致显示的时候字幕挤在一起）
+（语音识别只能还原字幕内容，时间轴无法对齐，会导致显示的时候字幕挤在一起）
+现在语音合成时会记录每个句子、每个词的时间，自动生成时间轴对齐的字幕 input/srt/tts.srt，没有手工准备 input/srt/final.srt 时最终视频直接使用这个字幕。
 
 备注：如果想要生成更好的字幕，推荐比如“剪影”等视频剪辑工具，可以导出语音中的字幕，可以对应到时间轴。
 
@@ -157,164 +173,107 @@ voice_text_XX.txt：视频中语音内容的文本内容
 # 第0步：设置一些基本配置信息
 G_OUTPUT_BASE_VIDEO_NAME    = 'base'    # 基本视频文件名
 G_OUTPUT_FINAL_VIDEO_NAME   = 'final'   # 最终生成的视频文件名
+G_OUTPUT_TTS_SRT_NAME       = 'tts'     # 根据语音合成时间生成的字幕文件名 input/srt/tts.srt
 
 '''
-分段完成配置
+增量构建说明
 #
-想要生成那个环节就开启设置为True，如果有些步骤已经生成了，可以设置为True，然后跳过这些步骤，直接从下一步开始，
-如果是调试使用，建议一步步进行，从上到下开启True，这样可以保证每个步骤都是正常的。
+每个产物（语音wav、显示图片png、分段视频、基本视频、字幕、最终视频）都会记录它的输入文件内容哈希和参数，
+保存在 input/.build_state.json 中，每次运行只会重新生成输入有变化的产物，没有变化的步骤会直接跳过，
+比如只修改了 video_text_02.txt，就只会重新生成 02 的图片、02 的分段视频、基本视频和最终视频。
+所有产物先写入 .part 临时文件，成功后再替换，中途中断后重新运行会从中断的位置继续。
+如果需要全部重新生成，使用命令行参数 --force
 '''
-G_IS_MAKE_TEXT_VOICE        = False        # 第二步：是否生成语音内容
-G_IS_MAKE_IMG_FILES         = False        # 第三步：是否生成视频中的显示内容
-G_IS_MAKE_BASE_VIDEO        = False        # 第四步：是否生成基本视频
-G_IS_MAKE_RAW_SRT_FILE      = False        # 第五步：是否生成字幕文件（目前功能效果不好，测试可以用，推荐关闭）
-G_IS_MAKE_FINAL_VIDEO       = False        # 第六步：是否生成最终视频（如果第五步字幕没有，本步骤可以跳过关闭）
-
-
-
-
-#  第一步：检测输入的原始文件是否准备好，设置基本输出信息
-dnames = util.check_input_files()
-# print(dnames)
-
-# 第二步：生成视频中的语音内容
-'''
-说明：本步骤主要是按照 input 目录中输入的 voice_text_XX.txt 文件，生成对应的语音内容文件，保存到 output 目录中。
-'''
-if G_IS_MAKE_TEXT_VOICE == True:
-    for num in dnames:
-        
-        fname = dnames[num][VOICE_TEXT_FILE]
-        input_text_file = INPUT_ROOT_PATH  + fname
-        # output_wav_file = OUTPUT_ROOT_PATH + num +''+ WAV_SUFFIX  #fname.replace(TEXT_SUFFIX, WAV_SUFFIX)
-        output_wav_file = get_output_wav_file_path(num)
-        output_mp3_file = get_output_mp3_file_path(num)
-
-        # print(input_text_file)
-        # print(output_wav_file)
-        # print(output_mp3_file)
-
-        # 文字转音频
-        synthesize_text_to_voice(
-            input_text_file=input_text_file,
-            output_wav_file=output_wav_file,
-            is_output_mp3=False,
-            output_mp3_file=output_mp3_file,
-            is_play=False
-        )
-        
-        # 等待几秒再生成下一个
-        sed = random.randint(5, 10)
-        time.sleep(sed)
-
-
-# 第三步：生成视频中的显示内容（生成图片）
-'''
-说明：
-本步骤是比较复杂的，要求 input 目录中提供好对应视频背景图片、还有对应要显示内容到背景图的文本文件、还有视频中语音内容的文本文件，对应编号要一致。
-比如：video_bg_01.png、video_text_01.txt、voice_text_01.txt，这三个文件的编号都是01，这样才能对应上。（文件前缀名必须一致，然后每个文件内容相关的编号必须一致）
-
-video_bg_XX.png：视频背景图
-video_text_XX.txt：视频中显示的文本内容
-voice_text_XX.txt：视频中语音内容的文本内容
-'''
-if G_IS_MAKE_IMG_FILES == True:
-    total_num = len(dnames)
-    for num in dnames:
-        num_int = int(num)
-
-        # fname = 
-        bg_img_file = INPUT_ROOT_PATH  + dnames[num][VIDEO_BG_FILE]
-        input_text_file = get_input_text_file_path(dnames[num][VIDEO_TEXT_FILE])
-        output_img_file = get_output_img_file_path(num)
-
-        # print(bg_img_file)
-        # print(input_text_file)
-        # print(output_img_file)
-
-        # 第一页
-        if num_int == 1:
-            draw_first_page(input_text_file, output_img_file, bg_img_file)
-        # 尾页
-        elif num_int == total_num:
-            draw_end_page(input_text_file, output_img_file, bg_img_file)
-        # 内容页
-        else:
-            draw_contents_page(input_text_file, output_img_file, bg_img_file)
-        
-    print("Image file generated: {}".format(output_img_file))
-
-
-# 第四步：生成基本视频
-'''
-说明：
-本步骤主要是按照生成视频所有需要的图片，然后图片合并成为视频，然后再合并上对应的语音内容，生成最终的视频。
-'''
-if G_IS_MAKE_BASE_VIDEO == True:
-    total_num = len(dnames)
-    input_video_list = []
-    for num in dnames:
-        num_int = int(num)
-
-        # 视频图片帧率（如果不怎动，推荐设置为2，如果语音太长，设置为1帧也可以，生成速度会大幅提高）
-        fps = 1
-
-        # 获取各个需要的文件和目录
-        img_dir = get_batch_img_dir_path(num)
-        audio_file = get_output_wav_file_path(num)
-        src_img_file = get_output_img_file_path(num)
-        input_video_file = get_input_video_file_path(num)
-
-        if os.path.exists(audio_file) is False:
-            raise Exception("Audio file not found: {}".format(audio_file))
-        if os.path.exists(src_img_file) is False:
-            raise Exception("Image file not found: {}".format(src_img_file))
-        
-        #生成构建视频需要的图片
-        make_img_from_audio(audio_file, src_img_file, img_dir, fps)
-
-        #图片生成视频 img_path, output_path, audio_path, fps
-        images_to_video(img_dir, input_video_file, audio_file, fps)
-
-        #构建视频列表
-        input_video_list.append(input_video_file)
-
-    # print(input_video_list)
-    # 合并视频 get_output_video_file_path
-    merge_videos(input_video_list, get_output_video_file_path(G_OUTPUT_BASE_VIDEO_NAME), get_input_video_list_file_path())
-
-    print("Base video file generated: {}".format(get_output_video_file_path(G_OUTPUT_BASE_VIDEO_NAME)))
-
-
-
-# 第五步：生成视频中的语音字幕
-'''
-说明：
-调用语音引擎，把视频中的语音内容识别成为字幕文件，保存为 srt 格式的字幕文件（目前效果不好，推荐关闭）
-'''
-if G_IS_MAKE_RAW_SRT_FILE == True:
-    # 设置 API 密钥和服务区域
-    speech_key = get_tts_key('subscription')
-    service_region = get_tts_key('region')
-
-    # 准备视频文件路径和音频输出文件路径
-    video_file_path = get_output_video_file_path(G_OUTPUT_BASE_VIDEO_NAME)
-    srt_file_path = get_input_srt_file_path(G_OUTPUT_BASE_VIDEO_NAME)
-    srt_audio_file_path = get_input_srt_audio_file_path(G_OUTPUT_BASE_VIDEO_NAME)
-
-    stt = SpeechToText(speech_key, service_region, video_file_path, srt_audio_file_path, srt_file_path)
-    stt.recognize_and_save_as_srt()
-    # print(stt.text)
-    print("Raw srt file generated: {}".format(srt_file_path))
-
-
-
-# 第六步：合并视频和语音字幕，生成最终视频
-if G_IS_MAKE_FINAL_VIDEO == True:
-    # 合并视频和字幕
-    merge_video_srt(get_output_video_file_path(G_OUTPUT_BASE_VIDEO_NAME), 
-                    get_input_srt_file_path(G_OUTPUT_FINAL_VIDEO_NAME), 
-                    get_output_video_file_path(G_OUTPUT_FINAL_VIDEO_NAME)
-    )
-    print("Final video file generated: {}".format(get_output_video_file_path(G_OUTPUT_FINAL_VIDEO_NAME)))
-
+G_IS_MAKE_TTS_SRT_FILE      = True         # 第五步：是否根据语音合成时记录的句子/词时间生成字幕 input/srt/tts.srt（没有手工准备 input/srt/final.srt 时最终视频使用这个字幕，可用命令行 --no-tts-srt 关闭）
+G_IS_MAKE_RAW_SRT_FILE      = False        # 第五步：是否根据分段语音文件生成字幕文件 input/srt/base.srt（用于不是本程序合成的音频，比如录制的配音，可用命令行 --align / --stt 开启）
+G_RAW_SRT_METHOD            = 'align'      # 第五步：base.srt 的生成方法 align（离线分析音频停顿，把语音文本按句子对齐到音频上，不需要网络）/ stt（语音识别，目前效果不好）
+G_IS_KEEP_BASE_VIDEO        = False        # 第四步：是否生成中间视频 output/base.mp4（有字幕时最终视频由分段视频和字幕一次编码生成，不需要，可用命令行 --keep-base 开启）
+G_IS_SAVE_IMG_FILES         = False        # 第三步：是否保存显示图片 input/img/XX.png（调试用，视频编码直接使用内存中的图片，可用命令行 --save-images 开启）
+
+G_VOICE_NAME                = 'zh-CN-YunzeNeural'   # 第二步：语音合成使用的声音（参考 defined.VOICE_TYPE_NAME）
+G_TTS_BACKEND               = 'azure'      # 第二步：语音合成后端 azure（在线）/ pyttsx3（本地离线引擎，不需要网络，适合草稿和测试，可用命令行 --tts-backend 覆盖）
+G_TTS_WORKERS               = 4            # 第二步：同时进行的语音合成数量
+G_TTS_REQUESTS_PER_SECOND   = 0.3          # 第二步：每秒最多合成请求数（Azure F0免费账号约20次/分钟，付费账号可以调大），0表示不限
+G_TTS_CHARS_PER_MINUTE      = 0            # 第二步：每分钟最多合成字符数，0表示不限
+G_STT_WORKERS               = 4            # 第五步：同时识别的分段语音数量
+G_VIDEO_FPS                 = 1            # 第四步：视频图片帧率（静态画面，1帧即可）
+G_ENCODE_PROFILE            = 'standard'   # 第四步：视频编码配置 draft / standard / archive（参考 encode.ENCODE_PROFILES，可用 python -m VideoMake.encode 自动测试选择）
+G_RENDER_JOBS               = 0            # 第四步：同时渲染的分段视频数量，0表示使用CPU核数（可用命令行 --jobs 覆盖）
+G_IS_PIPELINE               = True         # 第二步~第四步：流水线方式生成，每个分段合成语音后立即绘图、编码，不等其他分段（可用命令行 --no-pipeline 关闭）
+
+G_IS_LINE_MARKERS           = False        # 第三步：解析显示文本行首的 "# " 标题、"## " 小标题、"- " 列表项标记（默认关闭，按原文字显示；可用命令行 --line-markers 开启）
+
+# 绘图使用 spawn 方式启动的进程池，子进程会重新导入本脚本，生成流程只在主进程中运行
+if __name__ == "__main__":
+    # 命令行参数
+    parser = argparse.ArgumentParser(description="Black-Video-Make")
+    parser.add_argument("--jobs", type=int, default=G_RENDER_JOBS, help="number of segments rendered in parallel (0 = cpu count)")
+    parser.add_argument("--tts-backend", default=G_TTS_BACKEND, choices=list(TTS_BACKENDS), help="speech synthesis backend")
+    parser.add_argument("--tts-workers", type=int, default=G_TTS_WORKERS, help="number of concurrent speech syntheses")
+    parser.add_argument("--tts-rps", type=float, default=G_TTS_REQUESTS_PER_SECOND, help="speech synthesis requests per second (0 = unlimited)")
+    parser.add_argument("--tts-cpm", type=float, default=G_TTS_CHARS_PER_MINUTE, help="speech synthesis characters per minute (0 = unlimited)")
+    parser.add_argument("--profile", default=G_ENCODE_PROFILE, choices=list(ENCODE_PROFILES), help="video encoding profile")
+    parser.add_argument("--no-tts-srt", action="store_false", dest="tts_srt", default=G_IS_MAKE_TTS_SRT_FILE, help="do not generate subtitles from speech synthesis timings")
+    parser.add_argument("--align", action="store_true", help="generate raw srt file by aligning voice text to the audio offline")
+    parser.add_argument("--stt", action="store_true", help="generate raw srt file by speech recognition")
+    parser.add_argument("--stt-workers", type=int, default=G_STT_WORKERS, help="number of segments recognized concurrently")
+    parser.add_argument("--save-images", action="store_true", default=G_IS_SAVE_IMG_FILES, help="also save rendered slides to input/img/ for debugging")
+    parser.add_argument("--keep-base", action="store_true", default=G_IS_KEEP_BASE_VIDEO, help="also write the intermediate output/base.mp4")
+    parser.add_argument("--force", action="store_true", help="rebuild all files even if inputs are unchanged")
+    parser.add_argument("--rescan", action="store_true", help="scan and hash all input files again instead of using the project manifest")
+    parser.add_argument("--no-pipeline", action="store_false", dest="pipeline", default=G_IS_PIPELINE, help="finish each stage for all segments before starting the next one")
+    parser.add_argument("--line-markers", action="store_true", default=G_IS_LINE_MARKERS, help='style slide lines starting with "# ", "## " or "- " as title, subtitle or bullet')
+    parser.add_argument("--trace", default='', help="record timing spans and save them as a Chrome trace file (same as env VIDEOMAKE_TRACE)")
+    args = parser.parse_args()
+    if args.trace:
+        enable_trace(args.trace)
+    G_RENDER_JOBS = get_render_jobs(args.jobs)
+    G_TTS_BACKEND = args.tts_backend
+    G_TTS_WORKERS = args.tts_workers
+    G_TTS_REQUESTS_PER_SECOND = args.tts_rps
+    G_TTS_CHARS_PER_MINUTE = args.tts_cpm
+    G_IS_MAKE_TTS_SRT_FILE = args.tts_srt
+    if args.align or args.stt:
+        G_IS_MAKE_RAW_SRT_FILE = True
+        G_RAW_SRT_METHOD = 'stt' if args.stt else 'align'
+    G_STT_WORKERS = args.stt_workers
+    G_IS_SAVE_IMG_FILES = args.save_images
+    G_IS_KEEP_BASE_VIDEO = args.keep_base
+    G_ENCODE_PROFILE = args.profile
+    G_IS_PIPELINE = args.pipeline
+    G_IS_LINE_MARKERS = args.line_markers
+
+
+
+    #  第一步 ~ 第六步：生成流程在 VideoMake/render.py 中（渲染服务 python -m VideoMake.daemon 使用同一个流程）
+    '''
+    第一步：检测输入的原始文件是否准备好（项目清单 input/.project_manifest.json），登记所有需要生成的产物
+    第二步：生成视频中的语音内容，按照 input 目录中输入的 voice_text_XX.txt 文件并发合成，由令牌桶限流，服务限流/取消时自动退避重试
+    第三步：生成视频中的显示内容，只有开启 G_IS_SAVE_IMG_FILES（--save-images）时才会保存图片文件用于调试
+    第四步：各分段视频并行生成（显示图片在内存中生成，通过管道直接输入ffmpeg，保持到音频结束）
+    第五步：根据语音合成时记录的句子/词时间生成字幕；可选根据分段语音文件离线对齐（align）或者语音识别（stt）生成 base.srt
+    第六步：分段视频通过 concat 读取后直接叠加字幕编码一次生成最终视频，不需要先生成 base.mp4 再重新编码
+    '''
+    render_project({
+        "base_video_name": G_OUTPUT_BASE_VIDEO_NAME,
+        "final_video_name": G_OUTPUT_FINAL_VIDEO_NAME,
+        "tts_srt_name": G_OUTPUT_TTS_SRT_NAME,
+        "make_tts_srt": G_IS_MAKE_TTS_SRT_FILE,
+        "make_raw_srt": G_IS_MAKE_RAW_SRT_FILE,
+        "raw_srt_method": G_RAW_SRT_METHOD,
+        "keep_base_video": G_IS_KEEP_BASE_VIDEO,
+        "save_images": G_IS_SAVE_IMG_FILES,
+        "voice_name": G_VOICE_NAME,
+        "tts_backend": G_TTS_BACKEND,
+        "tts_workers": G_TTS_WORKERS,
+        "tts_rps": G_TTS_REQUESTS_PER_SECOND,
+        "tts_cpm": G_TTS_CHARS_PER_MINUTE,
+        "stt_workers": G_STT_WORKERS,
+        "video_fps": G_VIDEO_FPS,
+        "encode_profile": G_ENCODE_PROFILE,
+        "render_jobs": G_RENDER_JOBS,
+        "pipeline": G_IS_PIPELINE,
+        "line_markers": G_IS_LINE_MARKERS,
+        "force": args.force,
+        "rescan": args.rescan,
+    })